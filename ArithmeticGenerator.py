@@ -0,0 +1,162 @@
+import random
+from collections.abc import Sequence
+from question.AutoMarkedQuestion import ArithmeticQuestion
+
+
+class ArithmeticTemplate:
+    """A pattern for arithmetic questions such as  a+b  with a and b from 1 to 100
+
+    first and second are the inclusive ranges of the two numbers. For - and ÷ the first range is the range of the
+    answer instead, and the first number is worked out from it, so that answers are never negative and divisions
+    always come out exact. Every pair of numbers the template allows is numbered from 0 to size - 1."""
+
+    OPERATORS = {'+': '+', '-': '-', '×': '×', '*': '×', 'x': '×', '÷': '÷', '/': '÷'}
+
+    def __init__(self, operator, first=(1, 100), second=(1, 100), tags=(), points=10):
+        if operator not in ArithmeticTemplate.OPERATORS:
+            raise ValueError('unknown operator {!r}'.format(operator))
+        self.operator = ArithmeticTemplate.OPERATORS[operator]
+        self.first = first
+        self.second = second
+        self.tags = list(tags)
+        self.points = points
+        if self.operator == '÷' and second[0] <= 0 <= second[1]:
+            raise ValueError('can\'t divide by a range that includes 0')
+        self.size = (first[1] - first[0] + 1) * (second[1] - second[0] + 1)
+        if self.size <= 0:
+            raise ValueError('the ranges are empty')
+
+    def numbers(self, number):
+        """Returns the two numbers of the template's question with this number"""
+        answer, second = divmod(number, self.second[1] - self.second[0] + 1)
+        answer += self.first[0]
+        second += self.second[0]
+        if self.operator == '-':
+            return answer + second, second
+        if self.operator == '÷':
+            return answer * second, second
+        return answer, second
+
+    def question(self, number):
+        first, second = self.numbers(number)
+        return ArithmeticQuestion('{}{}{}'.format(first, self.operator, second),
+                                  str(ArithmeticTemplate.calculate(first, self.operator, second)),
+                                  self.tags, self.points)
+
+    @staticmethod
+    def calculate(first, operator, second):
+        """Static method that works out first operator second, which for ÷ has to divide exactly"""
+        if operator == '+':
+            return first + second
+        if operator == '-':
+            return first - second
+        if operator == '×':
+            return first * second
+        quotient, remainder = divmod(first, second)
+        if remainder:
+            raise ValueError('{} doesn\'t divide exactly by {}'.format(first, second))
+        return quotient
+
+
+class NoCarryTemplate(ArithmeticTemplate):
+    """A template for questions that can be worked out a column at a time without carrying or borrowing
+
+    The numbers have up to digits digits. For + no column adds up to more than 9, for - no column borrows, and for
+    × the second number is a single digit that doesn't take any digit of the first past 9. The questions are
+    numbered a digit at a time, so only the pairs that don't carry are ever made."""
+
+    def __init__(self, operator, digits=2, tags=(), points=10):
+        operator = ArithmeticTemplate.OPERATORS.get(operator, operator)
+        if operator not in ('+', '-', '×'):
+            raise ValueError('questions with {!r} can\'t be made without carrying'.format(operator))
+        super().__init__(operator, (0, 10 ** digits - 1), (0, 10 ** digits - 1), tags, points)
+        self.digits = digits
+
+        if operator == '×':
+            # for each single digit multiplier, how many choices there are for each digit of the first number
+            self.columns = None
+            self.choices = [(multiplier, 9 // multiplier + 1) for multiplier in range(1, 10)]
+            self.size = sum(count ** digits for multiplier, count in self.choices)
+        else:
+            # the pairs of digits a column can have
+            self.columns = [(top, bottom) for top in range(10) for bottom in range(10)
+                            if (top + bottom <= 9 if operator == '+' else top >= bottom)]
+            self.size = len(self.columns) ** digits
+
+    def numbers(self, number):
+        if self.columns is not None:
+            first = second = 0
+            for column in range(self.digits):
+                number, pair = divmod(number, len(self.columns))
+                top, bottom = self.columns[pair]
+                first += top * 10 ** column
+                second += bottom * 10 ** column
+            return first, second
+
+        for multiplier, count in self.choices:
+            if number < count ** self.digits:
+                first = 0
+                for column in range(self.digits):
+                    number, digit = divmod(number, count)
+                    first += digit * 10 ** column
+                return first, multiplier
+            number -= count ** self.digits
+        raise IndexError('question number out of range')
+
+
+class ArithmeticGenerator(Sequence):
+    """Every question an ArithmeticTemplate allows, in a shuffled order given by a seed
+
+    Nothing is stored. The question at an index is made when it's asked for, by shuffling the index with a keyed
+    Feistel permutation of 0 to size - 1 and making the template's question with that number. As the permutation
+    is one to one no two indexes give the same question, and the same template, seed and index always give the
+    same question again. Each question made gets a new ident, so regenerate it from its seed and index
+    rather than looking it up by ident."""
+
+    ROUNDS = 4
+
+    def __init__(self, template, seed=0):
+        self.template = template
+        self.seed = seed
+        # the permutation works on numbers of an even number of bits, and skips any it makes that are too big
+        self.__bits = max(2, (template.size - 1).bit_length() + 1) & ~1
+        self.__half = self.__bits // 2
+        self.__mask = (1 << self.__half) - 1
+        generator = random.Random(seed)
+        self.__keys = [generator.getrandbits(64) for round in range(ArithmeticGenerator.ROUNDS)]
+
+    def __len__(self):
+        return self.template.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.template.question(self.number(index))
+
+    def __iter__(self):
+        return self.questions()
+
+    def questions(self, start=0, stop=None):
+        """Yields the questions from start up to stop, or to the end"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for index in range(start, stop):
+            yield self.template.question(self.number(index))
+
+    def number(self, index):
+        """Returns the template's question number at this index"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('question index out of range')
+        number = self.__permute(index)
+        # at most 4 times as many numbers as questions, so few steps are needed to get back in range
+        while number >= self.template.size:
+            number = self.__permute(number)
+        return number
+
+    def __permute(self, number):
+        left, right = number >> self.__half, number & self.__mask
+        for key in self.__keys:
+            left, right = right, left ^ (((right * 0x9E3779B97F4A7C15 + key) >> 17 ^ right) * 0xBF58476D1CE4E5B9
+                                         >> 29 & self.__mask)
+        return left << self.__half | right
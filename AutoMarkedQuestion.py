@@ -3,6 +3,7 @@ from question.Question import Question
 
 class AutoMarkedQuestion(Question):
     """A Question that can be marked automatically"""
+    __slots__ = ()
 
     # Factory style method that determines and creates the correct type of child object from its input
     @staticmethod
@@ -20,6 +21,8 @@ class AutoMarkedQuestion(Question):
 
 class ArithmeticQuestion(AutoMarkedQuestion):
     """An Arithmetic Question"""
+    __slots__ = ()
+
     def __init__(self, question, answer, tags, points):
         super().__init__(question, answer, tags, points)
 
@@ -27,24 +30,55 @@ class ArithmeticQuestion(AutoMarkedQuestion):
 class ReorderQuestion(AutoMarkedQuestion):
     """A Reorder Question"""
     # Not required for cw1
-    pass
+    __slots__ = ()
 
 
 class MultipleAnswerQuestion(AutoMarkedQuestion):
-    """A Multiple Answer Question"""
+    """A Multiple Answer Question
+
+    choices are given either as a dictionary of letter -> choice or as a list of choices, lettered a, b, c...
+    in order. They're kept as a tuple of (letter, choice) pairs or a tuple of choices respectively."""
+    __slots__ = ('choices',)
+
     def __init__(self, question, answer, tags, points, choices):
-        self.choices = choices
+        self.choices = MultipleAnswerQuestion.freezeChoices(choices)
         super().__init__(question, answer, tags, points)
 
+    def __setstate__(self, state):
+        if isinstance(state, dict) and 'choices' in state:
+            state['choices'] = MultipleAnswerQuestion.freezeChoices(state['choices'])
+        super().__setstate__(state)
+
     def getNumCorrectAnswers(self):
         return len(self._answer)
 
+    def getChoices(self):
+        """Returns a list of (letter, choice) pairs, however the choices were given"""
+        if self.choices and isinstance(self.choices[0], tuple):
+            return list(self.choices)
+        return [(chr(ord('a') + i), choice) for i, choice in enumerate(self.choices)]
+
+    def fingerprint(self):
+        # hashed as the dictionary or list they were given as, so fingerprints saved before choices were tuples match
+        choices = self.choices
+        if choices and isinstance(choices[0], tuple):
+            choices = dict(choices)
+        return Question.hashContent(type(self).__name__, self._question, self._answer, self._tags, choices)
+
+    @staticmethod
+    def freezeChoices(choices):
+        """Static method that turns a dictionary of choices into a tuple of (letter, choice) pairs
+        and a list of choices into a tuple"""
+        if isinstance(choices, dict):
+            return tuple(choices.items())
+        return tuple(choices)
+
 
 class MultipleChoiceQuestion(MultipleAnswerQuestion):
     """Multiple Choice Question"""
-    pass
+    __slots__ = ()
 
 
 class TrueFalseQuestion(MultipleAnswerQuestion):
     """True or False Question"""
-    pass
\ No newline at end of file
+    __slots__ = ()
\ No newline at end of file
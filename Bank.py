@@ -0,0 +1,59 @@
+from question.Writer import BackgroundWriter
+
+
+class FingerprintedCollection:
+    """Mixin for a collection keeping an index of content fingerprint -> ident, so that an item duplicating
+    the content of another can be turned away
+
+    The collection gives its dictionary of ident -> item from getItems and the fingerprint index from
+    getFingerprints. Items have an ident and a fingerprint method."""
+
+    def findDuplicate(self, item, fingerprint):
+        """Returns the other item with the same content as item, or None if there isn't one"""
+        ident = self.getFingerprints().get(fingerprint)
+        if ident is None or ident == item.ident:
+            return None
+
+        # the entry is stale if the other item has been changed in place since it was indexed
+        other = self.getItems().get(ident)
+        if other is not None and other.fingerprint() == fingerprint:
+            return other
+        return None
+
+    def indexFingerprint(self, item, fingerprint):
+        if self.findDuplicate(item, fingerprint) is None:
+            self.getFingerprints()[fingerprint] = item.ident
+
+    def unindexFingerprint(self, item):
+        fingerprint = item.fingerprint()
+        if self.getFingerprints().get(fingerprint) == item.ident:
+            del self.getFingerprints()[fingerprint]
+
+
+class StoredBank:
+    """Mixin for a bank that saves itself through the storage in its class attribute storage
+
+    Changes hold the storage's lock, so that a save running in the background sees a consistent bank,
+    and are staged with the storage so that it only has to write what changed."""
+
+    def add(self, item):
+        with type(self).storage.lock:
+            if super().add(item):
+                type(self).storage.stage(item)
+                return True
+            return False
+
+    def remove(self, ident):
+        with type(self).storage.lock:
+            item = super().remove(ident)
+            if item is not None:
+                type(self).storage.stageRemoval(ident)
+            return item
+
+    def save(self):
+        # written on a background thread so the ui never waits on the disk, use flush to wait for it
+        BackgroundWriter.forStorage(type(self).storage).save(self)
+
+    def flush(self, timeout=None):
+        """Wait until every save so far is on disk"""
+        return BackgroundWriter.forStorage(type(self).storage).flush(timeout)
@@ -0,0 +1,306 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    # the aggregations fall back to plain Python
+    numpy = None
+
+
+class QuestionColumns:
+    """A column by column copy of the questions' idents, points, types and tags, for aggregate queries
+
+    Each question is a row. Points, type codes and whether the row is still alive are arrays, and tags are kept
+    like a sparse matrix: tagIds holds every row's tag numbers one after another, and row i's tags are
+    tagIds[tagStarts[i]:tagStarts[i + 1]]. Removing a question only marks its row dead, and the rows are
+    compacted once more than half of them are dead.
+    When numpy is installed the aggregations run on numpy views of the arrays, otherwise they run in plain Python.
+
+    The columns can be saved to a file and opened again with mmap, so that several processes share the one copy
+    in the page cache. Opened columns are read only."""
+
+    MAGIC = b'MZCOL1\n'
+    # rows, tag entries, then the offset of each section and the length of the names
+    HEADER = struct.Struct('<QQQQQQQQQQ')
+    POINTS = 'i'
+    TYPES = 'B'
+    ALIVE = 'B'
+    OFFSETS = 'Q'
+    TAG_IDS = 'I'
+
+    def __init__(self):
+        self.idents = []
+        self.points = array(QuestionColumns.POINTS)
+        self.types = array(QuestionColumns.TYPES)
+        self.alive = array(QuestionColumns.ALIVE)
+        self.tagStarts = array(QuestionColumns.OFFSETS, [0])
+        self.tagIds = array(QuestionColumns.TAG_IDS)
+        self.tagNames = []
+        self.typeNames = []
+        self.readOnly = False
+        self.__rows = {}
+        self.__tagNumbers = {}
+        self.__typeNumbers = {}
+        self.__dead = 0
+        self.__mapped = None
+
+    @classmethod
+    def fromQuestions(cls, questions):
+        columns = cls()
+        for question in questions:
+            columns.add(question)
+        return columns
+
+    def __len__(self):
+        return len(self.__rows)
+
+    def add(self, question):
+        self.__checkWritable()
+        if question.ident in self.__rows:
+            self.remove(question.ident)
+
+        self.__rows[question.ident] = len(self.idents)
+        self.idents.append(question.ident)
+        self.points.append(QuestionColumns.pointsOf(question))
+        self.types.append(QuestionColumns.__number(type(question).__name__, self.typeNames, self.__typeNumbers))
+        self.alive.append(1)
+        self.tagIds.extend(QuestionColumns.__number(tag, self.tagNames, self.__tagNumbers)
+                           for tag in dict.fromkeys(question.getTags()))
+        self.tagStarts.append(len(self.tagIds))
+
+    def remove(self, ident):
+        self.__checkWritable()
+        row = self.__rows.pop(ident, None)
+        if row is None:
+            return
+        self.alive[row] = 0
+        self.__dead += 1
+        if self.__dead * 2 > len(self.idents):
+            self.compact()
+
+    def compact(self):
+        """Rebuild the columns without the rows of removed questions"""
+        self.__checkWritable()
+        rows = [row for row in range(len(self.idents)) if self.alive[row]]
+        tagIds = array(QuestionColumns.TAG_IDS)
+        tagStarts = array(QuestionColumns.OFFSETS, [0])
+        for row in rows:
+            tagIds.extend(self.tagIds[self.tagStarts[row]:self.tagStarts[row + 1]])
+            tagStarts.append(len(tagIds))
+
+        self.idents = [self.idents[row] for row in rows]
+        self.points = array(QuestionColumns.POINTS, (self.points[row] for row in rows))
+        self.types = array(QuestionColumns.TYPES, (self.types[row] for row in rows))
+        self.alive = array(QuestionColumns.ALIVE, [1]) * len(rows)
+        self.tagIds = tagIds
+        self.tagStarts = tagStarts
+        self.__rows = {ident: row for row, ident in enumerate(self.idents)}
+        self.__dead = 0
+
+    def countByTag(self):
+        """Returns a dictionary of tag -> number of questions with that tag"""
+        if numpy is not None:
+            counts = numpy.bincount(self.__numpyTagIds(), minlength=len(self.tagNames))
+            return {tag: int(count) for tag, count in zip(self.tagNames, counts) if count}
+
+        counts = {}
+        for row, tagId in self.__tagEntries():
+            tag = self.tagNames[tagId]
+            counts[tag] = counts.get(tag, 0) + 1
+        return counts
+
+    def pointsByTag(self):
+        """Returns a dictionary of tag -> total points of the questions with that tag"""
+        if numpy is not None:
+            rows, tagIds = self.__numpyTagEntries()
+            points = numpy.frombuffer(self.points, dtype=numpy.int32)[rows]
+            totals = numpy.bincount(tagIds, weights=points, minlength=len(self.tagNames))
+            counts = numpy.bincount(tagIds, minlength=len(self.tagNames))
+            return {tag: int(total) for tag, total, count in zip(self.tagNames, totals, counts) if count}
+
+        totals = {}
+        for row, tagId in self.__tagEntries():
+            tag = self.tagNames[tagId]
+            totals[tag] = totals.get(tag, 0) + self.points[row]
+        return totals
+
+    def countByType(self):
+        """Returns a dictionary of question type name -> number of questions of that type"""
+        if numpy is not None:
+            types = numpy.frombuffer(self.types, dtype=numpy.uint8)[self.__numpyAlive()]
+            counts = numpy.bincount(types, minlength=len(self.typeNames))
+            return {name: int(count) for name, count in zip(self.typeNames, counts) if count}
+
+        counts = {}
+        for code, alive in zip(self.types, self.alive):
+            if alive:
+                counts[self.typeNames[code]] = counts.get(self.typeNames[code], 0) + 1
+        return counts
+
+    def pointsDistribution(self):
+        """Returns a dictionary of points -> number of questions worth that many, in order of points"""
+        if numpy is not None:
+            points = numpy.frombuffer(self.points, dtype=numpy.int32)[self.__numpyAlive()]
+            values, counts = numpy.unique(points, return_counts=True)
+            return {int(value): int(count) for value, count in zip(values, counts)}
+
+        counts = {}
+        for points, alive in zip(self.points, self.alive):
+            if alive:
+                counts[points] = counts.get(points, 0) + 1
+        return dict(sorted(counts.items()))
+
+    def filter(self, tags=(), typeName=None, minPoints=None, maxPoints=None):
+        """Returns the idents of the questions with all of tags, of the given type and with points in the range"""
+        tagIds = set()
+        for tag in tags:
+            if tag not in self.__tagNumbers:
+                return []
+            tagIds.add(self.__tagNumbers[tag])
+        if typeName is not None and typeName not in self.__typeNumbers:
+            return []
+
+        if numpy is not None:
+            mask = self.__numpyAlive().copy()
+            points = numpy.frombuffer(self.points, dtype=numpy.int32)
+            if minPoints is not None:
+                mask &= points >= minPoints
+            if maxPoints is not None:
+                mask &= points <= maxPoints
+            if typeName is not None:
+                mask &= numpy.frombuffer(self.types, dtype=numpy.uint8) == self.__typeNumbers[typeName]
+            if tagIds:
+                rows, entries = self.__numpyTagEntries(alive=False)
+                for tagId in tagIds:
+                    tagged = numpy.zeros(len(mask), dtype=bool)
+                    tagged[rows[entries == tagId]] = True
+                    mask &= tagged
+            return [self.idents[row] for row in numpy.flatnonzero(mask)]
+
+        matching = []
+        for row, ident in enumerate(self.idents):
+            if not self.alive[row]:
+                continue
+            if minPoints is not None and self.points[row] < minPoints:
+                continue
+            if maxPoints is not None and self.points[row] > maxPoints:
+                continue
+            if typeName is not None and self.types[row] != self.__typeNumbers[typeName]:
+                continue
+            if tagIds and not tagIds.issubset(self.tagIds[self.tagStarts[row]:self.tagStarts[row + 1]]):
+                continue
+            matching.append(ident)
+        return matching
+
+    def save(self, path):
+        """Write the columns to path, for opening with open"""
+        identHeap = bytearray()
+        identStarts = array(QuestionColumns.OFFSETS, [0])
+        for ident in self.idents:
+            identHeap += ident.encode('utf-8')
+            identStarts.append(len(identHeap))
+        names = json.dumps({'tags': self.tagNames, 'types': self.typeNames}).encode('utf-8')
+
+        sections = [self.points, self.types, self.alive, self.tagStarts, self.tagIds, identStarts, identHeap, names]
+        offsets = []
+        position = len(QuestionColumns.MAGIC) + QuestionColumns.HEADER.size
+        for section in sections:
+            # every section starts on an 8 byte boundary, so numpy can read it in place
+            position += -position % 8
+            offsets.append(position)
+            position += len(memoryview(section).cast('B'))
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(QuestionColumns.MAGIC)
+            f.write(QuestionColumns.HEADER.pack(len(self.idents), len(self.tagIds), *offsets))
+            for offset, section in zip(offsets, sections):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(memoryview(section).cast('B'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    @classmethod
+    def open(cls, path):
+        """Map the columns saved at path, without copying them into this process"""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(mapped)
+        if bytes(view[:len(cls.MAGIC)]) != cls.MAGIC:
+            view.release()
+            mapped.close()
+            raise ValueError('{} is not a saved QuestionColumns'.format(path))
+        rows, entries, *offsets = cls.HEADER.unpack_from(view, len(cls.MAGIC))
+        points, types, alive, tagStarts, tagIds, identStarts, identHeap, names = offsets
+
+        columns = cls()
+        columns.points = view[points:points + rows * 4].cast(cls.POINTS)
+        columns.types = view[types:types + rows].cast(cls.TYPES)
+        columns.alive = view[alive:alive + rows].cast(cls.ALIVE)
+        columns.tagStarts = view[tagStarts:tagStarts + (rows + 1) * 8].cast(cls.OFFSETS)
+        columns.tagIds = view[tagIds:tagIds + entries * 4].cast(cls.TAG_IDS)
+        identStarts = view[identStarts:identStarts + (rows + 1) * 8].cast(cls.OFFSETS)
+        heap = view[identHeap:identHeap + identStarts[rows]]
+        columns.idents = [str(heap[identStarts[row]:identStarts[row + 1]], 'utf-8') for row in range(rows)]
+        names = json.loads(str(view[names:], 'utf-8'))
+        columns.tagNames = names['tags']
+        columns.typeNames = names['types']
+
+        columns.__rows = {ident: row for row, ident in enumerate(columns.idents) if columns.alive[row]}
+        columns.__tagNumbers = {tag: number for number, tag in enumerate(columns.tagNames)}
+        columns.__typeNumbers = {name: number for number, name in enumerate(columns.typeNames)}
+        columns.__mapped = mapped
+        columns.readOnly = True
+        return columns
+
+    @staticmethod
+    def pointsOf(question):
+        """Static method that returns a question's points as a whole number, as the ui stores them as strings"""
+        try:
+            return int(question.getPoints())
+        except (TypeError, ValueError):
+            return 0
+
+    def __checkWritable(self):
+        if self.readOnly:
+            raise ValueError('columns opened from a file are read only')
+
+    def __tagEntries(self):
+        # (row, tag number) for every tag of every live row
+        for row, alive in enumerate(self.alive):
+            if alive:
+                for index in range(self.tagStarts[row], self.tagStarts[row + 1]):
+                    yield row, self.tagIds[index]
+
+    def __numpyAlive(self):
+        return numpy.frombuffer(self.alive, dtype=numpy.uint8).astype(bool)
+
+    def __numpyTagEntries(self, alive=True):
+        # the row of each tag entry, by repeating each row number once for each of its tags
+        starts = numpy.frombuffer(self.tagStarts, dtype=numpy.uint64).astype(numpy.int64)
+        rows = numpy.repeat(numpy.arange(len(starts) - 1), numpy.diff(starts))
+        tagIds = numpy.frombuffer(self.tagIds, dtype=numpy.uint32)
+        if alive:
+            keep = self.__numpyAlive()[rows]
+            return rows[keep], tagIds[keep]
+        return rows, tagIds
+
+    def __numpyTagIds(self):
+        return self.__numpyTagEntries()[1]
+
+    @staticmethod
+    def __number(name, names, numbers):
+        number = numbers.get(name)
+        if number is None:
+            number = numbers[name] = len(names)
+            names.append(name)
+        return number
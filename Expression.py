@@ -0,0 +1,135 @@
+import functools
+import re
+from fractions import Fraction
+
+
+class ArithmeticExpression:
+    """A small parser for arithmetic answers such as  10,  10.0,  20/2  or  (3+1)×2.5
+
+    Only numbers, + - × ÷ * / ^ and brackets are understood, and values are worked out exactly as Fractions,
+    so 1/3 stays a third. Nothing is ever passed to eval. Answers longer than MAX_LENGTH, or with a power bigger
+    than MAX_EXPONENT or one that would come to more than MAX_BITS, aren't worked out, so a student can't make
+    marking take forever.
+    Values are cached by text, as the same few answers come up again and again."""
+
+    TOKENS = re.compile(r'\s*(?:(\d+(?:\.\d*)?|\.\d+)|(\*\*|[-+*/×÷^()−]))')
+    OPERATORS = {'*': '*', '×': '*', '/': '/', '÷': '/', '**': '^', '^': '^', '−': '-', '+': '+', '-': '-',
+                 '(': '(', ')': ')'}
+    MAX_LENGTH = 100
+    MAX_EXPONENT = 100
+    MAX_BITS = 4096
+
+    def __init__(self, text):
+        self.text = text
+        self.__tokens = ArithmeticExpression.__tokenize(text)
+        self.__position = 0
+
+    @staticmethod
+    @functools.lru_cache(maxsize=65536)
+    def value(text):
+        """Static method that returns the value of text as a Fraction, or None if it isn't valid arithmetic"""
+        if not isinstance(text, str) or len(text) > ArithmeticExpression.MAX_LENGTH:
+            return None
+        try:
+            return ArithmeticExpression(text).evaluate()
+        except (ValueError, ZeroDivisionError):
+            return None
+
+    @staticmethod
+    def equal(expected, answer, tolerance=0):
+        """Static method that returns whether answer works out to within tolerance of expected,
+        comparing them as text if expected isn't arithmetic"""
+        expectedValue = ArithmeticExpression.value(expected)
+        if expectedValue is None:
+            return isinstance(answer, str) and answer.strip() == expected.strip()
+        answerValue = ArithmeticExpression.value(answer)
+        return answerValue is not None and abs(answerValue - expectedValue) <= tolerance
+
+    def evaluate(self):
+        """Returns the value of the expression, raising ValueError if it isn't valid"""
+        if not self.__tokens:
+            raise ValueError('the answer is empty')
+        value = self.__sum()
+        if self.__position < len(self.__tokens):
+            raise ValueError('unexpected {!r}'.format(self.__tokens[self.__position][1]))
+        return value
+
+    @staticmethod
+    def __tokenize(text):
+        # each token is ('number', Fraction) or (operator, operator)
+        tokens = []
+        position = 0
+        text = text.strip()
+        while position < len(text):
+            match = ArithmeticExpression.TOKENS.match(text, position)
+            if match is None:
+                raise ValueError('{!r} isn\'t arithmetic'.format(text[position:]))
+            position = match.end()
+            number, operator = match.groups()
+            if number is not None:
+                tokens.append(('number', Fraction(number)))
+            else:
+                operator = ArithmeticExpression.OPERATORS[operator]
+                tokens.append((operator, operator))
+        return tokens
+
+    def __peek(self):
+        return self.__tokens[self.__position][0] if self.__position < len(self.__tokens) else None
+
+    def __sum(self):
+        value = self.__product()
+        while self.__peek() in ('+', '-'):
+            operator = self.__peek()
+            self.__position += 1
+            right = self.__product()
+            value = value + right if operator == '+' else value - right
+        return value
+
+    def __product(self):
+        value = self.__unary()
+        while self.__peek() in ('*', '/'):
+            operator = self.__peek()
+            self.__position += 1
+            right = self.__unary()
+            value = value * right if operator == '*' else value / right
+        return value
+
+    def __unary(self):
+        if self.__peek() in ('+', '-'):
+            operator = self.__peek()
+            self.__position += 1
+            value = self.__unary()
+            return value if operator == '+' else -value
+        return self.__power()
+
+    def __power(self):
+        value = self.__atom()
+        if self.__peek() == '^':
+            self.__position += 1
+            # right to left, so 2^3^2 is 2^9
+            exponent = self.__unary()
+            if exponent.denominator != 1 or abs(exponent) > ArithmeticExpression.MAX_EXPONENT:
+                raise ValueError('only whole powers up to {} are worked out'.format(ArithmeticExpression.MAX_EXPONENT))
+            # and powers of powers can't run away either
+            bits = max(value.numerator.bit_length(), value.denominator.bit_length()) * abs(int(exponent))
+            if bits > ArithmeticExpression.MAX_BITS:
+                raise ValueError('the answer is too big')
+            value = value ** int(exponent)
+        return value
+
+    def __atom(self):
+        kind = self.__peek()
+        if kind == 'number':
+            value = self.__tokens[self.__position][1]
+            self.__position += 1
+            return value
+        if kind == '(':
+            self.__position += 1
+            value = self.__sum()
+            if self.__peek() != ')':
+                raise ValueError('missing )')
+            self.__position += 1
+            return value
+        if kind is None:
+            raise ValueError('the answer ends too early')
+        raise ValueError('unexpected {!r}'.format(kind))
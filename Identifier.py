@@ -0,0 +1,68 @@
+import itertools
+import os
+import threading
+import time
+
+
+class IdentifierAllocator:
+    """Allocates unique, time ordered identifiers
+
+    An identifier is the prefix followed by a 48 bit millisecond timestamp and 80 random bits, written in
+    Crockford's base 32 so that sorting identifiers as strings also sorts them by creation time.
+    Identifiers created in the same millisecond count up from the previous random value, so they stay in order.
+    Nothing has to be persisted or shared between processes, the random bits make a clash vanishingly unlikely."""
+
+    ALPHABET = '0123456789abcdefghjkmnpqrstvwxyz'
+    # every pair of characters, so that encoding takes 10 bits at a time
+    PAIRS = [''.join(pair) for pair in itertools.product(ALPHABET, repeat=2)]
+
+    __allocators = []
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.__lock = threading.Lock()
+        self.__lastTime = 0
+        self.__lastRandom = 0
+        type(self).__allocators.append(self)
+
+    def allocate(self):
+        with self.__lock:
+            now = time.time_ns() // 1000000
+            if now > self.__lastTime:
+                self.__lastTime = now
+                self.__lastRandom = int.from_bytes(os.urandom(10), 'big')
+            else:
+                # same millisecond, or the clock has gone backwards, so count on from the last identifier
+                self.__lastRandom += 1
+                if self.__lastRandom >> 80:
+                    # used up the millisecond, borrow the next one
+                    self.__lastTime += 1
+                    self.__lastRandom = int.from_bytes(os.urandom(10), 'big')
+            value = (self.__lastTime << 80) | self.__lastRandom
+
+        return self.prefix + IdentifierAllocator.encode(value)
+
+    def reseed(self):
+        """Forget the last identifier, so the next one starts from fresh random bits"""
+        with self.__lock:
+            self.__lastTime = 0
+
+    @staticmethod
+    def encode(value):
+        """Static method that writes a 128 bit number as 26 base 32 characters"""
+        pairs = IdentifierAllocator.PAIRS
+        chars = []
+        for _ in range(13):
+            chars.append(pairs[value & 1023])
+            value >>= 10
+        return ''.join(reversed(chars))
+
+    @classmethod
+    def reseedAll(cls):
+        for allocator in cls.__allocators:
+            allocator.reseed()
+
+
+# a forked child would otherwise carry on counting from exactly where its parent was
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=IdentifierAllocator.reseedAll)
@@ -0,0 +1,179 @@
+import csv
+import json
+import os
+from question.Question import Question, QuestionBank
+from question.AutoMarkedQuestion import AutoMarkedQuestion, ArithmeticQuestion
+
+
+class ImportReport:
+    """The outcome of an import, with the line number and reason for every row that was rejected"""
+
+    def __init__(self, maxErrors=1000):
+        self.imported = 0
+        self.duplicates = 0
+        self.errorCount = 0
+        self.errors = []
+        self.maxErrors = maxErrors
+
+    def addError(self, lineNumber, message):
+        # only keep so many errors, so that importing a completely wrong file doesn't use up memory
+        self.errorCount += 1
+        if len(self.errors) < self.maxErrors:
+            self.errors.append((lineNumber, message))
+
+    def __str__(self):
+        lines = ['{} imported, {} duplicates skipped, {} rows with errors'.format(
+            self.imported, self.duplicates, self.errorCount)]
+        lines += ['line {}: {}'.format(lineNumber, message) for lineNumber, message in self.errors]
+        if self.errorCount > len(self.errors):
+            lines.append('... and {} more errors'.format(self.errorCount - len(self.errors)))
+        return '\n'.join(lines)
+
+
+class QuestionImporter:
+    """Streams questions from a JSONL or CSV file into the QuestionBank
+
+    Each row has a question, an answer, and optionally tags, points and choices. Rows with choices become whichever
+    multiple choice type AutoMarkedQuestion.createFromInput picks, and rows without become ArithmeticQuestions.
+    In JSONL the choices are an object of letter -> choice, in CSV they are the columns a, b, c and d.
+    Answers and tags can be lists, or strings separated by commas like in the ui.
+
+    Rows are read one at a time and the bank is saved after every batch, waiting for the save to finish,
+    so the file itself is never held in memory. Every question imported is still kept in the bank though."""
+
+    CHOICE_LETTERS = ('a', 'b', 'c', 'd')
+
+    def __init__(self, bank=None, batchSize=5000):
+        self.bank = bank if bank is not None else QuestionBank.getInstance()
+        self.batchSize = batchSize
+
+    def importFile(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        with open(path, newline='', encoding='utf-8') as f:
+            if extension == '.csv':
+                return self.importRows(QuestionImporter.readCsv(f))
+            if extension in ('.jsonl', '.json'):
+                return self.importRows(QuestionImporter.readJsonLines(f))
+        raise ValueError('Unknown file type {}, expected .jsonl or .csv'.format(extension))
+
+    def importRows(self, rows):
+        """Import an iterable of (line number, row) pairs, where each row is a dictionary or an error message"""
+        report = ImportReport()
+        batch = 0
+
+        for lineNumber, row in rows:
+            if isinstance(row, str):
+                report.addError(lineNumber, row)
+                continue
+
+            try:
+                question = QuestionImporter.createQuestion(row)
+            except ValueError as e:
+                report.addError(lineNumber, str(e))
+                continue
+
+            if self.bank.add(question):
+                report.imported += 1
+                batch += 1
+            else:
+                report.duplicates += 1
+
+            if batch >= self.batchSize:
+                self.bank.save()
+                self.bank.flush()
+                batch = 0
+
+        self.bank.save()
+        self.bank.flush()
+        return report
+
+    @staticmethod
+    def readJsonLines(f):
+        for lineNumber, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield lineNumber, 'not valid JSON: {}'.format(e)
+                continue
+            if not isinstance(row, dict):
+                yield lineNumber, 'expected a JSON object'
+                continue
+            yield lineNumber, row
+
+    @staticmethod
+    def readCsv(f):
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+
+    @staticmethod
+    def createQuestion(row):
+        """Static method that validates a row and creates its question, raising ValueError if the row is invalid"""
+        question = QuestionImporter.__text(row.get('question'))
+        if not question:
+            raise ValueError('the question is empty')
+
+        tags = QuestionImporter.__list(row.get('tags'))
+
+        points = row.get('points')
+        if points in (None, ''):
+            points = 10
+        # int() would turn 2.5 into 2 and True into 1 without complaint
+        if isinstance(points, bool) or isinstance(points, float) and not points.is_integer():
+            raise ValueError('points should be a whole number, not {!r}'.format(points))
+        try:
+            points = int(points)
+        except (TypeError, ValueError):
+            raise ValueError('points should be a whole number, not {!r}'.format(points))
+        if points <= 0:
+            raise ValueError('points should be more than 0')
+
+        choices = row.get('choices')
+        if choices is None:
+            choices = {letter: row.get(letter) for letter in QuestionImporter.CHOICE_LETTERS}
+        if not isinstance(choices, dict):
+            raise ValueError('choices should be an object of letter -> choice')
+        choices = {str(letter).lower(): QuestionImporter.__text(choice) for letter, choice in choices.items()}
+        choices = {letter: choice for letter, choice in choices.items() if choice}
+
+        if not choices:
+            answer = row.get('answer')
+            if isinstance(answer, (list, tuple)):
+                if len(answer) != 1:
+                    raise ValueError('an arithmetic question has exactly one answer')
+                answer = answer[0]
+            answer = QuestionImporter.__text(answer)
+            if not answer:
+                raise ValueError('the answer is empty')
+            return ArithmeticQuestion(question, answer, tags, points)
+
+        answer = [letter.lower() for letter in QuestionImporter.__list(row.get('answer'))]
+        if not answer:
+            raise ValueError('the answer is empty')
+        missing = [letter for letter in answer if letter not in choices]
+        if missing:
+            raise ValueError('the answer {} is not one of the choices'.format(', '.join(missing)))
+        return AutoMarkedQuestion.createFromInput(question, choices, answer, tags, points)
+
+    @staticmethod
+    def __text(value):
+        return '' if value is None else str(value).strip()
+
+    @staticmethod
+    def __list(value):
+        if value is None:
+            return []
+        if isinstance(value, (list, tuple)):
+            return [str(v).strip() for v in value if str(v).strip()]
+        return Question.stringInputToList(str(value))
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2:
+        sys.exit('usage: python Importer.py questions.jsonl|questions.csv')
+
+    print(QuestionImporter().importFile(sys.argv[1]))
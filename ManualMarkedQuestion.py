@@ -3,14 +3,14 @@ from question.Question import Question
 
 class ManualMarkedQuestion(Question):
     # Not required for cw1
-    pass
+    __slots__ = ()
 
 
 class EssayQuestion(ManualMarkedQuestion):
     # Not required for cw1
-    pass
+    __slots__ = ()
 
 
 class ShortAnswer(ManualMarkedQuestion):
     # Not required for cw1
-    pass
+    __slots__ = ()
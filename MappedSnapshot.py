@@ -0,0 +1,259 @@
+import json
+import mmap
+import os
+import pickle
+import struct
+import threading
+from array import array
+from collections.abc import Mapping
+from question.Question import Question
+# imported so that every question type can be found by name
+import question.AutoMarkedQuestion
+import question.ManualMarkedQuestion
+from question.TextSearch import TextIndex
+
+
+class MappedSnapshot:
+    """A read only snapshot of the questions that is opened with mmap rather than unpickled
+
+    The file is a table of fixed width records, one per question and sorted by ident, followed by a heap holding
+    the strings they point to, an array of tag numbers, the tag and type names, and the pickled TagIndex.
+    Opening it only reads the header, names and tag index, and a question is decoded from its record the first
+    time it's looked up, so a process can start using a large bank straight away. The pages are shared through
+    the page cache by every process that has the same file open.
+
+    The answer and choices of a question are kept in the heap as JSON."""
+
+    MAGIC = b'MZMS1\n'
+    # the offset and length of the record table, heap, tag numbers, names and tag index
+    HEADER = struct.Struct('<QQQQQQQQQQ')
+    # ident, question, answer and choices as heap (offset, length), first tag and number of tags, points, type, flags
+    RECORD = struct.Struct('<QIQIQIQIIIiBB2x')
+    TAG_NUMBERS = 'I'
+    POINTS_AS_TEXT = 1
+    HAS_CHOICES = 2
+
+    @staticmethod
+    def write(path, collection):
+        """Write the questions of a QuestionCollection to path"""
+        heap = bytearray()
+        tagNumbers = array(MappedSnapshot.TAG_NUMBERS)
+        tags, types = {}, {}
+        records = []
+
+        def store(value):
+            data = value.encode('utf-8')
+            offset = len(heap)
+            heap.extend(data)
+            return offset, len(data)
+
+        questions = collection.getQuestions()
+        for ident in sorted(questions):
+            question = questions[ident]
+            state = question.__getstate__()
+
+            points = state.get('_points')
+            flags = MappedSnapshot.POINTS_AS_TEXT if isinstance(points, str) else 0
+            try:
+                points = int(points)
+            except (TypeError, ValueError):
+                raise ValueError('{} has points {!r}, which aren\'t a whole number'.format(ident, points))
+
+            if 'choices' in state:
+                flags |= MappedSnapshot.HAS_CHOICES
+            firstTag = len(tagNumbers)
+            for tag in question.getTags():
+                tagNumbers.append(tags.setdefault(tag, len(tags)))
+
+            records.append(MappedSnapshot.RECORD.pack(
+                *store(ident), *store(question.question), *store(json.dumps(state.get('_answer'))),
+                *store(json.dumps(state.get('choices'))), firstTag, len(tagNumbers) - firstTag, points,
+                types.setdefault(type(question).__name__, len(types)), flags))
+
+        names = json.dumps({'tags': list(tags), 'types': list(types)}).encode('utf-8')
+        tagIndex = pickle.dumps(collection.getTagIndex(), pickle.HIGHEST_PROTOCOL)
+        sections = [b''.join(records), heap, memoryview(tagNumbers).cast('B'), names, tagIndex]
+
+        offsets = []
+        position = len(MappedSnapshot.MAGIC) + MappedSnapshot.HEADER.size
+        for section in sections:
+            position += -position % 8
+            offsets += [position, len(section)]
+            position += len(section)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # a new file is renamed over the old one, so processes that have the old one mapped carry on reading it
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(MappedSnapshot.MAGIC)
+            f.write(MappedSnapshot.HEADER.pack(*offsets))
+            for offset, section in zip(offsets[::2], sections):
+                f.write(b'\0' * (offset - f.tell()))
+                f.write(section)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    @staticmethod
+    def open(path):
+        """Map the snapshot at path, returning a MappedQuestions and the TagIndex"""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(mapped)
+        if len(view) < len(MappedSnapshot.MAGIC) + MappedSnapshot.HEADER.size or \
+                bytes(view[:len(MappedSnapshot.MAGIC)]) != MappedSnapshot.MAGIC:
+            view.release()
+            mapped.close()
+            raise ValueError('{} is not a MappedSnapshot'.format(path))
+        offsets = MappedSnapshot.HEADER.unpack_from(view, len(MappedSnapshot.MAGIC))
+        table, heap, tagNumbers, names, tagIndex = [view[offset:offset + length]
+                                                    for offset, length in zip(offsets[::2], offsets[1::2])]
+
+        names = json.loads(str(names, 'utf-8'))
+        questions = MappedQuestions(mapped, table, heap, tagNumbers.cast(MappedSnapshot.TAG_NUMBERS),
+                                    names['tags'], names['types'])
+        return questions, pickle.loads(tagIndex)
+
+
+class MappedQuestions(Mapping):
+    """A read only dictionary of ident -> question, decoded from a MappedSnapshot as they are looked up"""
+
+    def __init__(self, mapped, table, heap, tagNumbers, tags, types):
+        self.__mapped = mapped
+        self.__table = table
+        self.__heap = heap
+        self.__tagNumbers = tagNumbers
+        self.__tags = tags
+        self.__types = [MappedQuestions.questionType(name) for name in types]
+        self.__count = len(table) // MappedSnapshot.RECORD.size
+        self.__loaded = {}
+        self.__lock = threading.Lock()
+
+    def __getitem__(self, ident):
+        question = self.__loaded.get(ident)
+        if question is None:
+            row = self.__find(ident)
+            if row is None:
+                raise KeyError(ident)
+            question = self.__decode(row)
+            with self.__lock:
+                question = self.__loaded.setdefault(ident, question)
+        return question
+
+    def __setitem__(self, ident, question):
+        raise ValueError('a MappedSnapshot is read only')
+
+    def __delitem__(self, ident):
+        raise ValueError('a MappedSnapshot is read only')
+
+    def pop(self, ident, default=None):
+        raise ValueError('a MappedSnapshot is read only')
+
+    def __contains__(self, ident):
+        return ident in self.__loaded or self.__find(ident) is not None
+
+    def __iter__(self):
+        # in order of ident, which is the order the questions were created in
+        for row in range(self.__count):
+            yield self.__ident(row)
+
+    def __len__(self):
+        return self.__count
+
+    @staticmethod
+    def questionType(name):
+        """Static method that finds the Question subclass with this name"""
+        types = [Question]
+        while types:
+            cls = types.pop()
+            if cls.__name__ == name:
+                return cls
+            types.extend(cls.__subclasses__())
+        raise ValueError('unknown question type {}'.format(name))
+
+    def __record(self, row):
+        return MappedSnapshot.RECORD.unpack_from(self.__table, row * MappedSnapshot.RECORD.size)
+
+    def __string(self, offset, length):
+        return str(self.__heap[offset:offset + length], 'utf-8')
+
+    def __ident(self, row):
+        offset, length = MappedSnapshot.RECORD.unpack_from(self.__table, row * MappedSnapshot.RECORD.size)[:2]
+        return self.__string(offset, length)
+
+    def __find(self, ident):
+        # binary search of the table, which is sorted by ident
+        key = ident.encode('utf-8')
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            offset, length = MappedSnapshot.RECORD.unpack_from(self.__table, middle * MappedSnapshot.RECORD.size)[:2]
+            found = self.__heap[offset:offset + length].tobytes()
+            if found == key:
+                return middle
+            if found < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def __decode(self, row):
+        (identOffset, identLength, textOffset, textLength, answerOffset, answerLength, choicesOffset, choicesLength,
+         firstTag, tagCount, points, typeNumber, flags) = self.__record(row)
+
+        answer = json.loads(self.__string(answerOffset, answerLength))
+        state = {
+            '_question': self.__string(textOffset, textLength),
+            '_answer': answer,
+            '_points': str(points) if flags & MappedSnapshot.POINTS_AS_TEXT else points,
+            '_tags': [self.__tags[number] for number in self.__tagNumbers[firstTag:firstTag + tagCount]],
+            '_ident': self.__string(identOffset, identLength),
+        }
+        if flags & MappedSnapshot.HAS_CHOICES:
+            choices = json.loads(self.__string(choicesOffset, choicesLength))
+            # JSON has no tuples, so (letter, choice) pairs come back as lists
+            state['choices'] = [tuple(choice) if isinstance(choice, list) else choice for choice in choices]
+
+        cls = self.__types[typeNumber]
+        question = cls.__new__(cls)
+        question.__setstate__(state)
+        return question
+
+
+class MappedSnapshotStorage:
+    """Loads a collection from a MappedSnapshot, for processes that only read the questions
+
+    Swap it in as QuestionBank.storage in a worker process. The bank can't be changed or saved."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+
+    def load(self, cls):
+        questions, tagIndex = MappedSnapshot.open(self.path)
+        # the text index is built from the questions if this process searches them
+        return cls(questions, {}, tagIndex, TextIndex.deferred(lambda: None))
+
+    def stage(self, item):
+        raise ValueError('a MappedSnapshot is read only')
+
+    def stageRemoval(self, ident):
+        raise ValueError('a MappedSnapshot is read only')
+
+    def identsForTag(self, tag):
+        return None
+
+    def identsForQuery(self, query):
+        return None
+
+    def identsForText(self, text, limit):
+        return None
+
+    def completeTags(self, prefix, limit):
+        return None
+
+    def save(self, collection):
+        raise ValueError('a MappedSnapshot is read only')
@@ -0,0 +1,315 @@
+from array import array
+from question.AutoMarkedQuestion import AutoMarkedQuestion, MultipleAnswerQuestion
+from question.Columns import QuestionColumns
+from question.Expression import ArithmeticExpression
+
+try:
+    import numpy
+except ImportError:
+    # marking falls back to plain Python
+    numpy = None
+
+
+class AnswerKey:
+    """The answers to a test's automatically marked questions, with every answer encoded as a whole number
+
+    For a question with choices the number is a bitmask with a bit for each choice picked, in the order of
+    getChoices, and the correct answer is the mask of the right choices. Any other answer is 1 if it works out to
+    within tolerance of the question's answer, so 10, 10.0 and 20/2 are all right for an answer of 10, and 0 if not.
+    Answers that aren't arithmetic are compared as text, ignoring spaces at either end, and an answer of several
+    items, like a reorder question's, has to have the same items in the same order. So an answer is right exactly
+    when its number is the same as the key's. A letter that isn't one of the choices sets the INVALID bit, so it's never right.
+    A question whose own answer isn't one of its choices can't be marked, so it raises ValueError.
+    Questions that have to be marked by hand are left out of the key and listed in manual.
+    The masks of up to CACHED different answers are kept for each question with choices, as most students give the
+    same few. Other answers are worked out each time, with ArithmeticExpression caching the values of their text."""
+
+    INVALID = 1 << 31
+    CODES = 'I'
+    CACHED = 1024
+
+    def __init__(self, test, tolerance=0):
+        self.tolerance = tolerance
+        self.idents = []
+        self.points = []
+        self.correct = []
+        self.manual = []
+        # for each question, letter -> bit if it has choices, otherwise None
+        self.letters = []
+        # for each question without choices, its answer as text, or a tuple of texts for an answer of several
+        # items like a reorder question's, otherwise None
+        self.expected = []
+        # for each question with choices, answer -> mask, filled in as answers are seen, otherwise None
+        self.__masks = []
+
+        for ident, question in test.getQuestions().items():
+            if not isinstance(question, AutoMarkedQuestion):
+                self.manual.append(ident)
+                continue
+            self.idents.append(ident)
+            self.points.append(QuestionColumns.pointsOf(question))
+            if isinstance(question, MultipleAnswerQuestion):
+                letters = {str(letter).lower(): 1 << bit for bit, (letter, choice) in enumerate(question.getChoices())}
+                correct = AnswerKey.__mask(letters, question.getAnswer())
+                # otherwise any answer with a letter that isn't a choice would be marked right
+                if correct & AnswerKey.INVALID:
+                    raise ValueError('the answer to {} isn\'t one of its choices'.format(ident))
+                self.letters.append(letters)
+                self.expected.append(None)
+                self.correct.append(correct)
+                self.__masks.append({})
+            else:
+                self.letters.append(None)
+                answer = question.getAnswer()
+                if isinstance(answer, (list, tuple)) and len(answer) > 1:
+                    self.expected.append(tuple(str(item).strip() for item in answer))
+                else:
+                    self.expected.append(AnswerKey.__text(answer))
+                self.correct.append(1)
+                self.__masks.append(None)
+
+    def __len__(self):
+        return len(self.idents)
+
+    def total(self):
+        return sum(self.points)
+
+    def encodeAnswer(self, position, answer):
+        """Returns the number for an answer to the question at position in the key"""
+        masks = self.__masks[position]
+        if masks is None:
+            return self.__encode(position, answer)
+
+        key = tuple(answer) if isinstance(answer, list) else answer
+        mask = masks.get(key)
+        if mask is None:
+            mask = self.__encode(position, answer)
+            # once full, answers seen that late are rare enough to work out each time
+            if len(masks) < AnswerKey.CACHED:
+                masks[key] = mask
+        return mask
+
+    def encode(self, answers):
+        """Returns the numbers for a dictionary of ident -> answer, or a list of answers in the order of the key,
+        in the order of the key, with 0 for no answer"""
+        if isinstance(answers, dict):
+            answers = [answers.get(ident) for ident in self.idents]
+        return [self.encodeAnswer(position, answer) for position, answer in enumerate(answers)]
+
+    def __encode(self, position, answer):
+        if answer is None:
+            return 0
+        if self.letters[position] is not None:
+            return AnswerKey.__mask(self.letters[position], answer)
+        expected = self.expected[position]
+        if expected is None:
+            # a question without an answer can't be got right
+            return 0
+        if isinstance(expected, tuple):
+            return int(isinstance(answer, (list, tuple)) and tuple(str(item).strip() for item in answer) == expected)
+        answer = AnswerKey.__text(answer)
+        return int(answer is not None and ArithmeticExpression.equal(expected, answer, self.tolerance))
+
+    @staticmethod
+    def __text(answer):
+        # an answer given as a list of one is the same as that answer on its own
+        if isinstance(answer, (list, tuple)):
+            answer = answer[0] if len(answer) == 1 else None
+        return None if answer is None else str(answer).strip()
+
+    @staticmethod
+    def __mask(letters, answer):
+        # a number on its own is one letter like any other, and one that isn't a choice is never right
+        if not isinstance(answer, (list, tuple)):
+            answer = [answer]
+        mask = 0
+        for letter in answer:
+            mask |= letters.get(str(letter).strip().lower(), AnswerKey.INVALID)
+        return mask
+
+
+class CreditRule:
+    """How much of a choice question's points an answer gets, worked out from bitmasks of the choices
+
+    With exact, the answer has to pick exactly the right choices to get anything. Otherwise it gets a share for
+    each right choice picked, less wrongPenalty shares for each wrong one, where a share is the points divided by
+    the number of right choices, and never less than minimum times the points. A minimum below 0 lets wrong
+    picks take points off the rest of the test."""
+
+    def __init__(self, exact=True, wrongPenalty=0.0, minimum=0.0):
+        self.exact = exact
+        self.wrongPenalty = wrongPenalty
+        self.minimum = minimum
+
+    @classmethod
+    def allOrNothing(cls):
+        return cls()
+
+    @classmethod
+    def perCorrectChoice(cls):
+        return cls(False)
+
+    @classmethod
+    def negativeMarking(cls, penalty=1.0, minimum=0.0):
+        return cls(False, penalty, minimum)
+
+    def fraction(self, picked, correct):
+        """Returns the fraction of the points for the choices picked, given the bitmasks of the picked and
+        right choices"""
+        if self.exact:
+            return float(picked == correct)
+        right = CreditRule.popcount(picked & correct)
+        wrong = CreditRule.popcount(picked & ~correct)
+        return min(1.0, max(self.minimum, (right - self.wrongPenalty * wrong) / max(CreditRule.popcount(correct), 1)))
+
+    def fractions(self, picked, correct):
+        """fraction for a numpy array of picked bitmasks, with a row for each student and a column for each
+        question, and an array of the right bitmask of each question"""
+        if self.exact:
+            return (picked == correct).astype(numpy.float64)
+        right = CreditRule.popcounts(picked & correct)
+        wrong = CreditRule.popcounts(picked & ~correct)
+        needed = numpy.maximum(CreditRule.popcounts(correct), 1)
+        return numpy.clip((right - self.wrongPenalty * wrong) / needed, self.minimum, 1.0)
+
+    def __eq__(self, other):
+        return isinstance(other, CreditRule) and \
+            (self.exact, self.wrongPenalty, self.minimum) == (other.exact, other.wrongPenalty, other.minimum)
+
+    def __hash__(self):
+        return hash((self.exact, self.wrongPenalty, self.minimum))
+
+    @staticmethod
+    def popcount(bits):
+        """Static method that counts the bits set"""
+        return bin(bits).count('1')
+
+    @staticmethod
+    def popcounts(bits):
+        """Static method that counts the bits set in each of a numpy array of 32 bit numbers"""
+        bits = numpy.asarray(bits, dtype=numpy.uint32)
+        if hasattr(numpy, 'bitwise_count'):
+            return numpy.bitwise_count(bits).astype(numpy.float64)
+        # numpy before 2.0 has no popcount, so add up the bits of each byte from a table
+        table = numpy.array([bin(byte).count('1') for byte in range(256)], dtype=numpy.uint8)
+        counts = table[bits.reshape(bits.shape + (1,)).view(numpy.uint8)]
+        return counts.sum(axis=-1, dtype=numpy.float64)
+
+
+class MarkedBatch:
+    """The marks of a batch of students on one test
+
+    scores holds each student's total in the order of students, and rightCounts how many students got each
+    question of the key completely right."""
+
+    def __init__(self, key, students, scores, rightCounts):
+        self.key = key
+        self.students = students
+        self.scores = scores
+        self.rightCounts = rightCounts
+
+    def __len__(self):
+        return len(self.students)
+
+    @classmethod
+    def combine(cls, batches):
+        """Returns one MarkedBatch of all the students in batches, which were all marked against the same key"""
+        batches = list(batches)
+        combined = cls(batches[0].key if batches else None, [], [], [0] * len(batches[0].rightCounts) if batches else [])
+        for batch in batches:
+            combined.students.extend(batch.students)
+            combined.scores.extend(batch.scores)
+            combined.rightCounts = [total + count for total, count in zip(combined.rightCounts, batch.rightCounts)]
+        return combined
+
+    def score(self, student):
+        return self.scores[self.students.index(student)]
+
+    def results(self):
+        """Returns a dictionary of student -> score"""
+        return dict(zip(self.students, self.scores))
+
+    def averageScore(self):
+        return sum(self.scores) / len(self.scores) if self.scores else 0.0
+
+
+class BatchMarker:
+    """Marks every student's answers to a test at once
+
+    Each student's answers are encoded with the test's AnswerKey into one row of a flat array of whole numbers,
+    and then the whole array is compared with the key and scored in one go. When numpy is installed the
+    comparison and scoring run on a numpy view of the array, otherwise they run in plain Python.
+
+    Questions with choices are scored with rule, or the CreditRule in rules for that question's ident.
+    Other questions are all or nothing, and right if they're within tolerance of the answer."""
+
+    def __init__(self, test, rule=None, rules=None, tolerance=0):
+        self.test = test
+        self.key = AnswerKey(test, tolerance)
+        rule = CreditRule.allOrNothing() if rule is None else rule
+        rules = rules or {}
+        exact = CreditRule.allOrNothing()
+        # the rule for each question in the key
+        self.rules = [rules.get(ident, rule) if letters is not None else exact
+                      for ident, letters in zip(self.key.idents, self.key.letters)]
+
+    def encode(self, submissions):
+        """Encode an iterable of (student, dictionary of ident -> answer) pairs, or a dictionary of
+        student -> answers. Returns the students and a flat array of their encoded answers, a row each"""
+        if isinstance(submissions, dict):
+            submissions = submissions.items()
+        students = []
+        encoded = array(AnswerKey.CODES)
+        encode = self.key.encode
+        for student, answers in submissions:
+            students.append(student)
+            encoded.extend(encode(answers))
+        return students, encoded
+
+    def mark(self, submissions):
+        """Mark the submissions, given as for encode. Returns a MarkedBatch"""
+        return self.markEncoded(*self.encode(submissions))
+
+    def markEncoded(self, students, encoded):
+        """Mark answers that have already been encoded, given the students and their rows of encoded answers"""
+        width = len(self.key)
+        if numpy is not None:
+            rows = numpy.frombuffer(encoded, dtype=numpy.uint32).reshape(len(students), width)
+            correct = numpy.array(self.key.correct, dtype=numpy.uint32)
+            right = rows == correct
+            credit = right.astype(numpy.float64)
+            # the questions scored by each rule other than all or nothing, a few columns at a time
+            for rule, positions in self.__partialRules().items():
+                credit[:, positions] = rule.fractions(rows[:, positions], correct[positions])
+            scores = credit @ numpy.array(self.key.points, dtype=numpy.float64)
+            return MarkedBatch(self.key, students, scores.tolist(), right.sum(axis=0).tolist())
+
+        scores = []
+        rightCounts = [0] * width
+        correct = self.key.correct
+        points = self.key.points
+        rules = [None if rule.exact else rule for rule in self.rules]
+        # the points for each answer to each question, worked out the first time that answer is seen
+        credits = [{} for position in range(width)]
+        for row in range(len(students)):
+            score = 0.0
+            for position, code in enumerate(encoded[row * width:(row + 1) * width]):
+                if code == correct[position]:
+                    score += points[position]
+                    rightCounts[position] += 1
+                elif rules[position] is not None:
+                    credit = credits[position].get(code)
+                    if credit is None:
+                        credit = credits[position][code] = points[position] * rules[position].fraction(
+                            code, correct[position])
+                    score += credit
+            scores.append(score)
+        return MarkedBatch(self.key, students, scores, rightCounts)
+
+    def __partialRules(self):
+        # rule -> positions of the questions scored by it, for every rule that isn't all or nothing
+        positions = {}
+        for position, rule in enumerate(self.rules):
+            if not rule.exact:
+                positions.setdefault(rule, []).append(position)
+        return positions
@@ -0,0 +1,133 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from question.MappedSnapshot import MappedSnapshotStorage
+from question.Marking import AnswerKey, BatchMarker, MarkedBatch
+from question.Question import QuestionBank, QuestionCollection
+from question.Test import TestBank
+
+
+class MarkingWorker:
+    """What runs in each worker process of a MarkingScheduler
+
+    Each worker loads the QuestionBank once when it starts, always from the MappedSnapshot, so that every worker
+    shares the same pages and none of them touches the files of the bank's usual storage. Switching storage also
+    drops any bank a forked worker inherited from its parent. A BatchMarker is kept for each test it has been
+    sent chunks of."""
+
+    snapshotPath = None
+    rule = None
+    rules = None
+    tolerance = 0
+    markers = {}
+
+    @staticmethod
+    def initialize(snapshotPath, rule, rules, tolerance):
+        MarkingWorker.snapshotPath = snapshotPath
+        MarkingWorker.rule = rule
+        MarkingWorker.rules = rules
+        MarkingWorker.tolerance = tolerance
+        MarkingWorker.markers = {}
+        QuestionBank.useStorage(MappedSnapshotStorage(snapshotPath))
+        QuestionBank.getInstance()
+
+    @staticmethod
+    def mark(testIdent, questionIdents, students, answers):
+        """Mark a chunk of students' answers to one test, whose automatically marked questions are questionIdents
+        and are all in the QuestionBank. Each student's answers are a list in the order of questionIdents"""
+        marker = MarkingWorker.markers.get(testIdent)
+        if marker is None:
+            bank = QuestionBank.getInstance().getQuestions()
+            questions = QuestionCollection({ident: bank[ident] for ident in questionIdents})
+            marker = BatchMarker(questions, MarkingWorker.rule, MarkingWorker.rules, MarkingWorker.tolerance)
+            MarkingWorker.markers[testIdent] = marker
+
+        batch = marker.mark(zip(students, answers))
+        return testIdent, batch.students, batch.scores, batch.rightCounts
+
+
+class MarkingScheduler:
+    """Marks submissions to many tests across a pool of worker processes
+
+    Submissions are grouped by test into chunks of chunkSize students, and each full chunk is sent to the pool
+    straight away. At most twice as many chunks as there are workers are waiting at once, so reading more
+    submissions waits on the workers rather than filling memory. Results come back a chunk at a time as they're
+    marked, and progress holds how many students of each test have been marked out of how many were sent.
+
+    Workers only read the questions, from the MappedSnapshot at snapshotPath, which has to hold every
+    automatically marked question of each test. Write one with MappedSnapshot.write before marking.
+    Loading the bank's usual storage in each worker could change its files while the parent is still saving.
+    How well marking scales with more workers hasn't been measured, so don't count on it being linear."""
+
+    def __init__(self, snapshotPath, workers=None, chunkSize=2000, rule=None, rules=None, tolerance=0, tests=None):
+        if snapshotPath is None:
+            raise ValueError('workers have to read the questions from a MappedSnapshot, give its path')
+        self.snapshotPath = snapshotPath
+        self.workers = workers or os.cpu_count() or 1
+        self.chunkSize = chunkSize
+        self.rule = rule
+        self.rules = rules
+        self.tolerance = tolerance
+        self.tests = tests
+        # test ident -> [students marked, students sent]
+        self.progress = {}
+
+    def mark(self, submissions, progress=None):
+        """Mark an iterable of (test ident, student, dictionary of ident -> answer), yielding (test ident, MarkedBatch)
+        for each chunk as it's marked. progress, if given, is called with the test ident, the number of its
+        students marked and the number sent so far each time a chunk comes back.
+        Raises ValueError for a test that isn't in tests, or the TestBank by default"""
+        tests = TestBank.getInstance().getTests() if self.tests is None else self.tests
+        # test ident -> (idents of the questions to mark, AnswerKey)
+        keys = {}
+        # test ident -> (students, answers) waiting to fill a chunk
+        chunks = {}
+        self.progress = {}
+
+        with ProcessPoolExecutor(self.workers, initializer=MarkingWorker.initialize,
+                                 initargs=(self.snapshotPath, self.rule, self.rules, self.tolerance)) as executor:
+            pending = set()
+
+            def send(testIdent):
+                students, answers = chunks.pop(testIdent)
+                pending.add(executor.submit(MarkingWorker.mark, testIdent, keys[testIdent][0], students, answers))
+                self.progress[testIdent][1] += len(students)
+
+            for testIdent, student, answers in submissions:
+                if testIdent not in keys:
+                    if testIdent not in tests:
+                        raise ValueError('there is no test {}'.format(testIdent))
+                    test = tests[testIdent]
+                    key = AnswerKey(test, self.tolerance)
+                    keys[testIdent] = (tuple(key.idents), key)
+                    self.progress[testIdent] = [0, 0]
+
+                students, chunk = chunks.setdefault(testIdent, ([], []))
+                students.append(student)
+                # sent as a list in the order of the key, which pickles far smaller than a dictionary
+                chunk.append([answers.get(ident) for ident in keys[testIdent][0]])
+                if len(students) >= self.chunkSize:
+                    send(testIdent)
+                    while len(pending) >= self.workers * 2:
+                        yield from self.__collect(pending, keys, progress)
+
+            for testIdent in list(chunks):
+                send(testIdent)
+            while pending:
+                yield from self.__collect(pending, keys, progress)
+
+    def markAll(self, submissions, progress=None):
+        """Mark the submissions and return a dictionary of test ident -> MarkedBatch of all its students"""
+        batches = {}
+        for testIdent, batch in self.mark(submissions, progress):
+            batches.setdefault(testIdent, []).append(batch)
+        return {testIdent: MarkedBatch.combine(marked) for testIdent, marked in batches.items()}
+
+    def __collect(self, pending, keys, progress):
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        pending.difference_update(done)
+        for future in done:
+            testIdent, students, scores, rightCounts = future.result()
+            self.progress[testIdent][0] += len(students)
+            if progress is not None:
+                progress(testIdent, *self.progress[testIdent])
+            yield testIdent, MarkedBatch(keys[testIdent][1], students, scores, rightCounts)
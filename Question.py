@@ -1,77 +1,306 @@
 import copy
-import random
-import pickle
+import hashlib
+import sys
+from question.Bank import FingerprintedCollection, StoredBank
+from question.Columns import QuestionColumns
+from question.Identifier import IdentifierAllocator
+from question.Storage import IndexedJournalStorage
+from question.TagQuery import TagIndex, TagQuery
+from question.TextSearch import TextIndex
 
 
-class QuestionCollection:
-    """A wrapper around a dictionary of Questions"""
+class QuestionCollection(FingerprintedCollection):
+    """A wrapper around a dictionary of Questions
 
-    def __init__(self):
-        self.__questions = {}
+    The collection also keeps a TagIndex of tag -> question idents and an index of content fingerprint -> question ident.
+    Tags should be changed through the collection's setTags rather than on the question itself, otherwise the
+    indexes won't know about it.
+    The QuestionBank keeps a TextIndex of the question text too, but it isn't pickled with the collection. It's
+    rebuilt from the questions the first time it's searched, unless the storage saved it separately. Other
+    collections, like each Test, only build one if they're searched.
+    QuestionColumns for aggregate queries are built the first time they're asked for, and kept up to date
+    from then on.
+    A collection made with indexed False keeps neither index, as its storage answers tag and text searches
+    itself. It only builds them if it's searched directly."""
+
+    indexesText = False
+
+    def __init__(self, questions=None, fingerprints=None, tagIndex=None, textIndex=None, indexed=True):
+        self.__questions = {} if questions is None else questions
+        self.__fingerprints = {} if fingerprints is None else fingerprints
+        if tagIndex is None and indexed:
+            tagIndex = TagIndex()
+        self.__tagIndex = tagIndex
+        if textIndex is None and indexed and self.indexesText:
+            textIndex = TextIndex()
+        self.__textIndex = textIndex
+        self.__columns = None
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('_QuestionCollection__textIndex', None)
+        state.pop('_QuestionCollection__columns', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__textIndex = TextIndex.deferred(lambda: None) if self.indexesText else None
+        self.__columns = None
+
+        # collections pickled before the indexes existed need them building once
+        try:
+            self.__fingerprints
+        except AttributeError:
+            self.__fingerprints = {}
+            self.__tagIndex = TagIndex()
+            for question in self.__questions.values():
+                self.__index(question, question.fingerprint())
+
+        # and ones pickled when the tag index was a dictionary of tag -> idents need it converting
+        if isinstance(self.__tagIndex, dict):
+            self.__tagIndex = TagIndex.fromTags(self.__tagIndex, self.__questions)
 
     @property
     def questions(self):
         return list(self.__questions.values())
 
     def add(self, question):
-        if not question in self.__questions.values():
-            self.__questions[question.ident] = question
-            return True
-        return False
+        # a question is always stored under its own ident, so only that one entry needs checking for the same object
+        previous = self.__questions.get(question.ident)
+        if previous is question:
+            return False
+
+        # and any other question with the same content will be under the same fingerprint
+        fingerprint = question.fingerprint()
+        if self.findDuplicate(question, fingerprint) is not None:
+            return False
+
+        if previous is not None:
+            self.__unindex(previous)
+            if self.__textIndex is not None:
+                self.__textIndex.remove(previous.ident, previous.question)
+        self.__questions[question.ident] = question
+        self.__index(question, fingerprint)
+        if self.__textIndex is not None:
+            self.__textIndex.add(question.ident, question.question)
+        if self.__columns is not None:
+            self.__columns.add(question)
+        return True
+
+    def remove(self, ident):
+        question = self.__questions.pop(ident, None)
+        if question is not None:
+            self.__unindex(question)
+            if self.__tagIndex is not None:
+                self.__tagIndex.forget(ident)
+            if self.__textIndex is not None:
+                self.__textIndex.remove(ident, question.question)
+            if self.__columns is not None:
+                self.__columns.remove(ident)
+        return question
+
+    def setTags(self, ident, tags):
+        """Set the tags of the question with this ident, keeping the tag index up to date"""
+        question = self.__questions[ident]
+        self.__unindex(question)
+        question.setTags(tags)
+        # store it again so that storage backed collections write the change through
+        self.__questions[ident] = question
+        self.__index(question, question.fingerprint())
+        if self.__columns is not None:
+            self.__columns.add(question)
+        return question
 
     def __len__(self):
         return len(self.__questions)
 
     def findQuestionsByTag(self, tag):
-        tagged = []
-        for question in self.__questions.values():
-            if tag in question.getTags():
-                tagged.append(question)
-        return tagged
+        return [self.__questions[ident] for ident in self.getTagIndex().find(tag)]
+
+    def findQuestionsByQuery(self, query):
+        """Find the questions matching a search over tags like  algebra AND year7 AND NOT calculator,
+        given as a string or an already parsed TagQuery. Raises ValueError if the search isn't valid"""
+        if isinstance(query, str):
+            query = TagQuery.parse(query)
+        return [self.__questions[ident] for ident in self.getTagIndex().query(query)]
+
+    def findQuestionsByText(self, text, limit=50):
+        """Find the questions whose text best matches the words searched for, best first.
+        Words in quotes have to appear together in that order"""
+        return [self.__questions[ident] for ident, score in self.getTextIndex().search(text, limit)]
 
     def getQuestions(self):
         return self.__questions
 
+    def completeTags(self, prefix, limit=10):
+        """Suggest up to limit tags starting with prefix, with the most used first"""
+        return self.getTagIndex().complete(prefix, limit)
+
+    def getColumns(self):
+        """Returns QuestionColumns of every question, for totals and counts without going through each question"""
+        if self.__columns is None:
+            self.__columns = QuestionColumns.fromQuestions(self.__questions.values())
+        return self.__columns
 
-class QuestionBank(QuestionCollection):
+    def getTagIndex(self):
+        if self.__tagIndex is None:
+            # built from the questions the first time a collection without one is searched, then kept up to date
+            self.__tagIndex = TagIndex()
+            for question in self.__questions.values():
+                self.__tagIndex.add(question.ident, question.getTags())
+        return self.__tagIndex
+
+    def getTextIndex(self):
+        if self.__textIndex is None:
+            # built from the questions the first time a collection without one is searched, then kept up to date
+            self.__textIndex = TextIndex.deferred(lambda: None)
+        self.__textIndex.load(self.__questions)
+        return self.__textIndex
+
+    def getFingerprints(self):
+        return self.__fingerprints
+
+    def getItems(self):
+        return self.__questions
+
+    def __index(self, question, fingerprint):
+        self.indexFingerprint(question, fingerprint)
+        if self.__tagIndex is not None:
+            self.__tagIndex.add(question.ident, question.getTags())
+
+    def __unindex(self, question):
+        self.unindexFingerprint(question)
+        if self.__tagIndex is not None:
+            self.__tagIndex.discard(question.ident, question.getTags())
+
+
+class QuestionBank(StoredBank, QuestionCollection):
         """Singleton to create ONE list of questions to be used in the tests"""
         __instance = None
 
+        # the question bank is journaled, so saving after each new question only appends that question to the log,
+        # and its snapshot is indexed, so loading it only reads the index until questions are needed.
+        # Swap in a SqliteQuestionStorage to keep the bank in an indexed database instead
+        storage = IndexedJournalStorage('data/questionBank.txt')
+
+        # only the bank is searched often enough to keep its text indexed from the start
+        indexesText = True
+
         @classmethod
         def getInstance(cls):
-            if not cls.__instance:
-                try:
-                    # try and load from filesystem
-                    with open('data/questionBank.txt', 'rb') as qb:
-                        cls.__instance = pickle.load(qb)
-                except Exception:
-                    # new up a question bank
-                    cls.__instance = QuestionBank()
+            if cls.__instance is None:
+                # load the snapshot index from the filesystem and replay the journal on top of it
+                cls.__instance = cls.storage.load(cls)
             return cls.__instance
 
-        def save(self):
-            # pickle and save to filesystem
-            with open('data/questionBank.txt', 'wb') as qb:
-                pickle.dump(self.__instance, qb, pickle.HIGHEST_PROTOCOL)
+        @classmethod
+        def useStorage(cls, storage):
+            """Switch to another storage, such as a MappedSnapshotStorage in a worker process.
+            The bank is loaded from it the next time getInstance is called"""
+            cls.storage = storage
+            cls.__instance = None
+
+        # add, save and flush go through the storage as StoredBank's do
+
+        # called with each question after it's removed from the bank, so that tests using it can keep their own copy.
+        # Only removals from the one instance count, not those replayed while a bank is loaded
+        removalListeners = []
+
+        def remove(self, ident):
+            with type(self).storage.lock:
+                question = super().remove(ident)
+                if question is not None and type(self).__instance is self:
+                    for listener in type(self).removalListeners:
+                        listener(question)
+                return question
+
+        def setTags(self, ident, tags):
+            with type(self).storage.lock:
+                question = super().setTags(ident, tags)
+                type(self).storage.stage(question)
+                return question
+
+        def findQuestionsByTag(self, tag):
+            # let the storage answer from its own tag index if it has one
+            idents = type(self).storage.identsForTag(tag)
+            if idents is None:
+                return super().findQuestionsByTag(tag)
+
+            questions = self.getQuestions()
+            return [questions[ident] for ident in idents]
+
+        def findQuestionsByQuery(self, query):
+            if isinstance(query, str):
+                query = TagQuery.parse(query)
+            idents = type(self).storage.identsForQuery(query)
+            if idents is None:
+                return super().findQuestionsByQuery(query)
+
+            questions = self.getQuestions()
+            return [questions[ident] for ident in idents]
+
+        def completeTags(self, prefix, limit=10):
+            tags = type(self).storage.completeTags(prefix, limit)
+            if tags is None:
+                return super().completeTags(prefix, limit)
+            return tags
+
+        def getColumns(self):
+            # built under the lock so that no change is missed while every question is read
+            with type(self).storage.lock:
+                return super().getColumns()
+
+        def findQuestionsByText(self, text, limit=50):
+            # the lock is held as the first search may read the text index in
+            with type(self).storage.lock:
+                idents = type(self).storage.identsForText(text, limit)
+                if idents is None:
+                    return super().findQuestionsByText(text, limit)
+
+            questions = self.getQuestions()
+            return [questions[ident] for ident in idents]
 
 
 class Question:
-    __identifiers = []
+    """A question in the bank
+
+    Questions use __slots__ rather than a __dict__ each, as a bank holds a great many of them, so every subclass
+    has to declare __slots__ too, even if it's empty. A list of answers is kept as a tuple.
+    They pickle as a dictionary of attribute -> value, the same as before they had slots, so both old and new
+    pickles load."""
+
+    __slots__ = ('_question', '_answer', '_points', '_tags', '_ident')
+    __identifiers = IdentifierAllocator('question')
 
     def __init__(self, question, answer, tags, points=10, ident=''):
         self._question = question
-        self._answer = answer
+        self._answer = Question.freeze(answer)
         self._points = points
-        self._tags = tags
+        self._tags = Question.internTags(tags)
 
         if ident:
             self._ident = ident
         else:
-            ident = random.randint(1000, 9999)
-            while ident in type(self).__identifiers:
-                ident = random.randint(1000, 9999)
-            type(self).__identifiers += [ident]
-            self._ident = "question" + str(ident)
+            self._ident = Question.__identifiers.allocate()
+
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        # a pickle of a slotted object without __getstate__ is a (__dict__, slots) pair
+        if isinstance(state, tuple):
+            state = dict(state[0] or {}, **(state[1] or {}))
+
+        # each question unpickled on its own gets its own copy of every tag, so share them again
+        state['_tags'] = Question.internTags(state.get('_tags', ()))
+        state['_answer'] = Question.freeze(state.get('_answer'))
+        for name, value in state.items():
+            setattr(self, name, value)
 
     @property
     def ident(self):
@@ -85,7 +314,10 @@ class Question:
         return self._tags
 
     def setTags(self, tags):
-        self._tags = tags
+        self._tags = Question.internTags(tags)
+
+    def getAnswer(self):
+        return self._answer
 
     def getPoints(self):
         return self._points
@@ -96,6 +328,34 @@ class Question:
     def clone(self):
         return copy.copy(self)
 
+    def fingerprint(self):
+        """Returns a stable hash of the question's content, which is the same for questions that duplicate each other"""
+        return Question.hashContent(type(self).__name__, self._question, self._answer, self._tags)
+
+    @staticmethod
+    def hashContent(*content):
+        """Static method that hashes the given values, ignoring the order of items in any lists or dictionaries
+        so that for example the same tags entered in a different order give the same hash"""
+        normalised = []
+        for value in content:
+            if isinstance(value, dict):
+                value = sorted((str(k), str(v)) for k, v in value.items())
+            elif isinstance(value, (list, tuple, set)):
+                value = sorted(str(v) for v in value)
+            normalised.append(value)
+        return hashlib.sha1(repr(normalised).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def freeze(values):
+        """Static method that turns a list into a tuple, leaving anything else as it is"""
+        return tuple(values) if isinstance(values, list) else values
+
+    @staticmethod
+    def internTags(tags):
+        """Static method that interns each tag, so that every question with a tag shares the one string.
+        Banks reuse a small set of tags across many questions, so this saves a string per tag per question"""
+        return [sys.intern(tag) if type(tag) is str else tag for tag in tags]
+
     @staticmethod
     def stringInputToList(x):
         """Static method that takes a string, splits on a comma and returns a list,
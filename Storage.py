@@ -0,0 +1,854 @@
+import io
+import os
+import pickle
+import sqlite3
+import struct
+import sys
+import threading
+import zlib
+from collections.abc import MutableMapping
+from question.TagQuery import TagIndex
+from question.TextSearch import TextIndex
+
+
+class CorruptStorageError(Exception):
+    """Raised when stored data fails its checksum or can't be read,
+    rather than quietly carrying on with an empty collection and overwriting the damaged file"""
+    pass
+
+
+class PickleStorage:
+    """Persists a whole collection as a single pickle file
+
+    This is the original storage format, every save re-pickles the entire collection.
+    The pickle is written after a header holding its length and CRC32, which is checked when it's loaded.
+    Files are written to a temporary file, synced and then renamed over the old one, so a crash part way through a
+    save leaves the previous file as it was.
+    Saves can run on a BackgroundWriter thread, so anything that changes the collection holds the storage's lock,
+    and the lock is held while the collection is pickled but not while the file is written."""
+
+    MAGIC = b'MZPK1\n'
+    FRAME = struct.Struct('<QI')
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+
+    def load(self, cls):
+        try:
+            # try and load from filesystem
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            # nothing saved yet, so new up an empty collection
+            return cls()
+        return self.unpickle(data)
+
+    def stage(self, item):
+        # nothing to do, the whole collection is written on save
+        pass
+
+    def stageRemoval(self, ident):
+        pass
+
+    def identsForTag(self, tag):
+        # a pickle has no index of its own, the collection has to search itself
+        return None
+
+    def identsForQuery(self, query):
+        return None
+
+    def identsForText(self, text, limit):
+        return None
+
+    def completeTags(self, prefix, limit):
+        return None
+
+    def save(self, collection):
+        with self.lock:
+            data = pickle.dumps(collection, pickle.HIGHEST_PROTOCOL)
+        self.write(self.path, self.frame(data))
+
+    def frame(self, data):
+        return self.MAGIC + self.FRAME.pack(len(data), zlib.crc32(data)) + data
+
+    def unpickle(self, data):
+        if data.startswith(self.MAGIC):
+            start = len(self.MAGIC) + self.FRAME.size
+            if len(data) < start:
+                raise CorruptStorageError('{} is truncated'.format(self.path))
+            length, checksum = self.FRAME.unpack(data[len(self.MAGIC):start])
+            data = data[start:]
+            if len(data) != length or zlib.crc32(data) != checksum:
+                raise CorruptStorageError('{} failed its checksum'.format(self.path))
+        # otherwise it was saved before checksums were added, and can only be checked by unpickling it
+
+        try:
+            return pickle.loads(data)
+        except Exception as e:
+            raise CorruptStorageError('{} could not be unpickled: {}'.format(self.path, e)) from e
+
+    def write(self, path, data):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+        self.syncDirectory(path)
+
+    @staticmethod
+    def syncDirectory(path):
+        """Static method that syncs the directory holding path, so that a rename into it is durable too"""
+        try:
+            descriptor = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+        except OSError:
+            # directories can't be opened on windows, where the rename is durable already
+            return
+        try:
+            os.fsync(descriptor)
+        except OSError:
+            pass
+        finally:
+            os.close(descriptor)
+
+
+class JournalStorage(PickleStorage):
+    """Persists a collection as a snapshot pickle plus an append-only log of changes
+
+    Items added or removed since the last save are staged, and save only appends those records to the log.
+    Once the log holds compactEvery records it is folded into a fresh snapshot and truncated, so that loading never
+    has to replay, and unpickle, more than that many records whatever the size of the collection.
+    Loading reads the snapshot and then replays the log on top of it.
+    Each log record is written after its length and CRC32. A record cut short at the very end of the log is what
+    a crash during an append leaves behind, so it is dropped, but a bad record anywhere else means corruption.
+    Loading never changes the log. A torn record is cut off by the next save, before it appends.
+    Staged records are only dropped once they're on disk, so a save that fails leaves them for the next one."""
+
+    PUT = 'put'
+    REMOVE = 'remove'
+    RECORD = struct.Struct('<II')
+
+    def __init__(self, path, compactEvery=500):
+        super().__init__(path)
+        self.logPath = os.path.splitext(path)[0] + '.log'
+        self.compactEvery = compactEvery
+        self.__pending = []
+        self.__logLength = 0
+        # where the good records in the log end, if a torn record after them has to be cut off before appending
+        self.__tornAt = None
+
+    def load(self, cls):
+        with self.lock:
+            # records staged but not written yet are kept, as they're changes the log doesn't have
+            pending, self.__pending = self.__pending, []
+            collection = self.loadSnapshot(cls)
+
+            # replay the log on top of the snapshot. A PUT replaces any existing item with the same ident,
+            # so replaying records that are already in the snapshot (after an interrupted compaction) is harmless
+            self.__logLength = 0
+            self.__tornAt = None
+            for record in self.__readLog():
+                self.__replay(collection, record)
+                self.__logLength += 1
+            # and then the staged records, so the collection has every change made before it was loaded
+            for record in pending:
+                self.__replay(collection, record)
+
+            # replaying goes through the collection, so throw away anything it staged
+            self.__pending = pending
+        return collection
+
+    def __replay(self, collection, record):
+        op, value = record
+        if op == self.PUT:
+            collection.remove(value.ident)
+            collection.add(value)
+        elif op == self.REMOVE:
+            collection.remove(value)
+
+    def stage(self, item):
+        self.__pending.append((self.PUT, item))
+
+    def stageRemoval(self, ident):
+        self.__pending.append((self.REMOVE, ident))
+
+    def save(self, collection):
+        # take everything staged so far, along with the state to snapshot if the log is due to be compacted.
+        # Anything staged after this point waits for the next save
+        with self.lock:
+            records = []
+            for record in self.__pending:
+                data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+                records.append(self.RECORD.pack(len(data), zlib.crc32(data)) + data)
+            snapshot = None
+            if self.__logLength + len(records) >= self.compactEvery:
+                snapshot = self.prepareSnapshot(collection)
+
+        if records:
+            directory = os.path.dirname(self.logPath)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.logPath, 'ab') as log:
+                if self.__tornAt is not None:
+                    log.truncate(self.__tornAt)
+                    self.__tornAt = None
+                start = log.tell()
+                try:
+                    log.write(b''.join(records))
+                    log.flush()
+                    os.fsync(log.fileno())
+                except BaseException:
+                    # part of the records may have been written, so cut them off before the next append,
+                    # and keep the records staged so that the next save tries them again
+                    self.__tornAt = start
+                    raise
+            self.__logLength += len(records)
+
+        # only now that they're on disk are the records taken off the staged ones
+        with self.lock:
+            del self.__pending[:len(records)]
+
+        if snapshot is not None:
+            self.compact(snapshot)
+
+    def compact(self, snapshot):
+        """Fold the log into a new snapshot and truncate the log"""
+        # the snapshot is durable before the log goes, and replaying the log again on top of it is harmless
+        self.saveSnapshot(snapshot)
+        open(self.logPath, 'wb').close()
+        self.__logLength = 0
+        self.__tornAt = None
+
+    def loadSnapshot(self, cls):
+        return PickleStorage.load(self, cls)
+
+    def prepareSnapshot(self, collection):
+        """Called with the lock held, returns whatever saveSnapshot needs to write the collection as it is now"""
+        return pickle.dumps(collection, pickle.HIGHEST_PROTOCOL)
+
+    def saveSnapshot(self, snapshot):
+        self.write(self.path, self.frame(snapshot))
+
+    def __readLog(self):
+        try:
+            with open(self.logPath, 'rb') as log:
+                data = log.read()
+        except FileNotFoundError:
+            return
+
+        position = 0
+        while position < len(data):
+            end = position + self.RECORD.size
+            if end <= len(data):
+                length, checksum = self.RECORD.unpack(data[position:end])
+                record = data[end:end + length]
+                if len(record) == length and zlib.crc32(record) == checksum:
+                    try:
+                        yield pickle.loads(record)
+                    except Exception as e:
+                        raise CorruptStorageError('{} has a record that could not be unpickled: {}'.format(
+                            self.logPath, e)) from e
+                    position = end + length
+                    continue
+
+                if end + length <= len(data) or self.__recordAfter(data, position):
+                    raise CorruptStorageError('{} has a bad record at offset {}'.format(self.logPath, position))
+
+            # a torn record from a crash during the last append. The log isn't changed here, as other processes
+            # may be reading it, but the record is cut off before anything is appended after it
+            self.__tornAt = position
+            return
+
+    def __recordAfter(self, data, position):
+        # whether a whole record with the right checksum starts anywhere after position, in which case the bad
+        # record at position isn't the last one, and its length rather than the end of the log is what's wrong
+        for start in range(position + 1, len(data) - self.RECORD.size + 1):
+            length, checksum = self.RECORD.unpack_from(data, start)
+            end = start + self.RECORD.size + length
+            if 0 < length and end <= len(data) and zlib.crc32(data[start + self.RECORD.size:end]) == checksum:
+                return True
+        return False
+
+
+class IndexedJournalStorage(JournalStorage):
+    """A JournalStorage for question collections whose snapshot can be loaded without reading every question
+
+    The snapshot starts with a header giving the position, length and CRC32 of an index at the end of the file.
+    The index holds each question's ident and the offset, length and CRC32 of its pickle, along with the collection's
+    tag and fingerprint indexes and the TagDictionary the question pickles were written with. Loading reads just the header and the index, and each question is unpickled
+    (and its checksum checked) the first time it's needed.
+    The collection's TextIndex is saved next to the snapshot, in a .search file that is only read the first time
+    the text is searched. The snapshot index records a token for the .search file it goes with, and if they
+    don't match, after a crash between writing the two, the TextIndex is rebuilt from the questions instead."""
+
+    MAGIC = b'MZQB2\n'
+    HEADER = struct.Struct('<QQI')
+
+    def __init__(self, path, compactEvery=500):
+        super().__init__(path, compactEvery)
+        self.searchPath = os.path.splitext(path)[0] + '.search'
+        self.tagDictionary = TagDictionary()
+
+    def loadSnapshot(self, cls):
+        try:
+            snapshot = open(self.path, 'rb')
+        except FileNotFoundError:
+            # still kept in a SnapshotMapping, so that questions already written aren't pickled again by compactions
+            return cls(SnapshotMapping(self.path, [], self.lock, self.tagDictionary))
+
+        with snapshot:
+            if snapshot.read(len(self.MAGIC)) != self.MAGIC:
+                # a bank saved as one big pickle, before snapshots were indexed
+                snapshot.seek(0)
+                return self.unpickle(snapshot.read())
+
+            header = snapshot.read(self.HEADER.size)
+            if len(header) != self.HEADER.size:
+                raise CorruptStorageError('{} is truncated'.format(self.path))
+            indexOffset, indexLength, checksum = self.HEADER.unpack(header)
+            snapshot.seek(indexOffset)
+            index = snapshot.read(indexLength)
+
+        if len(index) != indexLength or zlib.crc32(index) != checksum:
+            raise CorruptStorageError('{} failed its checksum'.format(self.path))
+        index = pickle.loads(index)
+
+        tags = index['tags']
+        if isinstance(tags, dict):
+            # snapshots saved before tags were indexed as bitmaps
+            tags = TagIndex.fromTags(tags, (record[0] for record in index['records']))
+
+        token = index.get('search')
+        text = TextIndex.deferred(lambda: self.loadTextIndex(token))
+
+        # snapshots from before tags were numbered have plain pickles, which load the same with an empty dictionary
+        self.tagDictionary = TagDictionary(index.get('tagDictionary', ()))
+        questions = SnapshotMapping(self.path, index['records'], self.lock, self.tagDictionary)
+        return cls(questions, index['fingerprints'], tags, text)
+
+    def loadTextIndex(self, token):
+        """Returns the TextIndex saved with the snapshot with this token, or None if it has to be rebuilt"""
+        try:
+            with open(self.searchPath, 'rb') as f:
+                saved = self.unpickle(f.read())
+        except (FileNotFoundError, CorruptStorageError):
+            return None
+
+        if token is None or not isinstance(saved, dict) or saved.get('token') != token:
+            return None
+        return saved['index']
+
+    def prepareSnapshot(self, collection):
+        # copy the entries and indexes, the questions themselves are pickled later without holding the lock
+        questions = collection.getQuestions()
+        if isinstance(questions, SnapshotMapping):
+            entries = questions.entries()
+        else:
+            entries = list(questions.items())
+        tags = collection.getTagIndex().copy()
+        text = collection.getTextIndex().copy()
+        return questions, entries, tags, text, dict(collection.getFingerprints())
+
+    def saveSnapshot(self, snapshot):
+        questions, entries, tags, text, fingerprints = snapshot
+
+        # numbers for any new tags are added before the questions using them are written
+        self.tagDictionary.update(tags.tags())
+
+        token = os.urandom(8).hex()
+        self.write(self.searchPath, self.frame(pickle.dumps({'token': token, 'index': text},
+                                                            pickle.HIGHEST_PROTOCOL)))
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # a bank that has never been saved has no records to copy from
+        copying = isinstance(questions, SnapshotMapping) and os.path.exists(self.path)
+        previous = open(self.path, 'rb') if copying else None
+        records = []
+        temporary = self.path + '.tmp'
+        try:
+            with open(temporary, 'wb') as f:
+                f.write(self.MAGIC)
+                f.write(self.HEADER.pack(0, 0, 0))
+
+                for ident, question in entries:
+                    if isinstance(question, tuple):
+                        # a question that was never loaded is copied across as it is, without unpickling it,
+                        # but it is checked so that a damaged record isn't carried into the new snapshot
+                        offset, length, checksum = question
+                        previous.seek(offset)
+                        record = previous.read(length)
+                        if len(record) != length or zlib.crc32(record) != checksum:
+                            raise CorruptStorageError('{} failed its checksum for {}'.format(self.path, ident))
+                    else:
+                        record = self.tagDictionary.dumps(question)
+                        checksum = zlib.crc32(record)
+                    records.append((ident, f.tell(), len(record), checksum))
+                    f.write(record)
+
+                indexOffset = f.tell()
+                index = pickle.dumps({'records': records, 'tags': tags.compact(), 'fingerprints': fingerprints,
+                                      'search': token, 'tagDictionary': list(self.tagDictionary.tags)},
+                                     pickle.HIGHEST_PROTOCOL)
+                f.write(index)
+                f.seek(len(self.MAGIC))
+                f.write(self.HEADER.pack(indexOffset, len(index), zlib.crc32(index)))
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            if previous is not None:
+                previous.close()
+
+        # questions still to be loaded have to be read from the new snapshot from now on
+        with self.lock:
+            os.replace(temporary, self.path)
+            if isinstance(questions, SnapshotMapping):
+                questions.rebase(self.path, records)
+        self.syncDirectory(self.path)
+
+
+class SnapshotMapping(MutableMapping):
+    """A dictionary of questions read on demand from an IndexedJournalStorage snapshot
+
+    Each entry starts as the (offset, length, checksum) of the question's pickle in the snapshot file,
+    and is replaced by the question itself the first time it is looked up.
+    A loaded question that hasn't been stored again since is still the same as its record in the snapshot, so
+    a compaction copies the record across rather than pickling the question again."""
+
+    def __init__(self, path, records, lock, tagDictionary):
+        self.__path = path
+        self.__lock = lock
+        self.__tagDictionary = tagDictionary
+        self.__questions = {ident: (offset, length, checksum) for ident, offset, length, checksum in records}
+        # ident -> record in the snapshot, of each loaded question that hasn't been stored since
+        self.__records = {}
+        # idents stored since the last call to entries, whose questions may not match what that snapshot writes
+        self.__stored = set()
+
+    def __getitem__(self, ident):
+        question = self.__questions[ident]
+        if isinstance(question, tuple):
+            # the snapshot can't be swapped for a new one while the question is being read
+            with self.__lock:
+                question = self.__questions[ident]
+                if isinstance(question, tuple):
+                    record = question
+                    question = self.__tagDictionary.loads(self.getRecord(ident))
+                    self.__questions[ident] = question
+                    self.__records[ident] = record
+        return question
+
+    def __setitem__(self, ident, question):
+        self.__questions[ident] = question
+        self.__records.pop(ident, None)
+        self.__stored.add(ident)
+
+    def __delitem__(self, ident):
+        del self.__questions[ident]
+        self.__records.pop(ident, None)
+        self.__stored.add(ident)
+
+    def __contains__(self, ident):
+        return ident in self.__questions
+
+    def __iter__(self):
+        return iter(self.__questions)
+
+    def __len__(self):
+        return len(self.__questions)
+
+    def entries(self):
+        """Returns a list of (ident, question) pairs, where questions that haven't been loaded,
+        or haven't been stored since, are (offset, length, checksum)"""
+        self.__stored = set()
+        return [(ident, self.__records.get(ident, question)) for ident, question in self.__questions.items()]
+
+    def getRecord(self, ident):
+        """Returns the pickled bytes of a question that hasn't been loaded yet, or None if it has"""
+        with self.__lock:
+            question = self.__questions[ident]
+            if not isinstance(question, tuple):
+                return None
+
+            offset, length, checksum = question
+            with open(self.__path, 'rb') as snapshot:
+                snapshot.seek(offset)
+                record = snapshot.read(length)
+
+        if len(record) != length or zlib.crc32(record) != checksum:
+            raise CorruptStorageError('{} failed its checksum for {}'.format(self.__path, ident))
+        return record
+
+    def rebase(self, path, records):
+        with self.__lock:
+            self.__path = path
+            for ident, offset, length, checksum in records:
+                if isinstance(self.__questions.get(ident), tuple):
+                    self.__questions[ident] = (offset, length, checksum)
+                elif ident in self.__questions and ident not in self.__stored:
+                    self.__records[ident] = (offset, length, checksum)
+                else:
+                    self.__records.pop(ident, None)
+
+
+class TagDictionary:
+    """Numbers the tags used in an IndexedJournalStorage snapshot, so that each question's pickle holds its tags
+    as small integers rather than repeating every tag's string in every record
+
+    Tags are only ever added, never renumbered, so records copied unchanged from an older snapshot stay valid.
+    Every question loaded with a tag gets the dictionary's one copy of the string."""
+
+    def __init__(self, tags=()):
+        self.tags = [sys.intern(tag) for tag in tags]
+        self.__numbers = {tag: number for number, tag in enumerate(self.tags)}
+
+    def update(self, tags):
+        for tag in tags:
+            if tag not in self.__numbers:
+                self.__numbers[tag] = len(self.tags)
+                self.tags.append(sys.intern(tag))
+
+    def dumps(self, item):
+        numbers = self.__numbers
+        data = io.BytesIO()
+        pickler = pickle.Pickler(data, pickle.HIGHEST_PROTOCOL)
+        # any string that is a tag is written as its number, which pickle stores as a persistent id
+        pickler.persistent_id = lambda value: numbers.get(value) if type(value) is str else None
+        pickler.dump(item)
+        return data.getvalue()
+
+    def loads(self, data):
+        unpickler = pickle.Unpickler(io.BytesIO(data))
+        unpickler.persistent_load = self.__tag
+        return unpickler.load()
+
+    def __tag(self, number):
+        try:
+            return self.tags[number]
+        except (IndexError, TypeError):
+            raise pickle.UnpicklingError('unknown tag number {!r}'.format(number))
+
+
+class SqliteStorage:
+    """Persists a collection as rows in a local SQLite database
+
+    Loading does not read any rows, the collection is handed a SqliteMapping which fetches items by ident on
+    demand. Adding or removing an item writes its row straight away, save then commits the transaction.
+    Items staged since the last save are written again if they've been changed in place since, but no others,
+    so a save costs the same however many items have been loaded.
+    Subclasses name the table and maintain any secondary index tables for their items.
+    The connection is shared with the BackgroundWriter thread, so it's only ever used with the lock held."""
+
+    table = None
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS questions (ident TEXT PRIMARY KEY, body BLOB NOT NULL);
+        CREATE TABLE IF NOT EXISTS question_tags (
+            tag TEXT NOT NULL,
+            ident TEXT NOT NULL,
+            PRIMARY KEY (tag, ident)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS question_tags_ident ON question_tags (ident);
+        CREATE INDEX IF NOT EXISTS question_tags_nocase ON question_tags (tag COLLATE NOCASE);
+        CREATE VIRTUAL TABLE IF NOT EXISTS question_text USING fts5 (text);
+        CREATE TABLE IF NOT EXISTS questions_fingerprints (
+            fingerprint TEXT PRIMARY KEY,
+            ident TEXT NOT NULL
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS tests (ident TEXT PRIMARY KEY, body BLOB NOT NULL);
+        CREATE TABLE IF NOT EXISTS test_questions (
+            test TEXT NOT NULL,
+            question TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (test, question)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS test_questions_question ON test_questions (question);
+        CREATE TABLE IF NOT EXISTS tests_fingerprints (
+            fingerprint TEXT PRIMARY KEY,
+            ident TEXT NOT NULL
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.__connection = None
+        self.__mapping = None
+
+    def connect(self):
+        if self.__connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.__connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.__connection.executescript(self.SCHEMA)
+        return self.__connection
+
+    def close(self):
+        with self.lock:
+            if self.__connection is not None:
+                self.__connection.close()
+                self.__connection = None
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connect().execute(sql, parameters).fetchall()
+
+    def modify(self, sql, parameters=()):
+        """Run a statement that changes rows, returning how many rows it changed"""
+        with self.lock:
+            return self.connect().execute(sql, parameters).rowcount
+
+    def load(self, cls):
+        self.__mapping = SqliteMapping(self)
+        return self.create(cls, self.__mapping)
+
+    def create(self, cls, mapping):
+        """Returns a new collection of the rows in mapping"""
+        return cls(mapping, SqliteFingerprints(self))
+
+    def stage(self, item):
+        # the mapping has already written the row, but the item could still be changed in place before the save
+        with self.lock:
+            if self.__mapping is not None:
+                self.__mapping.markChanged(item.ident)
+
+    def stageRemoval(self, ident):
+        pass
+
+    def identsForTag(self, tag):
+        return None
+
+    def identsForQuery(self, query):
+        return None
+
+    def identsForText(self, text, limit):
+        return None
+
+    def completeTags(self, prefix, limit):
+        return None
+
+    def index(self, cursor, item):
+        """Write the secondary index rows for item"""
+        pass
+
+    def unindex(self, cursor, ident):
+        """Delete the secondary index rows for ident"""
+        pass
+
+    def save(self, collection):
+        # staged items can be changed in place after they were added, so write back any that no longer match their row
+        with self.lock:
+            if self.__mapping is not None:
+                self.__mapping.flush()
+            self.connect().commit()
+
+
+class SqliteQuestionStorage(SqliteStorage):
+    """Stores questions with a tag table, so that tag searches are an indexed query,
+    and an FTS5 table of the question text with the same rowid as the question, for ranked text searches"""
+
+    table = 'questions'
+
+    def create(self, cls, mapping):
+        # tag and text searches are answered by the tag and FTS5 tables, so the collection doesn't index them too
+        return cls(mapping, SqliteFingerprints(self), indexed=False)
+
+    def load(self, cls):
+        collection = super().load(cls)
+
+        # a database from before the text was indexed has to have it added once
+        with self.lock:
+            if self.query('SELECT 1 FROM questions LIMIT 1') and not self.query('SELECT 1 FROM question_text LIMIT 1'):
+                cursor = self.connect().cursor()
+                for ident, body in self.query('SELECT ident, body FROM questions'):
+                    self.indexText(cursor, ident, pickle.loads(body).question)
+                self.connect().commit()
+        return collection
+
+    def index(self, cursor, item):
+        cursor.executemany('INSERT OR IGNORE INTO question_tags (tag, ident) VALUES (?, ?)',
+                           [(tag, item.ident) for tag in item.getTags()])
+        self.indexText(cursor, item.ident, item.question)
+
+    def indexText(self, cursor, ident, text):
+        cursor.execute('INSERT INTO question_text (rowid, text) SELECT rowid, ? FROM questions WHERE ident = ?',
+                       (text, ident))
+
+    def unindex(self, cursor, ident):
+        cursor.execute('DELETE FROM question_tags WHERE ident = ?', (ident,))
+        cursor.execute('DELETE FROM question_text WHERE rowid = (SELECT rowid FROM questions WHERE ident = ?)',
+                       (ident,))
+
+    def completeTags(self, prefix, limit):
+        # a range over the NOCASE index ignores case like the in memory index does, and is a search of the index
+        # rather than a LIKE over every tag
+        rows = self.query('SELECT tag FROM question_tags WHERE tag >= ? COLLATE NOCASE AND tag < ? COLLATE NOCASE '
+                          'GROUP BY tag ORDER BY COUNT(*) DESC, tag LIMIT ?', (prefix, prefix + '\U0010ffff', limit))
+        return [tag for tag, in rows]
+
+    def identsForText(self, text, limit):
+        # quoting every word keeps them from being read as FTS5 syntax
+        words, phrases = TextIndex.parse(text)
+        if not words:
+            return []
+        match = ' OR '.join('"{}"'.format(word) for word in words)
+        if phrases:
+            match = '({}) AND ({})'.format(' AND '.join('"{}"'.format(' '.join(phrase)) for phrase in phrases), match)
+
+        rows = self.query('SELECT q.ident FROM (SELECT rowid, rank FROM question_text WHERE question_text MATCH ? '
+                          'ORDER BY rank LIMIT ?) t JOIN questions q ON q.rowid = t.rowid ORDER BY t.rank',
+                          (match, limit))
+        return [ident for ident, in rows]
+
+    def identsForTag(self, tag):
+        rows = self.query('SELECT q.ident FROM question_tags t JOIN questions q ON q.ident = t.ident '
+                          'WHERE t.tag = ? ORDER BY q.rowid', (tag,))
+        return [ident for ident, in rows]
+
+    def identsForQuery(self, query):
+        # the query becomes compound selects over the tag table, which sqlite answers from its indexes
+        sql, parameters = self.compileQuery(query.tree)
+        rows = self.query('SELECT ident FROM questions WHERE ident IN ({}) ORDER BY rowid'.format(sql), parameters)
+        return [ident for ident, in rows]
+
+    def compileQuery(self, node):
+        kind = node[0]
+        if kind == 'tag':
+            return 'SELECT ident FROM question_tags WHERE tag = ?', [node[1]]
+        if kind == 'not':
+            sql, parameters = self.compileQuery(node[1])
+            return 'SELECT ident FROM questions EXCEPT SELECT ident FROM ({})'.format(sql), parameters
+
+        left, leftParameters = self.compileQuery(node[1])
+        right, rightParameters = self.compileQuery(node[2])
+        operator = 'INTERSECT' if kind == 'and' else 'UNION'
+        return ('SELECT ident FROM ({}) {} SELECT ident FROM ({})'.format(left, operator, right),
+                leftParameters + rightParameters)
+
+
+class SqliteTestStorage(SqliteStorage):
+    """Stores tests with a membership table recording which questions each test uses"""
+
+    table = 'tests'
+
+    def index(self, cursor, item):
+        cursor.executemany('INSERT INTO test_questions (test, question, position) VALUES (?, ?, ?)',
+                           [(item.ident, ident, position) for position, ident in enumerate(item.getQuestions())])
+
+    def unindex(self, cursor, ident):
+        cursor.execute('DELETE FROM test_questions WHERE test = ?', (ident,))
+
+
+class SqliteMapping(MutableMapping):
+    """A dictionary of items keyed by ident, backed by a SqliteStorage table
+
+    Items are unpickled on first access and then kept, so repeated lookups return the same object.
+    Each item written since the last flush keeps the body it was written with, so that flush only writes
+    those that have been changed in place since."""
+
+    def __init__(self, storage):
+        self.__storage = storage
+        self.__loaded = {}
+        # ident -> the body written for it, of each item changed since the last flush
+        self.__changed = {}
+
+    def __getitem__(self, ident):
+        if ident in self.__loaded:
+            return self.__loaded[ident]
+
+        rows = self.__storage.query('SELECT body FROM {} WHERE ident = ?'.format(self.__storage.table), (ident,))
+        if not rows:
+            raise KeyError(ident)
+
+        item = pickle.loads(rows[0][0])
+        self.__loaded[ident] = item
+        return item
+
+    def __setitem__(self, ident, item):
+        body = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+        self.__write(ident, item, body)
+        self.__loaded[ident] = item
+        self.__changed[ident] = body
+
+    def markChanged(self, ident):
+        """Check the item with this ident against its row on the next flush"""
+        self.__changed.setdefault(ident, None)
+
+    def __delitem__(self, ident):
+        with self.__storage.lock:
+            # unindexed while the row is still there, as the index rows can be keyed on its rowid
+            self.__storage.unindex(self.__storage.connect().cursor(), ident)
+            if not self.__storage.modify('DELETE FROM {} WHERE ident = ?'.format(self.__storage.table), (ident,)):
+                raise KeyError(ident)
+        self.__loaded.pop(ident, None)
+        self.__changed.pop(ident, None)
+
+    def __contains__(self, ident):
+        if ident in self.__loaded:
+            return True
+        return bool(self.__storage.query('SELECT 1 FROM {} WHERE ident = ?'.format(self.__storage.table), (ident,)))
+
+    def __iter__(self):
+        rows = self.__storage.query('SELECT ident FROM {} ORDER BY rowid'.format(self.__storage.table))
+        return (ident for ident, in rows)
+
+    def __len__(self):
+        return self.__storage.query('SELECT COUNT(*) FROM {}'.format(self.__storage.table))[0][0]
+
+    def flush(self):
+        changed, self.__changed = self.__changed, {}
+        for ident, body in changed.items():
+            item = self.__loaded.get(ident)
+            if item is None:
+                continue
+            current = pickle.dumps(item, pickle.HIGHEST_PROTOCOL)
+            if current != body:
+                self.__write(ident, item, current)
+
+    def __write(self, ident, item, body):
+        with self.__storage.lock:
+            cursor = self.__storage.connect().cursor()
+            cursor.execute('INSERT INTO {} (ident, body) VALUES (?, ?) '
+                           'ON CONFLICT (ident) DO UPDATE SET body = excluded.body'.format(self.__storage.table),
+                           (ident, body))
+            self.__storage.unindex(cursor, ident)
+            self.__storage.index(cursor, item)
+
+
+class SqliteFingerprints(MutableMapping):
+    """A dictionary of content fingerprint -> ident, backed by the fingerprints table of a SqliteStorage"""
+
+    def __init__(self, storage):
+        self.__storage = storage
+        self.__table = storage.table + '_fingerprints'
+
+    def __getitem__(self, fingerprint):
+        rows = self.__storage.query('SELECT ident FROM {} WHERE fingerprint = ?'.format(self.__table), (fingerprint,))
+        if not rows:
+            raise KeyError(fingerprint)
+        return rows[0][0]
+
+    def __setitem__(self, fingerprint, ident):
+        self.__storage.modify('INSERT INTO {} (fingerprint, ident) VALUES (?, ?) '
+                              'ON CONFLICT (fingerprint) DO UPDATE SET ident = excluded.ident'.format(self.__table),
+                              (fingerprint, ident))
+
+    def __delitem__(self, fingerprint):
+        if not self.__storage.modify('DELETE FROM {} WHERE fingerprint = ?'.format(self.__table), (fingerprint,)):
+            raise KeyError(fingerprint)
+
+    def __iter__(self):
+        rows = self.__storage.query('SELECT fingerprint FROM {}'.format(self.__table))
+        return (fingerprint for fingerprint, in rows)
+
+    def __len__(self):
+        return self.__storage.query('SELECT COUNT(*) FROM {}'.format(self.__table))[0][0]
@@ -0,0 +1,254 @@
+import json
+import os
+import queue
+import threading
+from question.Marking import BatchMarker
+from question.Storage import CorruptStorageError
+from question.Test import TestBank
+
+
+class SubmissionPipeline:
+    """Marks a file of submissions, one JSON object per line, writing a line of results for each
+
+    Each line looks like  {"test": test ident, "student": student, "answers": {question ident: answer}}.
+    The file goes through the stages read -> validate -> resolve -> mark -> aggregate -> write, each a generator
+    pulling from the one before, so only a batch of lines is ever held at once however big the file is.
+    Reading and validating run on a background thread ahead of the rest, handing batches over through a queue
+    of at most queueSize batches, so the reader waits whenever marking falls behind.
+
+    A line that isn't valid, names a test or question that doesn't exist, or can't be marked, gets a result
+    with an error rather than stopping the run. Results for each test are totalled as they go.
+    After each batch is written the checkpoint file records how far through the input and results files the
+    run got, along with the totals, so a run that crashed carries on from there when it's started again.
+    If the results file is shorter than the checkpoint says, results it counted have been lost, so run raises
+    CorruptStorageError rather than carrying on."""
+
+    __END = object()
+
+    def __init__(self, inputPath, resultsPath, checkpointPath=None, tests=None, batchSize=1000, queueSize=8,
+                 rule=None, tolerance=0):
+        self.inputPath = inputPath
+        self.resultsPath = resultsPath
+        self.checkpointPath = resultsPath + '.checkpoint' if checkpointPath is None else checkpointPath
+        self.tests = tests
+        self.batchSize = batchSize
+        self.queueSize = queueSize
+        self.rule = rule
+        self.tolerance = tolerance
+        self.__markers = {}
+
+    def run(self):
+        """Mark every submission not marked by an earlier run, returning the totals of every run so far:
+        a dictionary of test ident -> {'students', 'total', 'highest', 'lowest', 'outOf'}, and 'errors'"""
+        checkpoint = self.loadCheckpoint()
+        totals = checkpoint['totals']
+
+        with open(self.resultsPath, 'ab') as results:
+            # truncate would pad a file that's too short with zeros rather than complain
+            size = os.fstat(results.fileno()).st_size
+            if size < checkpoint['resultsSize']:
+                raise CorruptStorageError('{} is {} bytes but the checkpoint has {} bytes of results'.format(
+                    self.resultsPath, size, checkpoint['resultsSize']))
+            # drop anything written after the last checkpoint, as those lines will be marked again
+            results.truncate(checkpoint['resultsSize'])
+            batches = self.read(checkpoint['offset'])
+            batches = self.resolve(batches)
+            batches = self.mark(batches)
+            batches = self.aggregate(batches, totals)
+            for offset, batch in self.write(batches, results):
+                self.saveCheckpoint({'offset': offset, 'resultsSize': results.tell(), 'totals': totals})
+        return totals
+
+    def loadCheckpoint(self):
+        try:
+            with open(self.checkpointPath, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'offset': 0, 'resultsSize': 0, 'totals': {'errors': 0}}
+
+    def saveCheckpoint(self, checkpoint):
+        # written to a new file and renamed over the old one, so a crash leaves one or the other whole
+        temporary = self.checkpointPath + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.checkpointPath)
+
+    def read(self, offset):
+        """Yields (offset after the batch, [(offset of the line, submission or error)]) for each batch of lines
+        from offset on, read and validated on a background thread"""
+        batches = queue.Queue(self.queueSize)
+        stop = threading.Event()
+
+        def put(item):
+            # wait for room, but give up if the pipeline has been closed
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for batch in self.validate(self.readLines(offset)):
+                    if not put(batch):
+                        return
+                put(SubmissionPipeline.__END)
+            except BaseException as error:
+                put(error)
+
+        thread = threading.Thread(target=produce, name='SubmissionPipeline', daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is SubmissionPipeline.__END:
+                    return
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+
+    def readLines(self, offset):
+        """Yields (offset of the line, offset after it, line) for each line of the input from offset on"""
+        with open(self.inputPath, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                yield offset, offset + len(line), line
+                offset += len(line)
+
+    def validate(self, lines):
+        """Groups lines into batches, turning each into a submission or an error"""
+        batch = []
+        end = None
+        for start, end, line in lines:
+            if not line.strip():
+                continue
+            batch.append((start, SubmissionPipeline.parse(line)))
+            if len(batch) >= self.batchSize:
+                yield end, batch
+                batch = []
+        if batch:
+            yield end, batch
+
+    @staticmethod
+    def parse(line):
+        """Static method that returns a line's submission as (test ident, student, answers),
+        or the error as a string if it isn't valid"""
+        try:
+            submission = json.loads(line)
+        except ValueError as error:
+            return 'not valid JSON: {}'.format(error)
+        if not isinstance(submission, dict):
+            return 'not a JSON object'
+
+        test = submission.get('test')
+        student = submission.get('student')
+        answers = submission.get('answers')
+        if not isinstance(test, str) or not test:
+            return 'no test'
+        if not isinstance(student, (str, int)) or isinstance(student, bool) or student == '':
+            return 'no student'
+        if not isinstance(answers, dict):
+            return 'no answers'
+        for ident, answer in answers.items():
+            if isinstance(answer, list):
+                valid = all(SubmissionPipeline.__isValue(item) for item in answer)
+            else:
+                valid = answer is None or SubmissionPipeline.__isValue(answer)
+            if not valid:
+                return 'the answer to question {} isn\'t text, a number or a list of them'.format(ident)
+        return test, str(student), answers
+
+    @staticmethod
+    def __isValue(answer):
+        return isinstance(answer, (str, int, float)) and not isinstance(answer, bool)
+
+    def resolve(self, batches):
+        """Checks each submission's test exists and that it only answers questions in that test"""
+        tests = TestBank.getInstance().getTests() if self.tests is None else self.tests
+        for offset, batch in batches:
+            resolved = []
+            for start, submission in batch:
+                if isinstance(submission, tuple):
+                    test, student, answers = submission
+                    if test not in tests:
+                        submission = 'there is no test {}'.format(test)
+                    else:
+                        questions = tests[test].getQuestions()
+                        unknown = [ident for ident in answers if ident not in questions]
+                        if unknown:
+                            submission = 'question {} is not in test {}'.format(unknown[0], test)
+                resolved.append((start, submission))
+            yield offset, resolved
+
+    def mark(self, batches):
+        """Marks the submissions in each batch, a test at a time, turning each into a result"""
+        tests = TestBank.getInstance().getTests() if self.tests is None else self.tests
+        for offset, batch in batches:
+            byTest = {}
+            for index, (start, submission) in enumerate(batch):
+                if isinstance(submission, tuple):
+                    byTest.setdefault(submission[0], []).append(index)
+
+            results = [{'offset': start, 'error': submission} if isinstance(submission, str) else None
+                       for start, submission in batch]
+            for test, indexes in byTest.items():
+                try:
+                    marker = self.__marker(tests, test)
+                    marked = marker.mark([batch[index][1][1:] for index in indexes])
+                except Exception:
+                    # mark them one at a time instead, so only the submissions that can't be marked get an error
+                    for index in indexes:
+                        results[index] = self.__markOne(tests, batch[index])
+                    continue
+                outOf = marker.key.total()
+                for index, student, score in zip(indexes, marked.students, marked.scores):
+                    results[index] = {'test': test, 'student': student, 'score': score, 'outOf': outOf}
+            yield offset, results
+
+    def __marker(self, tests, test):
+        marker = self.__markers.get(test)
+        if marker is None:
+            marker = self.__markers[test] = BatchMarker(tests[test], self.rule, tolerance=self.tolerance)
+        return marker
+
+    def __markOne(self, tests, line):
+        start, (test, student, answers) = line
+        try:
+            marker = self.__marker(tests, test)
+            marked = marker.mark([(student, answers)])
+        except Exception as error:
+            return {'offset': start, 'error': 'couldn\'t be marked: {}'.format(error)}
+        return {'test': test, 'student': marked.students[0], 'score': marked.scores[0], 'outOf': marker.key.total()}
+
+    def aggregate(self, batches, totals):
+        """Adds each result to the totals for its test as it passes through"""
+        for offset, results in batches:
+            for result in results:
+                if 'error' in result:
+                    totals['errors'] += 1
+                    continue
+                score = result['score']
+                test = totals.get(result['test'])
+                if test is None:
+                    totals[result['test']] = {'students': 1, 'total': score, 'highest': score, 'lowest': score,
+                                              'outOf': result['outOf']}
+                else:
+                    test['students'] += 1
+                    test['total'] += score
+                    test['highest'] = max(test['highest'], score)
+                    test['lowest'] = min(test['lowest'], score)
+            yield offset, results
+
+    def write(self, batches, results):
+        """Writes each batch of results, making sure they're on disk before the batch is passed on"""
+        for offset, batch in batches:
+            results.write(''.join(json.dumps(result) + '\n' for result in batch).encode('utf-8'))
+            results.flush()
+            os.fsync(results.fileno())
+            yield offset, batch
@@ -0,0 +1,382 @@
+import bisect
+import heapq
+import re
+
+
+class Bitmap:
+    """A set of non-negative integers, stored as one bitmap per block of 1024 numbers
+
+    Only blocks with something in them are kept, so a tag used by a handful of questions stays small
+    while AND, OR and NOT on tags used by most of the bank are a few bitwise operations per block."""
+
+    BLOCK_BITS = 10
+    BLOCK_MASK = (1 << BLOCK_BITS) - 1
+
+    def __init__(self, blocks=None):
+        # block number -> int with a bit set for each number in that block
+        self.__blocks = {} if blocks is None else blocks
+
+    def add(self, n):
+        block = n >> Bitmap.BLOCK_BITS
+        self.__blocks[block] = self.__blocks.get(block, 0) | (1 << (n & Bitmap.BLOCK_MASK))
+
+    def discard(self, n):
+        block = n >> Bitmap.BLOCK_BITS
+        bits = self.__blocks.get(block, 0) & ~(1 << (n & Bitmap.BLOCK_MASK))
+        if bits:
+            self.__blocks[block] = bits
+        else:
+            self.__blocks.pop(block, None)
+
+    def copy(self):
+        return Bitmap(dict(self.__blocks))
+
+    def __contains__(self, n):
+        return bool(self.__blocks.get(n >> Bitmap.BLOCK_BITS, 0) >> (n & Bitmap.BLOCK_MASK) & 1)
+
+    def __and__(self, other):
+        small, large = sorted((self.__blocks, other.__blocks), key=len)
+        blocks = {}
+        for block, bits in small.items():
+            bits &= large.get(block, 0)
+            if bits:
+                blocks[block] = bits
+        return Bitmap(blocks)
+
+    def __or__(self, other):
+        blocks = dict(self.__blocks)
+        for block, bits in other.__blocks.items():
+            blocks[block] = blocks.get(block, 0) | bits
+        return Bitmap(blocks)
+
+    def __sub__(self, other):
+        blocks = {}
+        for block, bits in self.__blocks.items():
+            bits &= ~other.__blocks.get(block, 0)
+            if bits:
+                blocks[block] = bits
+        return Bitmap(blocks)
+
+    def __iter__(self):
+        # numbers come out in ascending order
+        for block in sorted(self.__blocks):
+            bits = self.__blocks[block]
+            base = block << Bitmap.BLOCK_BITS
+            while bits:
+                lowest = bits & -bits
+                yield base + lowest.bit_length() - 1
+                bits ^= lowest
+
+    def __len__(self):
+        return sum(bin(bits).count('1') for bits in self.__blocks.values())
+
+    def __bool__(self):
+        return bool(self.__blocks)
+
+    def __eq__(self, other):
+        return isinstance(other, Bitmap) and self.__blocks == other.__blocks
+
+
+class TagIndex:
+    """An index of tag -> the idents of the questions with that tag, kept as a Bitmap per tag
+
+    Each ident is given a position in the order it was first indexed, and the bitmaps are sets of positions,
+    so questions come back in the order they were added. Positions of removed idents are not reused.
+    The index also counts how many questions have each tag and keeps the tags in a sorted list,
+    so that the tags starting with what has been typed so far can be found with a binary search.
+    The tags suggested for each prefix are kept until the count of a tag starting with it changes, as a short
+    prefix can match most of the tags."""
+
+    # prefixes whose suggestions are kept, beyond this they're all dropped and found again as they're typed
+    COMPLETIONS = 256
+
+    def __init__(self):
+        self.__idents = []
+        self.__positions = {}
+        self.__tags = {}
+        self.__counts = {}
+        # (tag in lower case, tag), sorted
+        self.__sorted = []
+        self.__all = Bitmap()
+        # (prefix in lower case, limit) -> the tags suggested for it
+        self.__completions = {}
+
+    @classmethod
+    def fromTags(cls, tags, idents=()):
+        """Builds an index from a dictionary of tag -> idents, along with any idents that have no tags"""
+        index = cls()
+        for ident in idents:
+            index.__position(ident)
+        for tag, tagged in tags.items():
+            for ident in tagged:
+                index.__addTag(tag, index.__position(ident))
+        return index
+
+    def __getstate__(self):
+        return {'idents': self.__idents, 'tags': self.__tags, 'counts': self.__counts}
+
+    def __setstate__(self, state):
+        self.__idents = state['idents']
+        self.__tags = state['tags']
+        # indexes saved before tags were counted need counting once
+        self.__counts = state.get('counts') or {tag: len(bitmap) for tag, bitmap in self.__tags.items()}
+        self.__sorted = sorted((tag.casefold(), tag) for tag in self.__tags)
+        self.__completions = {}
+        self.__positions = {}
+        self.__all = Bitmap()
+        for position, ident in enumerate(self.__idents):
+            if ident is not None:
+                self.__positions[ident] = position
+                self.__all.add(position)
+
+    def copy(self):
+        index = TagIndex()
+        index.__setstate__({'idents': list(self.__idents),
+                            'tags': {tag: bitmap.copy() for tag, bitmap in self.__tags.items()},
+                            'counts': dict(self.__counts)})
+        return index
+
+    def compact(self):
+        """Returns a copy without the gaps left by removed idents, or this index if it has few enough of them"""
+        if len(self.__positions) * 2 >= len(self.__idents):
+            return self
+
+        renumbered = {}
+        for ident in self.__idents:
+            if ident is not None:
+                renumbered[self.__positions[ident]] = len(renumbered)
+        tags = {}
+        for tag, bitmap in self.__tags.items():
+            tags[tag] = Bitmap()
+            for position in bitmap:
+                tags[tag].add(renumbered[position])
+
+        index = TagIndex()
+        index.__setstate__({'idents': [ident for ident in self.__idents if ident is not None], 'tags': tags,
+                            'counts': self.__counts})
+        return index
+
+    def add(self, ident, tags):
+        """Index ident under each of tags. Every ident should be added, even with no tags, so that NOT can find it"""
+        position = self.__position(ident)
+        for tag in tags:
+            self.__addTag(tag, position)
+
+    def discard(self, ident, tags):
+        position = self.__positions.get(ident)
+        if position is None:
+            return
+        for tag in tags:
+            bitmap = self.__tags.get(tag)
+            if bitmap is None or position not in bitmap:
+                continue
+
+            bitmap.discard(position)
+            self.__counts[tag] -= 1
+            self.__countChanged(tag)
+            if not bitmap:
+                del self.__tags[tag]
+                del self.__counts[tag]
+                del self.__sorted[bisect.bisect_left(self.__sorted, (tag.casefold(), tag))]
+
+    def forget(self, ident):
+        """Remove ident altogether, once it has been discarded from all of its tags.
+        Its position is left as a gap rather than moving everything after it"""
+        position = self.__positions.pop(ident, None)
+        if position is not None:
+            self.__idents[position] = None
+            self.__all.discard(position)
+
+    def __len__(self):
+        return len(self.__positions)
+
+    def find(self, tag):
+        return self.idents(self.__tags.get(tag, Bitmap()))
+
+    def query(self, query):
+        """Returns the idents matching a TagQuery, in the order they were indexed"""
+        return self.idents(query.evaluate(self))
+
+    def idents(self, bitmap):
+        return [self.__idents[position] for position in bitmap]
+
+    def bitmap(self, tag):
+        return self.__tags.get(tag, Bitmap())
+
+    def everything(self):
+        return self.__all
+
+    def tags(self):
+        return self.__tags.keys()
+
+    def count(self, tag):
+        return self.__counts.get(tag, 0)
+
+    def complete(self, prefix, limit=10):
+        """Returns up to limit tags starting with prefix, ignoring case, with the most used first"""
+        folded = prefix.casefold()
+        completions = self.__completions.get((folded, limit))
+        if completions is None:
+            start = bisect.bisect_left(self.__sorted, (folded,))
+            end = bisect.bisect_left(self.__sorted, (folded + '\U0010ffff',))
+            # nlargest keeps tags used equally often in alphabetical order
+            matches = heapq.nlargest(limit, self.__sorted[start:end], key=lambda entry: self.__counts[entry[1]])
+            completions = [tag for folded, tag in matches]
+            if len(self.__completions) >= TagIndex.COMPLETIONS:
+                self.__completions.clear()
+            self.__completions[(folded, limit)] = completions
+        return list(completions)
+
+    def __contains__(self, tag):
+        return tag in self.__tags
+
+    def __addTag(self, tag, position):
+        bitmap = self.__tags.get(tag)
+        if bitmap is None:
+            bitmap = self.__tags[tag] = Bitmap()
+            self.__counts[tag] = 0
+            bisect.insort(self.__sorted, (tag.casefold(), tag))
+        elif position in bitmap:
+            return
+        bitmap.add(position)
+        self.__counts[tag] += 1
+        self.__countChanged(tag)
+
+    def __countChanged(self, tag):
+        # only the suggestions for prefixes of the tag can change
+        if self.__completions:
+            folded = tag.casefold()
+            for key in [key for key in self.__completions if folded.startswith(key[0])]:
+                del self.__completions[key]
+
+    def __position(self, ident):
+        position = self.__positions.get(ident)
+        if position is None:
+            position = len(self.__idents)
+            self.__idents.append(ident)
+            self.__positions[ident] = position
+            self.__all.add(position)
+        return position
+
+
+class TagQuery:
+    """A parsed search over tags, such as  algebra AND year7 AND NOT calculator
+
+    AND, OR and NOT must be in capitals and NOT binds tightest, then AND, then OR, with brackets to group.
+    Words next to each other make one tag, so a search for just  times tables  finds that tag as it did before,
+    and a tag can be put in quotes if it has brackets or capital AND, OR or NOT in it."""
+
+    KEYWORDS = ('AND', 'OR', 'NOT')
+    TOKENS = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+
+    def __init__(self, tree):
+        # nested tuples of ('tag', tag), ('not', a), ('and', a, b) and ('or', a, b)
+        self.tree = tree
+
+    @classmethod
+    def parse(cls, text):
+        """Parses the query, raising ValueError if it isn't valid"""
+        tokens = cls.__tokenize(text)
+        if not tokens:
+            raise ValueError('the search is empty')
+
+        tree, position = cls.__parseOr(tokens, 0)
+        if position < len(tokens):
+            raise ValueError('unexpected {!r} in the search'.format(tokens[position][1]))
+        return cls(tree)
+
+    def evaluate(self, index):
+        """Returns the Bitmap of positions in a TagIndex that match the query"""
+        return TagQuery.__evaluate(self.tree, index)
+
+    def tags(self):
+        """Returns every tag the query mentions"""
+        found = []
+        stack = [self.tree]
+        while stack:
+            node = stack.pop()
+            if node[0] == 'tag':
+                found.append(node[1])
+            else:
+                stack.extend(node[1:])
+        return found
+
+    @staticmethod
+    def __evaluate(node, index):
+        kind = node[0]
+        if kind == 'tag':
+            return index.bitmap(node[1])
+        if kind == 'not':
+            return index.everything() - TagQuery.__evaluate(node[1], index)
+
+        left, right = node[1], node[2]
+        if kind == 'and':
+            # a AND NOT b is a difference, rather than building everything that isn't b first
+            if right[0] == 'not':
+                return TagQuery.__evaluate(left, index) - TagQuery.__evaluate(right[1], index)
+            if left[0] == 'not':
+                return TagQuery.__evaluate(right, index) - TagQuery.__evaluate(left[1], index)
+            return TagQuery.__evaluate(left, index) & TagQuery.__evaluate(right, index)
+        return TagQuery.__evaluate(left, index) | TagQuery.__evaluate(right, index)
+
+    @classmethod
+    def __tokenize(cls, text):
+        # each token is (kind, value) where kind is '(', ')', a keyword or 'tag'
+        tokens = []
+        words = []
+        position = 0
+        text = text.strip()
+        while position < len(text):
+            match = cls.TOKENS.match(text, position)
+            if match is None:
+                raise ValueError('unmatched " in the search')
+            position = match.end()
+            opening, closing, quoted, word = match.groups()
+
+            if word is not None and word not in cls.KEYWORDS:
+                words.append(word)
+                continue
+            if words:
+                tokens.append(('tag', ' '.join(words)))
+                words = []
+            if quoted is not None:
+                tokens.append(('tag', quoted))
+            else:
+                tokens.append((opening or closing or word, opening or closing or word))
+        if words:
+            tokens.append(('tag', ' '.join(words)))
+        return tokens
+
+    @classmethod
+    def __parseOr(cls, tokens, position):
+        tree, position = cls.__parseAnd(tokens, position)
+        while position < len(tokens) and tokens[position][0] == 'OR':
+            right, position = cls.__parseAnd(tokens, position + 1)
+            tree = ('or', tree, right)
+        return tree, position
+
+    @classmethod
+    def __parseAnd(cls, tokens, position):
+        tree, position = cls.__parseNot(tokens, position)
+        while position < len(tokens) and tokens[position][0] == 'AND':
+            right, position = cls.__parseNot(tokens, position + 1)
+            tree = ('and', tree, right)
+        return tree, position
+
+    @classmethod
+    def __parseNot(cls, tokens, position):
+        if position >= len(tokens):
+            raise ValueError('the search ends too early')
+
+        kind, value = tokens[position]
+        if kind == 'NOT':
+            tree, position = cls.__parseNot(tokens, position + 1)
+            return ('not', tree), position
+        if kind == '(':
+            tree, position = cls.__parseOr(tokens, position + 1)
+            if position >= len(tokens) or tokens[position][0] != ')':
+                raise ValueError('missing ) in the search')
+            return tree, position + 1
+        if kind == 'tag':
+            return ('tag', value), position + 1
+        raise ValueError('unexpected {!r} in the search'.format(value))
@@ -1,19 +1,49 @@
-from question.Question import QuestionCollection
-import pickle
-import random
+from collections.abc import MutableMapping
+from question.Bank import FingerprintedCollection, StoredBank
+from question.Identifier import IdentifierAllocator
+from question.Question import Question, QuestionBank, QuestionCollection
+from question.Storage import PickleStorage
 
 
-class TestCollection:
-    """A wrapper around a dictionary of Tests"""
+class TestCollection(FingerprintedCollection):
+    """A wrapper around a dictionary of Tests, with an index of content fingerprint -> test ident"""
 
-    def __init__(self):
-        self.__tests = {}
+    def __init__(self, tests=None, fingerprints=None):
+        self.__tests = {} if tests is None else tests
+        self.__fingerprints = {} if fingerprints is None else fingerprints
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        # collections pickled before the fingerprint index existed need it building once
+        try:
+            self.__fingerprints
+        except AttributeError:
+            self.__fingerprints = {}
+            for test in self.__tests.values():
+                self.indexFingerprint(test, test.fingerprint())
 
     def add(self, test):
-        if not test in self.__tests.values():
-            self.__tests[test.ident] = test
-            return True
-        return False
+        # a test is always stored under its own ident, so only that one entry needs checking for the same object
+        previous = self.__tests.get(test.ident)
+        if previous is test:
+            return False
+
+        # and any other test with the same content will be under the same fingerprint
+        if self.findDuplicate(test, test.fingerprint()) is not None:
+            return False
+
+        if previous is not None:
+            self.unindexFingerprint(previous)
+        self.__tests[test.ident] = test
+        self.indexFingerprint(test, test.fingerprint())
+        return True
+
+    def remove(self, ident):
+        test = self.__tests.pop(ident, None)
+        if test is not None:
+            self.unindexFingerprint(test)
+        return test
 
     def __len__(self):
         return len(self.__tests)
@@ -21,31 +51,43 @@ class TestCollection:
     def getTests(self):
         return self.__tests
 
+    def getItems(self):
+        return self.__tests
 
-class TestBank(TestCollection):
+    def getFingerprints(self):
+        return self.__fingerprints
+
+
+class TestBank(StoredBank, TestCollection):
     """Singleton to create ONE list of tests"""
     __instance = None
 
+    # swap in a SqliteTestStorage to keep the tests in an indexed database instead
+    storage = PickleStorage('data/testBank.txt')
+
     @classmethod
     def getInstance(cls):
-        if not cls.__instance:
-            try:
-                # try and load from filesystem
-                with open('data/testBank.txt', 'rb') as qb:
-                    cls.__instance = pickle.load(qb)
-            except Exception:
-                # new up a test bank
-                cls.__instance = TestBank()
+        if cls.__instance is None:
+            cls.__instance = cls.storage.load(cls)
         return cls.__instance
 
-    def save(self):
-        # pickle and save to filesystem
-        with open('data/testBank.txt', 'wb') as qb:
-            pickle.dump(self.__instance, qb, pickle.HIGHEST_PROTOCOL)
+    @classmethod
+    def keepRemovedQuestion(cls, question):
+        """Give every test that uses a question removed from the QuestionBank its own copy of it, and save them,
+        as a test only stores the idents of the questions that are in the bank"""
+        bank = cls.getInstance()
+        kept = False
+        with cls.storage.lock:
+            for test in bank.getTests().values():
+                if test.getQuestions().keep(question):
+                    cls.storage.stage(test)
+                    kept = True
+        if kept:
+            bank.save()
 
 
 class Test(QuestionCollection):
-    __identifiers = []
+    __identifiers = IdentifierAllocator('test')
     __name = ''
     __currentDate = None
     __currentClass = None
@@ -54,21 +96,29 @@ class Test(QuestionCollection):
     __history = None
 
     def __init__(self, ident=''):
-        super().__init__()
+        # the test only holds references to questions in the QuestionBank, rather than its own copies
+        super().__init__(QuestionReferences())
 
         if ident:
             self.__ident = ident
         else:
-            ident = random.randint(1000, 9999)
-            while ident in type(self).__identifiers:
-                ident = random.randint(1000, 9999)
-            type(self).__identifiers += [ident]
-            self.__ident = "test" + str(ident)
+            self.__ident = Test.__identifiers.allocate()
+
+    def __setstate__(self, state):
+        # tests pickled before questions were stored by reference have a dictionary of their own copies
+        questions = state.get('_QuestionCollection__questions')
+        if isinstance(questions, dict):
+            state['_QuestionCollection__questions'] = QuestionReferences(questions)
+        super().__setstate__(state)
 
     @property
     def ident(self):
         return self.__ident
 
+    def fingerprint(self):
+        """Returns a stable hash of the test's name and questions, which is the same for tests that duplicate each other"""
+        return Question.hashContent(type(self).__name__, self.getName(), list(self.getQuestions()))
+
     def getName(self):
         return self.__name
 
@@ -106,8 +156,58 @@ class Test(QuestionCollection):
         self.__history = value
 
 
+class QuestionReferences(MutableMapping):
+    """A dictionary of questions in a Test, which only pickles the idents of the questions
+
+    After unpickling each question is looked up in the QuestionBank the first time it is needed, so every test
+    shares the bank's copy of a question. Questions that aren't in the bank are pickled in full instead, and the
+    tests in the TestBank are given their own copy of any question removed from the bank."""
+
+    def __init__(self, questions=None):
+        # ident -> question, or None if the question hasn't been looked up yet
+        self.__questions = dict(questions or {})
+
+    def __getstate__(self):
+        bank = QuestionBank.getInstance().getQuestions()
+        return [(ident, None if ident in bank else question) for ident, question in self.__questions.items()]
+
+    def __setstate__(self, state):
+        self.__questions = dict(state)
+
+    def keep(self, question):
+        """Hold on to a question that is leaving the bank, returning whether this test uses it"""
+        if question.ident not in self.__questions:
+            return False
+        self.__questions[question.ident] = question
+        return True
+
+    def __getitem__(self, ident):
+        question = self.__questions[ident]
+        if question is None:
+            question = QuestionBank.getInstance().getQuestions()[ident]
+            self.__questions[ident] = question
+        return question
+
+    def __setitem__(self, ident, question):
+        self.__questions[ident] = question
+
+    def __delitem__(self, ident):
+        del self.__questions[ident]
+
+    def __contains__(self, ident):
+        return ident in self.__questions
+
+    def __iter__(self):
+        return iter(self.__questions)
+
+    def __len__(self):
+        return len(self.__questions)
+
+
 class TestHistory:
     def __init__(self):
         self.usedBy = None
         self.previousResults = None
 
+
+QuestionBank.removalListeners.append(TestBank.keepRemovedQuestion)
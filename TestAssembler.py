@@ -0,0 +1,202 @@
+import bisect
+import random
+from question.Columns import QuestionColumns
+from question.Question import QuestionBank
+from question.Test import Test
+
+
+class TestRequirements:
+    """What a generated test has to contain, such as 20 questions worth 200 points, at least 5 of them tagged
+    geometry, all from the questions matching the tag search  year9
+
+    points can be None for any total, and a total within tolerance of points is close enough.
+    minimumTags is a dictionary of tag -> the fewest questions in the test that have that tag.
+    Raises ValueError for requirements no test could meet, such as fewer than one question."""
+
+    def __init__(self, questions, points=None, query=None, minimumTags=None, tolerance=0):
+        self.questions = questions
+        self.points = points
+        self.query = query
+        self.minimumTags = dict(minimumTags or {})
+        self.tolerance = tolerance
+
+        if questions < 1:
+            raise ValueError('a test needs at least one question, not {}'.format(questions))
+        if tolerance < 0:
+            raise ValueError('the tolerance can\'t be negative')
+        for tag, minimum in self.minimumTags.items():
+            if minimum > questions:
+                raise ValueError('a test of {} questions can\'t have {} tagged {}'.format(questions, minimum, tag))
+
+
+class CandidatePool:
+    """The questions a test can be assembled from, numbered, with their points and required tags looked up once
+
+    byTag holds the numbers of the candidates with each required tag, and byPoints the numbers of the
+    candidates worth each amount of points, so that the assembler picks from those rather than the whole pool.
+    Only one of any questions with the same content is a candidate, as a Test wouldn't take the others."""
+
+    def __init__(self, collection, requirements):
+        if requirements.query:
+            questions = collection.findQuestionsByQuery(requirements.query)
+        else:
+            questions = list(collection.getQuestions().values())
+        fingerprints = set()
+        unique = []
+        for question in questions:
+            fingerprint = question.fingerprint()
+            if fingerprint not in fingerprints:
+                fingerprints.add(fingerprint)
+                unique.append(question)
+        questions = unique
+        numbers = {question.ident: number for number, question in enumerate(questions)}
+
+        self.questions = questions
+        self.points = [QuestionColumns.pointsOf(question) for question in questions]
+        self.tags = [frozenset()] * len(questions)
+        self.byTag = {}
+        for tag in requirements.minimumTags:
+            tagged = [numbers[question.ident] for question in collection.findQuestionsByTag(tag)
+                      if question.ident in numbers]
+            self.byTag[tag] = tagged
+            for number in tagged:
+                self.tags[number] = self.tags[number] | {tag}
+
+        self.byPoints = {}
+        for number, points in enumerate(self.points):
+            self.byPoints.setdefault(points, []).append(number)
+        self.values = sorted(self.byPoints)
+
+    def __len__(self):
+        return len(self.questions)
+
+
+class TestAssembler:
+    """Assembles tests at random from the questions in a collection, to meet some TestRequirements
+
+    The tagged questions needed are picked first, the rest of the test is filled from the whole pool, and then
+    questions are swapped for ones worth nearer the points still needed until the total is right, never swapping
+    out a question a tag minimum depends on. An attempt that gets stuck is started again from scratch."""
+
+    # swaps to try before starting an attempt again
+    STEPS = 200
+
+    def __init__(self, collection=None, seed=None):
+        self.collection = QuestionBank.getInstance() if collection is None else collection
+        self.random = random.Random(seed)
+
+    def pool(self, requirements):
+        return CandidatePool(self.collection, requirements)
+
+    def assemble(self, requirements, attempts=50, pool=None):
+        """Returns a new Test that meets the requirements, raising ValueError if none could be found"""
+        pool = self.pool(requirements) if pool is None else pool
+        for attempt in range(attempts):
+            chosen = self.__attempt(pool, requirements)
+            test = None if chosen is None else self.__build(pool, chosen)
+            if test is not None:
+                return test
+        raise ValueError('couldn\'t find a test meeting the requirements in {} attempts'.format(attempts))
+
+    def assembleMany(self, requirements, count, attempts=None):
+        """Yields up to count tests that meet the requirements, no two with the same questions.
+        Gives up after attempts tries, ten per test by default, if there aren't enough different tests to be had"""
+        pool = self.pool(requirements)
+        attempts = count * 10 if attempts is None else attempts
+        seen = set()
+        for attempt in range(attempts):
+            if len(seen) >= count:
+                return
+            chosen = self.__attempt(pool, requirements)
+            if chosen is None:
+                continue
+            key = frozenset(chosen)
+            if key not in seen:
+                test = self.__build(pool, chosen)
+                if test is not None:
+                    seen.add(key)
+                    yield test
+
+    def __attempt(self, pool, requirements):
+        # returns a list of candidate numbers, or None if this attempt didn't meet the requirements
+        size = requirements.questions
+        if size > len(pool):
+            return None
+
+        chosen = []
+        picked = set()
+        for tag, minimum in requirements.minimumTags.items():
+            needed = minimum - sum(1 for number in chosen if tag in pool.tags[number])
+            if needed <= 0:
+                continue
+            tagged = pool.byTag.get(tag, ())
+            # at most len(chosen) of the sample are picked already, so there are always enough left
+            sample = self.random.sample(tagged, min(len(tagged), needed + len(chosen)))
+            sample = [number for number in sample if number not in picked][:needed]
+            if len(sample) < needed:
+                return None
+            chosen.extend(sample)
+            picked.update(sample)
+        if len(chosen) > size:
+            return None
+
+        while len(chosen) < size:
+            number = self.random.randrange(len(pool))
+            if number not in picked:
+                chosen.append(number)
+                picked.add(number)
+
+        if requirements.points is None or self.__balance(pool, requirements, chosen, picked):
+            self.random.shuffle(chosen)
+            return chosen
+        return None
+
+    def __balance(self, pool, requirements, chosen, picked):
+        # swap questions until the points add up, returning whether they did
+        total = sum(pool.points[number] for number in chosen)
+        counts = {tag: sum(1 for number in chosen if tag in pool.tags[number]) for tag in requirements.minimumTags}
+
+        for step in range(TestAssembler.STEPS):
+            difference = requirements.points - total
+            if abs(difference) <= requirements.tolerance:
+                return True
+
+            position = self.random.randrange(len(chosen))
+            out = chosen[position]
+            value = self.__nearest(pool, pool.points[out] + difference)
+            if abs(difference - value + pool.points[out]) >= abs(difference):
+                continue
+            replacement = self.random.choice(pool.byPoints[value])
+            if replacement in picked:
+                continue
+            if any(counts[tag] <= requirements.minimumTags[tag] for tag in pool.tags[out] - pool.tags[replacement]):
+                continue
+
+            for tag in pool.tags[out]:
+                counts[tag] -= 1
+            for tag in pool.tags[replacement]:
+                counts[tag] += 1
+            chosen[position] = replacement
+            picked.discard(out)
+            picked.add(replacement)
+            total += pool.points[replacement] - pool.points[out]
+        return abs(requirements.points - total) <= requirements.tolerance
+
+    @staticmethod
+    def __nearest(pool, points):
+        # the points value in the pool closest to points
+        index = bisect.bisect_left(pool.values, points)
+        if index == len(pool.values):
+            return pool.values[-1]
+        if index > 0 and points - pool.values[index - 1] < pool.values[index] - points:
+            return pool.values[index - 1]
+        return pool.values[index]
+
+    @staticmethod
+    def __build(pool, chosen):
+        # None if the Test turned any question away as a duplicate, so the test would come out short
+        test = Test()
+        for number in chosen:
+            if not test.add(pool.questions[number]):
+                return None
+        return test
@@ -0,0 +1,122 @@
+import random
+from array import array
+from collections.abc import Sequence
+from question.AutoMarkedQuestion import MultipleAnswerQuestion
+
+
+class TestVariants(Sequence):
+    """Shuffled variants of a Test, one per student, generated from a seed
+
+    A variant isn't a copy of the test. It's the order its questions are shown in and, for each question with
+    choices, the order the choices are shown in, as positions into the test's own questions and choices.
+    Every variant's positions are kept one after another in two flat arrays, so thousands of variants
+    take a few bytes per question each. The same test, seed and count always give the same variants."""
+
+    ORDER = 'H'
+    CHOICE_ORDER = 'B'
+
+    def __init__(self, test, seed, count, shuffleChoices=True):
+        questions = test.getQuestions()
+        self.test = test
+        self.seed = seed
+        self.idents = list(questions)
+        self.positions = {ident: position for position, ident in enumerate(self.idents)}
+        # the (letter, choice) pairs of each question with choices, in the test's own order, otherwise None
+        self.choices = [questions[ident].getChoices() if isinstance(questions[ident], MultipleAnswerQuestion)
+                        else None for ident in self.idents]
+        # where each question's choice positions start within a variant's share of choiceOrders
+        self.choiceStarts = array('I', [0])
+        for choices in self.choices:
+            self.choiceStarts.append(self.choiceStarts[-1] + len(choices or ()))
+
+        self.orders = array(TestVariants.ORDER)
+        self.choiceOrders = array(TestVariants.CHOICE_ORDER)
+        generator = random.Random(seed)
+        order = list(range(len(self.idents)))
+        choiceOrders = [list(range(len(choices))) if choices else None for choices in self.choices]
+        for variant in range(count):
+            generator.shuffle(order)
+            self.orders.extend(order)
+            for positions in choiceOrders:
+                if positions is not None:
+                    if shuffleChoices:
+                        generator.shuffle(positions)
+                    self.choiceOrders.extend(positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('variant {} out of range'.format(index))
+        return TestVariant(self, index)
+
+    def __len__(self):
+        return len(self.orders) // len(self.idents) if self.idents else 0
+
+
+class TestVariant:
+    """One student's variant of a test, which looks its order up in the TestVariants it came from"""
+
+    def __init__(self, variants, index):
+        self.variants = variants
+        self.index = index
+
+    def order(self):
+        """Returns the positions of the test's questions in the order this variant shows them"""
+        size = len(self.variants.idents)
+        return self.variants.orders[self.index * size:(self.index + 1) * size]
+
+    def idents(self):
+        return [self.variants.idents[position] for position in self.order()]
+
+    def questions(self):
+        questions = self.variants.test.getQuestions()
+        return [questions[ident] for ident in self.idents()]
+
+    def choiceOrder(self, position):
+        """Returns the positions of the choices of the test's question at position, in the order this variant
+        shows them, or None if the question has no choices"""
+        if self.variants.choices[position] is None:
+            return None
+        starts = self.variants.choiceStarts
+        offset = self.index * starts[-1]
+        return self.variants.choiceOrders[offset + starts[position]:offset + starts[position + 1]]
+
+    def choices(self, ident):
+        """Returns the (letter, choice) pairs of a question as this variant shows them, lettered a, b, c..."""
+        position = self.variants.positions[ident]
+        choices = self.variants.choices[position]
+        if choices is None:
+            return None
+        return [(chr(ord('a') + shown), choices[original][1])
+                for shown, original in enumerate(self.choiceOrder(position))]
+
+    def canonicalAnswer(self, ident, answer):
+        """Turn a student's answer to a question, given with the letters this variant showed, into the letters
+        of the test itself. A list of letters gives a list, and answers to questions without choices are unchanged.
+        Raises ValueError for a letter that wasn't shown"""
+        position = self.variants.positions[ident]
+        choices = self.variants.choices[position]
+        if choices is None:
+            return answer
+
+        order = self.choiceOrder(position)
+
+        def canonical(letter):
+            shown = ord(letter.strip().lower()) - ord('a') if len(letter.strip()) == 1 else -1
+            if not 0 <= shown < len(order):
+                raise ValueError('{!r} isn\'t one of the choices'.format(letter))
+            return choices[order[shown]][0]
+
+        if isinstance(answer, str):
+            return canonical(answer)
+        return [canonical(letter) for letter in answer]
+
+    def canonicalAnswers(self, answers):
+        """Turn a student's answers into the test's own letters. answers is a dictionary of ident -> answer,
+        or a list of answers in the order this variant showed the questions. Returns a dictionary of ident -> answer"""
+        if not isinstance(answers, dict):
+            answers = dict(zip(self.idents(), answers))
+        return {ident: self.canonicalAnswer(ident, answer) for ident, answer in answers.items()}
@@ -0,0 +1,223 @@
+import heapq
+import math
+import re
+
+
+class TextIndex:
+    """A positional inverted index over question text, ranked with BM25
+
+    Each word maps to the idents of the questions it appears in, along with its positions in each question,
+    so that "quoted phrases" can be matched as well as single words. The index is kept up to date as questions
+    are added and removed.
+
+    An index can also be deferred, in which case it is read from storage the first time it's needed and
+    changes made before then are replayed on top of it."""
+
+    WORDS = re.compile(r'\w+')
+    PHRASES = re.compile(r'"([^"]*)"')
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        # ident -> number of words in the question
+        self.__lengths = {}
+        # word -> {ident: positions of the word in that question}
+        self.__postings = {}
+        self.__totalLength = 0
+        self.__loader = None
+        self.__pending = None
+
+    @classmethod
+    def deferred(cls, loader):
+        """An index that calls loader the first time it's needed. loader returns the stored TextIndex,
+        or None if there isn't one that can be used, in which case the index is rebuilt from the questions"""
+        index = cls()
+        index.__loader = loader
+        index.__pending = []
+        return index
+
+    def __getstate__(self):
+        if self.__loader is not None:
+            raise ValueError('a deferred TextIndex has to be loaded before it can be saved')
+        return {'lengths': self.__lengths, 'postings': self.__postings, 'totalLength': self.__totalLength}
+
+    def __setstate__(self, state):
+        self.__lengths = state['lengths']
+        self.__postings = state['postings']
+        self.__totalLength = state['totalLength']
+        self.__loader = None
+        self.__pending = None
+
+    def isLoaded(self):
+        return self.__loader is None
+
+    def load(self, questions):
+        """Read a deferred index, given the dictionary of questions to rebuild it from if it can't be read"""
+        if self.__loader is None:
+            return
+
+        stored = self.__loader()
+        self.__loader, pending, self.__pending = None, self.__pending, None
+        if stored is None:
+            for ident, question in questions.items():
+                self.add(ident, question.question)
+            return
+
+        self.__setstate__(stored.__getstate__())
+        for op, ident, text in pending:
+            if op == 'add':
+                self.add(ident, text)
+            else:
+                self.remove(ident, text)
+
+    def copy(self):
+        index = TextIndex()
+        index.__setstate__({'lengths': dict(self.__lengths),
+                            'postings': {word: dict(postings) for word, postings in self.__postings.items()},
+                            'totalLength': self.__totalLength})
+        return index
+
+    def add(self, ident, text):
+        if self.__loader is not None:
+            self.__pending.append(('add', ident, text))
+            return
+        if ident in self.__lengths:
+            return
+
+        words = TextIndex.tokenize(text)
+        positions = {}
+        for position, word in enumerate(words):
+            positions.setdefault(word, []).append(position)
+        for word, found in positions.items():
+            self.__postings.setdefault(word, {})[ident] = tuple(found)
+        self.__lengths[ident] = len(words)
+        self.__totalLength += len(words)
+
+    def remove(self, ident, text):
+        """Remove the question with this ident, given its text so that only its own words need looking at"""
+        if self.__loader is not None:
+            self.__pending.append(('remove', ident, text))
+            return
+
+        length = self.__lengths.pop(ident, None)
+        if length is None:
+            return
+        self.__totalLength -= length
+        for word in set(TextIndex.tokenize(text)):
+            postings = self.__postings.get(word)
+            if postings is not None:
+                postings.pop(ident, None)
+                if not postings:
+                    del self.__postings[word]
+
+    def __len__(self):
+        return len(self.__lengths)
+
+    def search(self, query, limit=50):
+        """Returns up to limit (ident, score) pairs for the questions that best match the query, best first.
+        Words in quotes have to appear next to each other in that order"""
+        if self.__loader is not None:
+            raise ValueError('a deferred TextIndex has to be loaded before it can be searched')
+
+        words, phrases = TextIndex.parse(query)
+        if not words or not self.__lengths or limit <= 0:
+            return []
+
+        # only questions with every phrase in them can match, so those are the only ones scored
+        candidates = None
+        for phrase in phrases:
+            matching = self.__matchPhrase(phrase)
+            candidates = matching if candidates is None else candidates & matching
+        if candidates is not None:
+            scores = dict.fromkeys(candidates, 0.0)
+            for word in words:
+                self.__score(word, scores, True)
+        else:
+            scores = self.__scoreAll(words, limit)
+
+        return [(ident, scores[ident]) for ident in heapq.nlargest(limit, scores, key=scores.__getitem__)]
+
+    @staticmethod
+    def tokenize(text):
+        """Static method that splits text into lower case words"""
+        return [word.casefold() for word in TextIndex.WORDS.findall(text)]
+
+    @staticmethod
+    def parse(query):
+        """Static method that returns the distinct words in a query, and the phrases of more than one word in it"""
+        words = list(dict.fromkeys(TextIndex.tokenize(query)))
+        phrases = [TextIndex.tokenize(phrase) for phrase in TextIndex.PHRASES.findall(query)]
+        return words, [phrase for phrase in phrases if len(phrase) > 1]
+
+    def __scoreAll(self, words, limit):
+        # rarest words first, since they count for the most. Once the questions found so far are scoring more
+        # than any new question could get from the words left, those words only need adding to the questions
+        # already found rather than going through every question they appear in
+        bounds = {word: self.__idf(word) * (TextIndex.K1 + 1) for word in words if word in self.__postings}
+        words = sorted(bounds, key=bounds.get, reverse=True)
+        remaining = sum(bounds.values())
+
+        scores = {}
+        for word in words:
+            existingOnly = len(scores) >= limit and heapq.nlargest(limit, scores.values())[-1] >= remaining
+            self.__score(word, scores, existingOnly)
+            remaining -= bounds[word]
+        return scores
+
+    def __score(self, word, scores, existingOnly):
+        postings = self.__postings.get(word)
+        if not postings:
+            return
+
+        idf = self.__idf(word)
+        k1 = TextIndex.K1
+        lengthWeight = TextIndex.B / (self.__totalLength / len(self.__lengths) or 1)
+        lengths = self.__lengths
+
+        if not scores and not existingOnly:
+            # nothing to add to yet, which is the common case of a one word search, so score in one go
+            base = k1 * (1 - TextIndex.B)
+            weight = k1 * lengthWeight
+            top = idf * (k1 + 1)
+            scores.update((ident, top * len(positions) / (len(positions) + base + weight * lengths[ident]))
+                          for ident, positions in postings.items())
+            return
+
+        if existingOnly:
+            # look each question up in the postings, or go through the postings, whichever is fewer
+            if len(scores) < len(postings):
+                found = [(ident, postings[ident]) for ident in scores if ident in postings]
+            else:
+                found = [(ident, positions) for ident, positions in postings.items() if ident in scores]
+        else:
+            found = postings.items()
+
+        for ident, positions in found:
+            frequency = len(positions)
+            norm = k1 * (1 - TextIndex.B + lengthWeight * lengths[ident])
+            scores[ident] = scores.get(ident, 0.0) + idf * frequency * (k1 + 1) / (frequency + norm)
+
+    def __idf(self, word):
+        found = len(self.__postings.get(word, ()))
+        return math.log(1 + (len(self.__lengths) - found + 0.5) / (found + 0.5))
+
+    def __matchPhrase(self, phrase):
+        postings = [self.__postings.get(word) for word in phrase]
+        if not all(postings):
+            return set()
+
+        # start from the word in the fewest questions, then check the positions line up in each of those
+        candidates = set(min(postings, key=len))
+        for other in postings:
+            candidates.intersection_update(other)
+
+        matching = set()
+        for ident in candidates:
+            starts = set(postings[0][ident])
+            for offset, other in enumerate(postings[1:], 1):
+                starts.intersection_update(position - offset for position in other[ident])
+                if not starts:
+                    break
+            if starts:
+                matching.add(ident)
+        return matching
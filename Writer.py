@@ -0,0 +1,90 @@
+import atexit
+import threading
+import time
+
+
+class BackgroundWriter:
+    """Saves a collection through its storage on a background thread, so callers never wait on the disk
+
+    Saves requested while a write is already waiting are coalesced into that one write, after a short delay
+    to let a burst of saves build up. flush waits until everything requested so far has been written,
+    and every writer is flushed when the application exits."""
+
+    __writers = {}
+    __writersLock = threading.Lock()
+
+    def __init__(self, storage, delay=0.05):
+        self.storage = storage
+        self.delay = delay
+        self.__condition = threading.Condition()
+        self.__collection = None
+        self.__requested = 0
+        self.__completed = 0
+        self.__error = None
+        self.__thread = None
+
+    @classmethod
+    def forStorage(cls, storage):
+        """Returns the one writer for this storage, creating it the first time"""
+        with cls.__writersLock:
+            if not cls.__writers:
+                atexit.register(cls.flushAll)
+            if storage not in cls.__writers:
+                cls.__writers[storage] = cls(storage)
+            return cls.__writers[storage]
+
+    @classmethod
+    def flushAll(cls):
+        with cls.__writersLock:
+            writers = list(cls.__writers.values())
+        for writer in writers:
+            writer.flush()
+
+    def save(self, collection):
+        """Ask for the collection to be saved, returning straight away"""
+        with self.__condition:
+            self.__collection = collection
+            self.__requested += 1
+            if self.__thread is None:
+                # a daemon thread so it never holds up exit, the atexit flush makes sure nothing is lost
+                self.__thread = threading.Thread(target=self.__run, name='BackgroundWriter', daemon=True)
+                self.__thread.start()
+            self.__condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until every save requested so far has been written, returning False if the timeout ran out first.
+        If a write failed, its exception is raised here"""
+        with self.__condition:
+            target = self.__requested
+            if not self.__condition.wait_for(lambda: self.__completed >= target, timeout):
+                return False
+
+            error, self.__error = self.__error, None
+        if error is not None:
+            raise error
+        return True
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__requested > self.__completed)
+
+            # give any other saves in this burst a moment to arrive, so they all go in one write
+            time.sleep(self.delay)
+
+            with self.__condition:
+                target = self.__requested
+                collection = self.__collection
+
+            try:
+                self.storage.save(collection)
+            except Exception as e:
+                error = e
+            else:
+                error = None
+
+            with self.__condition:
+                if error is not None:
+                    self.__error = error
+                self.__completed = target
+                self.__condition.notify_all()
@@ -13,7 +13,8 @@ class App:
 
         # When first running the application, we set up our QuestionBank and TestBank singletons.
         # By doing this here, we ensure that if we have a question bank and test bank persisted,
-        # then they will be loaded into memory straight away.
+        # then they will be loaded into memory straight away. Only the question bank's index is read here,
+        # each question is loaded the first time it is needed, so this stays quick however big the bank gets.
         QuestionBank.getInstance()
         TestBank.getInstance()
 
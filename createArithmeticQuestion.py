@@ -1,6 +1,7 @@
 from PyQt5 import QtCore, QtGui, QtWidgets
 from question.Question import Question, QuestionBank
 from question.AutoMarkedQuestion import ArithmeticQuestion
+from ui.tagAutocomplete import TagAutocomplete
 
 
 class CreateArithmeticQuestionUi(object):
@@ -32,6 +33,8 @@ class CreateArithmeticQuestionUi(object):
         self.tagsInput = QtWidgets.QPlainTextEdit(createArithmeticQuestion)
         self.tagsInput.setGeometry(QtCore.QRect(30, 210, 341, 41))
         self.tagsInput.setObjectName("TagsInput")
+        # suggest tags already in the bank, so the same tag isn't entered slightly differently
+        self.tagsAutocomplete = TagAutocomplete(self.tagsInput)
         self.label_4 = QtWidgets.QLabel(createArithmeticQuestion)
         self.label_4.setGeometry(QtCore.QRect(30, 180, 341, 31))
         self.label_4.setObjectName("label_4")
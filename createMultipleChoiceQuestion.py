@@ -1,6 +1,7 @@
 from PyQt5 import QtCore, QtGui, QtWidgets
 from question.Question import Question, QuestionBank
 from question.AutoMarkedQuestion import AutoMarkedQuestion
+from ui.tagAutocomplete import TagAutocomplete
 
 
 class CreateMultipleChoiceQuestionUi(object):
@@ -35,6 +36,8 @@ class CreateMultipleChoiceQuestionUi(object):
         self.tagsInput = QtWidgets.QPlainTextEdit(createMultipleChoiceQuestion)
         self.tagsInput.setGeometry(QtCore.QRect(30, 500, 341, 41))
         self.tagsInput.setObjectName("tagsInput")
+        # suggest tags already in the bank, so the same tag isn't entered slightly differently
+        self.tagsAutocomplete = TagAutocomplete(self.tagsInput)
 
         self.label_4 = QtWidgets.QLabel(createMultipleChoiceQuestion)
         self.label_4.setGeometry(QtCore.QRect(30, 470, 341, 31))
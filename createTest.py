@@ -1,6 +1,7 @@
 from PyQt5 import QtCore, QtGui, QtWidgets
 from question.Question import QuestionBank
 from question.Test import Test, TestBank
+from ui.tagAutocomplete import TagAutocomplete
 
 class CreateTestUi(object):
     def setupUi(self, createTest):
@@ -38,13 +39,19 @@ class CreateTestUi(object):
         self.label.setObjectName("label")
         
         self.searchInput = QtWidgets.QLineEdit(createTest)
-        self.searchInput.setGeometry(QtCore.QRect(30, 140, 231, 25))
+        self.searchInput.setGeometry(QtCore.QRect(30, 140, 171, 25))
         self.searchInput.setObjectName("searchInput")
+        self.searchAutocomplete = TagAutocomplete(self.searchInput, TagAutocomplete.TAG_QUERY)
         
         self.searchSubmit = QtWidgets.QPushButton(createTest)
-        self.searchSubmit.setGeometry(QtCore.QRect(260, 140, 101, 25))
+        self.searchSubmit.setGeometry(QtCore.QRect(200, 140, 81, 25))
         self.searchSubmit.setObjectName("searchSubmit")
         self.searchSubmit.clicked.connect(self.search)
+
+        self.searchTextSubmit = QtWidgets.QPushButton(createTest)
+        self.searchTextSubmit.setGeometry(QtCore.QRect(280, 140, 81, 25))
+        self.searchTextSubmit.setObjectName("searchTextSubmit")
+        self.searchTextSubmit.clicked.connect(self.searchText)
         
         self.questionList = QtWidgets.QListWidget(createTest)
         self.questionList.setGeometry(QtCore.QRect(30, 180, 331, 271))
@@ -70,8 +77,9 @@ class CreateTestUi(object):
         createTest.setWindowTitle(_translate("createTest", "Create a Test"))
         self.label_6.setText(_translate("createTest", "Create a Test"))
         self.label_2.setText(_translate("createTest", "Test Name:"))
-        self.label.setText(_translate("createTest", "Find questions by searching for a tag:"))
-        self.searchSubmit.setText(_translate("createTest", "Search"))
+        self.label.setText(_translate("createTest", "Find questions by tags (AND, OR, NOT) or text:"))
+        self.searchSubmit.setText(_translate("createTest", "Tags"))
+        self.searchTextSubmit.setText(_translate("createTest", "Text"))
         __sortingEnabled = self.questionList.isSortingEnabled()
         self.questionList.setSortingEnabled(False)
         self.questionList.setSortingEnabled(__sortingEnabled)
@@ -84,10 +92,26 @@ class CreateTestUi(object):
 
         # clear existing list entries
         self.questionList.clear()
+        if not term.strip():
+            return
+
+        # search question bank for questions with tags matching search term, e.g. algebra AND year7 AND NOT calculator
+        try:
+            questions = QuestionBank.getInstance().findQuestionsByQuery(term)
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(None, 'Search', str(e))
+            return
+
+        self.showQuestions(questions)
+
+    def searchText(self):
+        term = self.searchInput.text()
+        self.questionList.clear()
 
-        # search question bank for questions with tags matching search term
-        questions = QuestionBank.getInstance().findQuestionsByTag(term)
+        # search the question text, best matches first
+        self.showQuestions(QuestionBank.getInstance().findQuestionsByText(term))
 
+    def showQuestions(self, questions):
         # add matching entries to list
         for question in questions:
             item = QtWidgets.QListWidgetItem()
@@ -1,15 +1,18 @@
 import sys
-from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton
+from PyQt5.QtWidgets import QApplication, QMainWindow, QPushButton, QListWidget
 from PyQt5.QtCore import QFile, QTextStream # Removed 'Qt' as it's not explicitly used by its direct name (like Qt.AlignCenter)
 from sidebar_ui import Ui_MainWindow
 import os
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, question_bank=None):
         super().__init__()
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
 
+        # The question bank to search. If none is given it's loaded the first time something is searched
+        self.question_bank = question_bank
+
         # --- Initial Setup ---
         # Initialize sidebar visibility. Adjust based on your preference:
         self.ui.icon_only_widget.setVisible(True)
@@ -46,6 +49,12 @@ class MainWindow(QMainWindow):
 
         # Search Page (Index 6 in sidebar_ui.py) - connected to search_btn
         self.ui.search_btn.clicked.connect(self.on_search_btn_clicked)
+        self.ui.search_input.returnPressed.connect(self.on_search_btn_clicked)
+
+        # List of matching questions, shown under the heading of the search page
+        self.search_results = QListWidget(self.ui.page_6)
+        self.search_results.setObjectName("search_results")
+        self.ui.gridLayout_7.addWidget(self.search_results, 1, 0, 1, 1)
 
         # --- Connect stackedWidget's currentChanged signal to manage button checked state ---
         self.ui.stackedWidget.currentChanged.connect(self.on_stacked_widget_current_changed)
@@ -56,12 +65,28 @@ class MainWindow(QMainWindow):
         self.ui.stackedWidget.setCurrentIndex(6) # The search page is at index 6
         search_text = self.ui.search_input.text().strip()
 
+        self.search_results.clear()
         if search_text:
             self.ui.label_9.setText(f"Search Results for: \"{search_text}\"") # Assuming label_9 is on the search page
+            # Ranked search over the question text, best matches first
+            for question in self.find_questions(search_text):
+                self.search_results.addItem(f"{question.ident} - {question.question}")
         else:
             self.ui.label_9.setText("Please enter text to search.")
             print("Search input is empty.")
 
+    # --- Questions whose text matches the search, or none when run without the question package ---
+    def find_questions(self, search_text):
+        if self.question_bank is None:
+            try:
+                # Imported here so that this script still runs on its own, outside the question package
+                from question.Question import QuestionBank
+            except ImportError:
+                print("The question bank isn't available, so there's nothing to search.")
+                return []
+            self.question_bank = QuestionBank.getInstance()
+        return self.question_bank.findQuestionsByText(search_text)
+
     # --- Function for changing page to user page (connected to user_btn) ---
     def on_user_btn_clicked(self):
         self.ui.stackedWidget.setCurrentIndex(1) # The profile page is at index 1
@@ -0,0 +1,93 @@
+import re
+from PyQt5 import QtCore, QtWidgets
+from question.Question import QuestionBank
+
+
+class TagAutocomplete(object):
+    """Suggests tags from the QuestionBank while they are typed
+
+    Works with a QLineEdit or a QPlainTextEdit. Only the tag being typed is completed, which is the text after
+    the last match of separator, so for a list of tags that's the last comma and for a tag search
+    it's the last AND, OR, NOT or bracket."""
+
+    TAG_LIST = re.compile(r',')
+    TAG_QUERY = re.compile(r'\bAND\b|\bOR\b|\bNOT\b|[()"]')
+
+    def __init__(self, widget, separator=TAG_LIST, limit=10):
+        self.widget = widget
+        self.separator = separator
+        self.limit = limit
+
+        self.model = QtCore.QStringListModel()
+        self.completer = QtWidgets.QCompleter()
+        self.completer.setModel(self.model)
+        self.completer.setWidget(widget)
+        # the bank has already picked the matches, so the completer shouldn't filter them again
+        self.completer.setCompletionMode(QtWidgets.QCompleter.UnfilteredPopupCompletion)
+        self.completer.activated[str].connect(self.insert)
+
+        if isinstance(widget, QtWidgets.QLineEdit):
+            widget.textEdited.connect(self.suggest)
+        else:
+            widget.textChanged.connect(self.suggest)
+
+    def suggest(self, *args):
+        start, end = self.currentTag()
+        prefix = self.text()[start:end].strip()
+        if not prefix:
+            self.completer.popup().hide()
+            return
+
+        tags = QuestionBank.getInstance().completeTags(prefix, self.limit)
+        # nothing to suggest if the only match is what has already been typed
+        if not tags or tags == [prefix]:
+            self.completer.popup().hide()
+            return
+
+        self.model.setStringList(tags)
+        if isinstance(self.widget, QtWidgets.QLineEdit):
+            # under the whole line edit
+            self.completer.complete()
+        else:
+            rect = self.widget.cursorRect()
+            rect.setWidth(self.completer.popup().sizeHintForColumn(0) + 20)
+            self.completer.complete(rect)
+
+    def insert(self, tag):
+        start, end = self.currentTag()
+        text = self.text()
+        # keep a space after a separator, as it was typed
+        if text[start:end].startswith(' '):
+            tag = ' ' + tag
+        text = text[:start] + tag + text[end:]
+
+        if isinstance(self.widget, QtWidgets.QLineEdit):
+            self.widget.setText(text)
+            self.widget.setCursorPosition(start + len(tag))
+        else:
+            self.widget.blockSignals(True)
+            self.widget.setPlainText(text)
+            self.widget.blockSignals(False)
+            cursor = self.widget.textCursor()
+            cursor.setPosition(start + len(tag))
+            self.widget.setTextCursor(cursor)
+
+    def currentTag(self):
+        """Returns the start and end of the tag the cursor is in"""
+        text = self.text()
+        if isinstance(self.widget, QtWidgets.QLineEdit):
+            cursor = self.widget.cursorPosition()
+        else:
+            cursor = self.widget.textCursor().position()
+
+        start = 0
+        for match in self.separator.finditer(text, 0, cursor):
+            start = match.end()
+        following = self.separator.search(text, cursor)
+        end = following.start() if following else len(text)
+        return start, end
+
+    def text(self):
+        if isinstance(self.widget, QtWidgets.QLineEdit):
+            return self.widget.text()
+        return self.widget.toPlainText()
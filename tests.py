@@ -1,5 +1,31 @@
+import copyreg
+import json
+import os
+import pickle
+import shutil
+import tempfile
 import unittest
-from question.Question import Question
+from unittest import mock
+from fractions import Fraction
+from question import Columns
+from question.ArithmeticGenerator import ArithmeticGenerator, ArithmeticTemplate, NoCarryTemplate
+from question.AutoMarkedQuestion import ArithmeticQuestion, MultipleAnswerQuestion, ReorderQuestion, TrueFalseQuestion
+from question.Expression import ArithmeticExpression
+from question.Identifier import IdentifierAllocator
+from question.Importer import QuestionImporter
+from question import Marking
+from question.Marking import AnswerKey, BatchMarker, CreditRule
+from question.MappedSnapshot import MappedSnapshot, MappedSnapshotStorage
+from question.MarkingScheduler import MarkingScheduler
+from question.Question import Question, QuestionBank, QuestionCollection
+from question.Columns import QuestionColumns
+from question.SubmissionPipeline import SubmissionPipeline
+from question.Storage import CorruptStorageError, IndexedJournalStorage, JournalStorage, PickleStorage, SqliteQuestionStorage, SqliteTestStorage
+from question.TagQuery import Bitmap, TagQuery
+from question.Test import Test, TestBank, TestCollection
+from question.TestAssembler import TestAssembler, TestRequirements
+from question.TestVariants import TestVariants
+from question.TextSearch import TextIndex
 
 
 class QuestionTest(unittest.TestCase):
@@ -64,8 +90,1143 @@ class QuestionTest(unittest.TestCase):
         # therefore we can assert that it isn't just the same object being returned
         self.assertNotEqual(self.__question, self.__question.clone())
 
-        # can then use the __dict__ magic methods on the objects to assert that the new object has same properties
-        self.assertDictEqual(self.__question.__dict__, self.__question.clone().__dict__)
+        # questions have slots rather than a __dict__, so compare the state they pickle instead
+        self.assertDictEqual(self.__question.__getstate__(), self.__question.clone().__getstate__())
+
+    def testPicklesFromBeforeSlotsLoad(self):
+        # before slots a question pickled its __dict__, with lists for the answer and choices
+        state = {'_question': 'Pick two', '_answer': ['a', 'c'], '_points': 10, '_tags': ['maths'],
+                 '_ident': 'question1', 'choices': {'a': '1', 'b': '2', 'c': '3'}}
+
+        class OldQuestion:
+            def __reduce_ex__(self, protocol):
+                return copyreg._reconstructor, (MultipleAnswerQuestion, object, None), dict(state)
+
+        question = pickle.loads(pickle.dumps(OldQuestion()))
+        self.assertIsInstance(question, MultipleAnswerQuestion)
+        self.assertFalse(hasattr(question, '__dict__'))
+        self.assertEqual(question.getNumCorrectAnswers(), 2)
+        self.assertListEqual(question.getChoices(), [('a', '1'), ('b', '2'), ('c', '3')])
+
+        # and it has the same fingerprint as a question made from the same input
+        self.assertEqual(question.fingerprint(),
+                         MultipleAnswerQuestion('Pick two', ['a', 'c'], ['maths'], 10, state['choices']).fingerprint())
+        self.assertEqual(pickle.loads(pickle.dumps(question)).__getstate__(), question.__getstate__())
+
+
+class ArithmeticGeneratorTest(unittest.TestCase):
+    """A set of tests for generating arithmetic questions from templates"""
+
+    def testEveryQuestionOnce(self):
+        for template in (ArithmeticTemplate('+', (1, 20), (1, 30)), ArithmeticTemplate('÷', (1, 12), (2, 12)),
+                         NoCarryTemplate('+', 2), NoCarryTemplate('-', 2), NoCarryTemplate('×', 2)):
+            generator = ArithmeticGenerator(template, seed=3)
+            self.assertListEqual(sorted(generator.number(i) for i in range(len(generator))), list(range(len(generator))))
+            questions = [question.question for question in generator]
+            self.assertEqual(len(set(questions)), len(generator))
+
+    def testAnswers(self):
+        for question in ArithmeticGenerator(ArithmeticTemplate('÷', (1, 12), (2, 12))):
+            dividend, divisor = question.question.split('÷')
+            self.assertEqual(int(dividend) // int(divisor) * int(divisor), int(dividend))
+            self.assertEqual(question._answer, str(int(dividend) // int(divisor)))
+
+        # no column of a sum without carrying adds up to more than 9
+        for number in range(0, 166375, 97):
+            first, second = NoCarryTemplate('+', 3).numbers(number)
+            self.assertTrue(all(int(a) + int(b) <= 9 for a, b in zip(str(first).zfill(3), str(second).zfill(3))))
+
+    def testSameSeedSameQuestions(self):
+        template = ArithmeticTemplate('×', (1, 1000000), (1, 1000000))
+        self.assertEqual(ArithmeticGenerator(template, 8)[123456789].question,
+                         ArithmeticGenerator(template, 8)[123456789].question)
+        self.assertNotEqual([question.question for question in ArithmeticGenerator(template, 8)[:5]],
+                            [question.question for question in ArithmeticGenerator(template, 9)[:5]])
+
+
+class IdentifierAllocatorTest(unittest.TestCase):
+    """A set of tests for the IdentifierAllocator class"""
+
+    def testIdentifiersAreUniqueAndOrdered(self):
+        allocator = IdentifierAllocator('question')
+        idents = [allocator.allocate() for _ in range(10000)]
+
+        # no duplicates, and sorting as strings keeps them in the order they were allocated
+        self.assertEqual(len(set(idents)), len(idents))
+        self.assertListEqual(sorted(idents), idents)
+        self.assertTrue(all(ident.startswith('question') for ident in idents))
+
+    def testQuestionsGetAnIdent(self):
+        self.assertNotEqual(Question('1+1', '2', []).ident, Question('1+1', '2', []).ident)
+        self.assertTrue(Test().ident.startswith('test'))
+
+
+class QuestionCollectionTest(unittest.TestCase):
+    """A set of tests for the QuestionCollection class"""
+
+    def setUp(self):
+        self.__collection = QuestionCollection()
+        self.__first = Question('1+1', '2', ['maths', 'year7'], 10, 'question1')
+        self.__second = Question('2+2', '4', ['maths'], 10, 'question2')
+        self.__collection.add(self.__first)
+        self.__collection.add(self.__second)
+
+    def testFindQuestionsByTag(self):
+        self.assertListEqual(self.__collection.findQuestionsByTag('maths'), [self.__first, self.__second])
+        self.assertListEqual(self.__collection.findQuestionsByTag('year7'), [self.__first])
+        self.assertListEqual(self.__collection.findQuestionsByTag('geography'), [])
+
+    def testTagIndexFollowsSetTagsAndRemove(self):
+        self.__collection.setTags('question1', ['year8'])
+        self.assertListEqual(self.__collection.findQuestionsByTag('maths'), [self.__second])
+        self.assertListEqual(self.__collection.findQuestionsByTag('year7'), [])
+        self.assertListEqual(self.__collection.findQuestionsByTag('year8'), [self.__first])
+
+        self.__collection.remove('question2')
+        self.assertListEqual(self.__collection.findQuestionsByTag('maths'), [])
+
+    def testAddRejectsDuplicateContent(self):
+        # the same question again, and a copy of it with its tags in a different order, are both duplicates
+        self.assertFalse(self.__collection.add(self.__first))
+        self.assertFalse(self.__collection.add(Question('1+1', '2', ['year7', 'maths'], 10, 'question3')))
+        self.assertTrue(self.__collection.add(Question('1+1', '2', ['year8'], 10, 'question3')))
+        self.assertEqual(len(self.__collection), 3)
+
+        # once removed, the content can be added again
+        self.__collection.remove('question1')
+        self.assertTrue(self.__collection.add(Question('1+1', '2', ['maths', 'year7'], 10, 'question4')))
+
+    def testTagIndexIsPickled(self):
+        collection = pickle.loads(pickle.dumps(self.__collection))
+        self.assertListEqual([q.ident for q in collection.findQuestionsByTag('maths')], ['question1', 'question2'])
+
+
+class TagQueryTest(unittest.TestCase):
+    """A set of tests for searching a QuestionCollection with AND, OR and NOT"""
+
+    def setUp(self):
+        self.__collection = QuestionCollection()
+        self.__collection.add(Question('x+1=2', '1', ['algebra', 'year7'], 10, 'question1'))
+        self.__collection.add(Question('x*3=9', '3', ['algebra', 'year7', 'calculator'], 10, 'question2'))
+        self.__collection.add(Question('2x=8', '4', ['algebra', 'year8'], 10, 'question3'))
+        self.__collection.add(Question('7*8', '56', ['times tables'], 10, 'question4'))
+        self.__collection.add(Question('1+1', '2', [], 10, 'question5'))
+
+    def find(self, query):
+        return [q.ident for q in self.__collection.findQuestionsByQuery(query)]
+
+    def testQueries(self):
+        self.assertListEqual(self.find('algebra AND year7 AND NOT calculator'), ['question1'])
+        self.assertListEqual(self.find('year8 OR calculator'), ['question2', 'question3'])
+        self.assertListEqual(self.find('NOT (algebra OR times tables)'), ['question5'])
+        self.assertListEqual(self.find('NOT algebra AND NOT "times tables"'), ['question5'])
+        # AND binds tighter than OR
+        self.assertListEqual(self.find('times tables OR algebra AND year8'), ['question3', 'question4'])
+
+    def testSingleTagStillWorks(self):
+        # a plain search is one tag, even with spaces in it, like before queries were supported
+        self.assertListEqual(self.find('times tables'), ['question4'])
+        self.assertListEqual(self.find('geography'), [])
+
+    def testQueriesFollowChanges(self):
+        self.__collection.setTags('question1', ['algebra', 'calculator'])
+        self.__collection.remove('question5')
+        self.assertListEqual(self.find('algebra AND NOT calculator'), ['question3'])
+        self.assertListEqual(self.find('NOT algebra'), ['question4'])
+
+    def testInvalidQueries(self):
+        for query in ('', 'algebra AND', '(algebra OR year7', 'algebra )', 'NOT', '"year7'):
+            with self.assertRaises(ValueError):
+                TagQuery.parse(query)
+
+    def testCompleteTags(self):
+        # most used first, then alphabetical, ignoring case
+        self.assertListEqual(self.__collection.completeTags('a'), ['algebra'])
+        self.assertListEqual(self.__collection.completeTags('YEAR'), ['year7', 'year8'])
+        self.assertListEqual(self.__collection.completeTags('year', 1), ['year7'])
+        self.assertListEqual(self.__collection.completeTags('geo'), [])
+
+        # counts follow changes, and a tag that is no longer used isn't suggested
+        self.__collection.setTags('question1', ['algebra', 'year8'])
+        self.__collection.setTags('question2', ['Calculator'])
+        self.assertListEqual(self.__collection.completeTags('year'), ['year8'])
+        self.assertListEqual(self.__collection.completeTags('c'), ['Calculator'])
+        self.assertEqual(self.__collection.getTagIndex().count('year8'), 2)
+
+        # suggestions are kept for each prefix, without handing out the list that is kept
+        self.__collection.completeTags('c').append('cosine')
+        self.assertListEqual(self.__collection.completeTags('c'), ['Calculator'])
+        self.__collection.setTags('question1', ['algebra', 'calculus'])
+        self.assertListEqual(self.__collection.completeTags('c'), ['Calculator', 'calculus'])
+
+        collection = pickle.loads(pickle.dumps(self.__collection))
+        self.assertEqual(collection.getTagIndex().count('algebra'), 2)
+        self.assertListEqual(collection.completeTags('y'), ['year8'])
+
+    def testBitmap(self):
+        # numbers far apart land in different blocks, and only those blocks are kept
+        first, second = Bitmap(), Bitmap()
+        for n in (1, 5, 5000, 70000):
+            first.add(n)
+        for n in (5, 70000, 80000):
+            second.add(n)
+        self.assertListEqual(list(first & second), [5, 70000])
+        self.assertListEqual(list(first | second), [1, 5, 5000, 70000, 80000])
+        self.assertListEqual(list(first - second), [1, 5000])
+        first.discard(5000)
+        self.assertEqual(len(first), 3)
+        self.assertNotIn(5000, first)
+
+
+class TextSearchTest(unittest.TestCase):
+    """A set of tests for the ranked search of question text"""
+
+    def setUp(self):
+        self.__collection = QuestionCollection()
+        self.__collection.add(Question('What is the capital of France?', 'Paris', [], 10, 'question1'))
+        self.__collection.add(Question('Which river flows through the capital of England?', 'Thames', [], 10,
+                                       'question2'))
+        self.__collection.add(Question('What is France famous for? France France', 'Cheese', [], 10, 'question3'))
+        self.__collection.add(Question('What is 7 times 8?', '56', [], 10, 'question4'))
+
+    def find(self, text, limit=50):
+        return [q.ident for q in self.__collection.findQuestionsByText(text, limit)]
+
+    def testRanking(self):
+        # the question that says France most comes first, and questions without the words don't come back
+        self.assertListEqual(self.find('france'), ['question3', 'question1'])
+        self.assertListEqual(self.find('Capital'), ['question1', 'question2'])
+        self.assertListEqual(self.find('capital France', 1), ['question1'])
+        self.assertListEqual(self.find('geography'), [])
+
+    def testPhrases(self):
+        self.assertListEqual(self.find('"capital of france"'), ['question1'])
+        self.assertListEqual(self.find('"france capital"'), [])
+        self.assertListEqual(self.find('"the capital" england'), ['question2', 'question1'])
+
+    def testIndexFollowsChanges(self):
+        self.__collection.remove('question3')
+        self.assertListEqual(self.find('france'), ['question1'])
+
+        # the text index isn't pickled, it's rebuilt the first time it's searched
+        collection = pickle.loads(pickle.dumps(self.__collection))
+        self.assertListEqual([q.ident for q in collection.findQuestionsByText('times')], ['question4'])
+
+    def testOnlyTheBankIndexesTextUpFront(self):
+        test = Test('test1')
+        test.add(Question('What is the capital of France?', 'Paris', [], 10, 'question1'))
+        self.assertIsNone(test._QuestionCollection__textIndex)
+        self.assertIsNotNone(QuestionBank()._QuestionCollection__textIndex)
+
+        # a collection without one builds it the first time it's searched, and keeps it up to date after that
+        self.assertListEqual([q.ident for q in test.findQuestionsByText('france')], ['question1'])
+        test.add(Question('Where is France?', 'Europe', [], 10, 'question2'))
+        self.assertListEqual([q.ident for q in test.findQuestionsByText('where')], ['question2'])
+
+    def testTopResultsMatchScoringEverything(self):
+        # skipping common words once the top results are settled shouldn't change what the top results are
+        index = TextIndex()
+        for n in range(300):
+            index.add('q{}'.format(n), 'common ' * (n % 5 + 1) + ('rare ' if n % 7 == 0 else '') + 'word{}'.format(n % 11))
+        for query in ('rare common', 'common word3', 'rare word4 common'):
+            everything = index.search(query, 1000)
+            self.assertListEqual(index.search(query, 10), everything[:10])
+
+
+class QuestionColumnsTest(unittest.TestCase):
+    """A set of tests for the column by column aggregate queries over the questions"""
+
+    def setUp(self):
+        self.__collection = QuestionCollection()
+        self.__collection.add(ArithmeticQuestion('1+1', '2', ['maths', 'year7'], '10'))
+        self.__collection.add(ArithmeticQuestion('2+2', '4', ['maths'], 20))
+        self.__collection.add(TrueFalseQuestion('The sky is blue', ['a'], ['science', 'year7'], 10, ['true', 'false']))
+        self.__directory = tempfile.mkdtemp()
+        self.__numpy = Columns.numpy
+
+    def tearDown(self):
+        Columns.numpy = self.__numpy
+        shutil.rmtree(self.__directory)
+
+    def checkAggregates(self, columns):
+        self.assertDictEqual(columns.countByTag(), {'maths': 2, 'year7': 2, 'science': 1})
+        self.assertDictEqual(columns.pointsByTag(), {'maths': 30, 'year7': 20, 'science': 10})
+        self.assertDictEqual(columns.countByType(), {'ArithmeticQuestion': 2, 'TrueFalseQuestion': 1})
+        self.assertDictEqual(columns.pointsDistribution(), {10: 2, 20: 1})
+        self.assertEqual(len(columns.filter(tags=['maths', 'year7'])), 1)
+        self.assertEqual(len(columns.filter(typeName='ArithmeticQuestion', minPoints=15)), 1)
+        self.assertListEqual(columns.filter(tags=['geography']), [])
+
+    def testAggregates(self):
+        # with numpy if it's installed, and always in plain Python
+        for numpy in {self.__numpy, None}:
+            Columns.numpy = numpy
+            self.checkAggregates(self.__collection.getColumns())
+
+    def testColumnsFollowChanges(self):
+        columns = self.__collection.getColumns()
+        question = ArithmeticQuestion('3+3', '6', ['maths'], 10)
+        self.__collection.add(question)
+        self.__collection.setTags(question.ident, ['year8'])
+        self.assertDictEqual(columns.countByTag(), {'maths': 2, 'year7': 2, 'science': 1, 'year8': 1})
+
+        # removing most of the questions compacts the columns
+        for ident in list(self.__collection.getQuestions())[:3]:
+            self.__collection.remove(ident)
+        self.assertDictEqual(columns.countByTag(), {'year8': 1})
+        self.assertEqual(len(columns), 1)
+        self.assertLess(len(columns.idents), 5)
+
+    def testSavedColumnsAreMapped(self):
+        path = os.path.join(self.__directory, 'columns.bin')
+        self.__collection.getColumns().save(path)
+
+        columns = QuestionColumns.open(path)
+        for numpy in {self.__numpy, None}:
+            Columns.numpy = numpy
+            self.checkAggregates(columns)
+        with self.assertRaises(ValueError):
+            columns.remove(columns.idents[0])
+
+
+class MappedSnapshotTest(unittest.TestCase):
+    """A set of tests for the read only snapshot that is opened with mmap"""
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        self.__path = os.path.join(self.__directory, 'questionBank.map')
+        self.__collection = QuestionCollection()
+        self.__collection.add(ArithmeticQuestion('1+1', '2', ['maths', 'year7'], '10'))
+        self.__collection.add(MultipleAnswerQuestion('Pick the primes', ['a', 'c'], ['maths'], 20,
+                                                     {'a': '2', 'b': '4', 'c': '5'}))
+        self.__collection.add(TrueFalseQuestion('The sky is blue', ['a'], ['science'], 10, ['true', 'false']))
+
+    def tearDown(self):
+        shutil.rmtree(self.__directory)
+
+    def testQuestionsComeBackTheSame(self):
+        MappedSnapshot.write(self.__path, self.__collection)
+        questions, tagIndex = MappedSnapshot.open(self.__path)
+
+        self.assertEqual(len(questions), 3)
+        self.assertListEqual(list(questions), sorted(self.__collection.getQuestions()))
+        for ident, question in self.__collection.getQuestions().items():
+            self.assertEqual(type(questions[ident]), type(question))
+            self.assertDictEqual(questions[ident].__getstate__(), question.__getstate__())
+            self.assertEqual(questions[ident].fingerprint(), question.fingerprint())
+        self.assertNotIn('missing', questions)
+        self.assertEqual(len(tagIndex.find('maths')), 2)
+
+    def testBankLoadsFromTheSnapshot(self):
+        MappedSnapshot.write(self.__path, self.__collection)
+        bank = MappedSnapshotStorage(self.__path).load(QuestionCollection)
+
+        self.assertEqual(len(bank.findQuestionsByQuery('maths AND NOT year7')), 1)
+        self.assertEqual(bank.findQuestionsByText('primes')[0].question, 'Pick the primes')
+        # it can't be changed
+        with self.assertRaises(ValueError):
+            bank.add(ArithmeticQuestion('2+2', '4', ['maths'], 10))
+
+
+class TestCollectionTest(unittest.TestCase):
+    """A set of tests for the TestCollection class"""
+
+    def testAddRejectsDuplicateContent(self):
+        collection = TestCollection()
+        question = Question('1+1', '2', ['maths'], 10, 'question1')
+
+        first = Test('test1')
+        first.setName('Maths')
+        first.add(question)
+        copy = Test('test2')
+        copy.setName('Maths')
+        copy.add(question)
+
+        self.assertTrue(collection.add(first))
+        self.assertFalse(collection.add(first))
+        self.assertFalse(collection.add(copy))
+
+        copy.setName('More maths')
+        self.assertTrue(collection.add(copy))
+
+
+class TestAssemblerTest(unittest.TestCase):
+    """A set of tests for assembling tests at random to meet requirements"""
+
+    def setUp(self):
+        self.__collection = QuestionCollection()
+        for i in range(60):
+            tags = ['year9' if i % 3 else 'year8'] + (['geometry'] if i % 5 == 0 else [])
+            self.__collection.add(ArithmeticQuestion('{}+1'.format(i), str(i + 1), tags, [5, 10, 20][i % 3]))
+
+    def checkTest(self, test, questions, points):
+        found = list(test.getQuestions().values())
+        self.assertEqual(len(found), questions)
+        self.assertEqual(sum(question.getPoints() for question in found), points)
+        self.assertTrue(all('year9' in question.getTags() for question in found))
+        self.assertGreaterEqual(sum('geometry' in question.getTags() for question in found), 3)
+
+    def testAssembleMeetsRequirements(self):
+        requirements = TestRequirements(8, 100, 'year9', {'geometry': 3})
+        self.checkTest(TestAssembler(self.__collection, seed=1).assemble(requirements), 8, 100)
+
+    def testAssembleManyGivesDifferentTests(self):
+        requirements = TestRequirements(8, 100, 'year9', {'geometry': 3})
+        tests = list(TestAssembler(self.__collection, seed=1).assembleMany(requirements, 20))
+        self.assertEqual(len(tests), 20)
+        self.assertEqual(len({frozenset(test.getQuestions()) for test in tests}), 20)
+        for test in tests:
+            self.checkTest(test, 8, 100)
+
+    def testImpossibleRequirements(self):
+        # only 8 of the year 9 questions have the geometry tag
+        with self.assertRaises(ValueError):
+            TestAssembler(self.__collection).assemble(TestRequirements(10, None, 'year9', {'geometry': 9}))
+        with self.assertRaises(ValueError):
+            TestAssembler(self.__collection).assemble(TestRequirements(5, 1000))
+
+        # requirements no test could meet are turned away before any attempt is made
+        for questions, minimumTags in ((0, None), (3, {'geometry': 4})):
+            with self.assertRaises(ValueError):
+                TestRequirements(questions, 100, None, minimumTags)
+
+    def testDuplicateQuestionsAreOnlyCandidatesOnce(self):
+        # a collection given its questions directly doesn't check them for duplicates
+        questions = {'question{}'.format(i): Question('1+1', '2', ['maths'], 10, 'question{}'.format(i))
+                     for i in range(3)}
+        questions['question3'] = Question('2+2', '4', ['maths'], 10, 'question3')
+        assembler = TestAssembler(QuestionCollection(questions), seed=1)
+
+        self.assertEqual(len(assembler.assemble(TestRequirements(2)).getQuestions()), 2)
+        with self.assertRaises(ValueError):
+            assembler.assemble(TestRequirements(3))
+
+
+class TestVariantsTest(unittest.TestCase):
+    """A set of tests for the shuffled variants of a test"""
+
+    def setUp(self):
+        self.__test = Test()
+        self.__sum = ArithmeticQuestion('1+1', '2', ['maths'], 10)
+        self.__primes = MultipleAnswerQuestion('Pick the primes', ['a', 'c'], ['maths'], 20, {'a': '2', 'b': '4', 'c': '5'})
+        self.__colour = MultipleAnswerQuestion('Sky colour', ['b'], ['science'], 10, ['green', 'blue', 'red', 'pink'])
+        for question in (self.__sum, self.__primes, self.__colour):
+            self.__test.add(question)
+
+    def testVariantsAreRepeatable(self):
+        variants = TestVariants(self.__test, 7, 50)
+        self.assertEqual(len(variants), 50)
+        again = TestVariants(self.__test, 7, 50)
+        self.assertEqual(variants.orders, again.orders)
+        self.assertEqual(variants.choiceOrders, again.choiceOrders)
+        # with three questions, 50 students shouldn't all get the same order
+        self.assertGreater(len({tuple(variant.order()) for variant in variants}), 1)
+
+    def testAnswersMapBackToTheTest(self):
+        for variant in TestVariants(self.__test, 3, 20):
+            self.assertCountEqual(variant.questions(), [self.__sum, self.__primes, self.__colour])
+
+            # the student picks whichever letters the variant showed the right choices under
+            shown = dict((choice, letter) for letter, choice in variant.choices(self.__primes.ident))
+            blue = [letter for letter, choice in variant.choices(self.__colour.ident) if choice == 'blue'][0]
+            answers = variant.canonicalAnswers({self.__sum.ident: '2', self.__primes.ident: [shown['2'], shown['5']],
+                                                self.__colour.ident: blue})
+            self.assertEqual(answers[self.__sum.ident], '2')
+            self.assertCountEqual(answers[self.__primes.ident], ['a', 'c'])
+            self.assertEqual(answers[self.__colour.ident], 'b')
+
+            with self.assertRaises(ValueError):
+                variant.canonicalAnswer(self.__colour.ident, 'e')
+
+
+class ArithmeticExpressionTest(unittest.TestCase):
+    """A set of tests for working out arithmetic answers without eval"""
+
+    def testValues(self):
+        self.assertEqual(ArithmeticExpression.value('10'), 10)
+        self.assertEqual(ArithmeticExpression.value(' 10.0 '), 10)
+        self.assertEqual(ArithmeticExpression.value('20/2'), 10)
+        self.assertEqual(ArithmeticExpression.value('(3+1)×2.5'), 10)
+        self.assertEqual(ArithmeticExpression.value('-2^2 + 2^3^2'), 508)
+        self.assertEqual(ArithmeticExpression.value('1/3'), Fraction(1, 3))
+
+    def testInvalid(self):
+        for text in ('', 'ten', '1/0', '2+', '(1+2', '__import__("os")', '2^0.5', '9^99^99', '1' * 200):
+            self.assertIsNone(ArithmeticExpression.value(text), text)
+
+    def testEqual(self):
+        self.assertTrue(ArithmeticExpression.equal('10', '20/2'))
+        self.assertFalse(ArithmeticExpression.equal('1/3', '0.333'))
+        self.assertTrue(ArithmeticExpression.equal('1/3', '0.333', tolerance=0.001))
+        # answers that aren't arithmetic are compared as text
+        self.assertTrue(ArithmeticExpression.equal('x = 2', ' x = 2'))
+
+
+class BatchMarkerTest(unittest.TestCase):
+    """A set of tests for marking every student's answers to a test at once"""
+
+    def setUp(self):
+        self.__test = Test()
+        self.__sum = ArithmeticQuestion('1+1', '2', ['maths'], '10')
+        self.__primes = MultipleAnswerQuestion('Pick the primes', ['a', 'c'], ['maths'], 20, {'a': '2', 'b': '4', 'c': '5'})
+        self.__colour = MultipleAnswerQuestion('Sky colour', ['b'], ['science'], 5, ['green', 'blue', 'red'])
+        for question in (self.__sum, self.__primes, self.__colour):
+            self.__test.add(question)
+        self.__submissions = {
+            'alice': {self.__sum.ident: '4/2', self.__primes.ident: ['c', 'a'], self.__colour.ident: 'b'},
+            'bob': {self.__sum.ident: '3', self.__primes.ident: ['a'], self.__colour.ident: 'B'},
+            'carol': {self.__primes.ident: ['a', 'c', 'z']},
+        }
+        self.__numpy = Marking.numpy
+
+    def tearDown(self):
+        Marking.numpy = self.__numpy
+
+    def testEncode(self):
+        key = AnswerKey(self.__test)
+        self.assertListEqual(key.correct, [1, 0b101, 0b10])
+        self.assertListEqual(key.encode(self.__submissions['alice']), key.correct)
+        self.assertListEqual(key.encode(self.__submissions['carol']), [0, 0b101 | AnswerKey.INVALID, 0])
+
+        # however many different answers are given, only CACHED masks are kept for a question
+        for number in range(AnswerKey.CACHED * 2):
+            self.assertEqual(key.encodeAnswer(1, ['a', str(number)]), 0b1 | AnswerKey.INVALID)
+            self.assertEqual(key.encodeAnswer(0, str(number)), int(number == 2))
+        self.assertIsNone(key._AnswerKey__masks[0])
+        self.assertEqual(len(key._AnswerKey__masks[1]), AnswerKey.CACHED)
+
+        # an answer of several items without choices has to match item by item, in order
+        test = Test()
+        steps = ReorderQuestion('Put in order', ['1', '2', '3'], ['maths'], 10)
+        test.add(steps)
+        key = AnswerKey(test)
+        self.assertListEqual(key.encode({steps.ident: [' 1', '2', '3']}), [1])
+        self.assertListEqual(key.encode({steps.ident: ['2', '1', '3']}), [0])
+        self.assertListEqual(key.encode({steps.ident: '1'}), [0])
+
+        # a key whose answer isn't a choice would mark every letter that isn't one right
+        test = Test()
+        test.add(MultipleAnswerQuestion('Sky colour', ['e'], ['science'], 5, ['green', 'blue', 'red']))
+        with self.assertRaises(ValueError):
+            AnswerKey(test)
+
+    def testMark(self):
+        # with numpy if it's installed, and always in plain Python
+        for numpy in {self.__numpy, None}:
+            Marking.numpy = numpy
+            batch = BatchMarker(self.__test).mark(self.__submissions)
+            self.assertDictEqual(batch.results(), {'alice': 35, 'bob': 5, 'carol': 0})
+            self.assertListEqual(list(batch.rightCounts), [1, 1, 2])
+            self.assertEqual(batch.score('bob'), 5)
+
+    def testPartialCredit(self):
+        # bob picked one of the two primes, carol picked both and a letter that isn't a choice
+        for numpy in {self.__numpy, None}:
+            Marking.numpy = numpy
+            batch = BatchMarker(self.__test, CreditRule.perCorrectChoice()).mark(self.__submissions)
+            self.assertDictEqual(batch.results(), {'alice': 35, 'bob': 15, 'carol': 20})
+            batch = BatchMarker(self.__test, CreditRule.negativeMarking(0.5)).mark(self.__submissions)
+            self.assertDictEqual(batch.results(), {'alice': 35, 'bob': 15, 'carol': 15})
+            # only the primes question loses marks for a wrong pick
+            rules = {self.__primes.ident: CreditRule.negativeMarking(2, minimum=-1)}
+            batch = BatchMarker(self.__test, rules=rules).mark(self.__submissions)
+            self.assertDictEqual(batch.results(), {'alice': 35, 'bob': 15, 'carol': 0})
+
+    def testPopcount(self):
+        self.assertEqual(CreditRule.popcount(0b1011 | AnswerKey.INVALID), 4)
+        if self.__numpy is not None:
+            self.assertListEqual(CreditRule.popcounts([0, 0b1011, AnswerKey.INVALID | 1]).tolist(), [0, 3, 2])
+
+
+class MarkingSchedulerTest(unittest.TestCase):
+    """A set of tests for marking across worker processes"""
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        self.__path = os.path.join(self.__directory, 'questionBank.map')
+        collection = QuestionCollection()
+        self.__tests = {}
+        for name in ('first', 'second'):
+            test = Test()
+            for i in range(3):
+                question = ArithmeticQuestion('{}+{}'.format(name, i), str(i), ['maths'], 10)
+                collection.add(question)
+                test.add(question)
+            self.__tests[test.ident] = test
+        MappedSnapshot.write(self.__path, collection)
+
+    def tearDown(self):
+        shutil.rmtree(self.__directory)
+
+    def testMarkAcrossWorkers(self):
+        # student n gets the first n % 4 questions of each test right
+        submissions = []
+        for n in range(20):
+            for testIdent, test in self.__tests.items():
+                idents = list(test.getQuestions())
+                submissions.append((testIdent, 'student{}'.format(n),
+                                    {ident: str(i) if i < n % 4 else 'wrong' for i, ident in enumerate(idents)}))
+
+        reported = []
+        scheduler = MarkingScheduler(self.__path, workers=2, chunkSize=3, tests=self.__tests)
+        batches = scheduler.markAll(submissions, lambda *args: reported.append(args))
+
+        for testIdent in self.__tests:
+            results = batches[testIdent].results()
+            self.assertEqual(len(results), 20)
+            self.assertEqual(results['student7'], 30)
+            self.assertEqual(results['student5'], 10)
+            self.assertListEqual(scheduler.progress[testIdent], [20, 20])
+        self.assertIn((list(self.__tests)[0], 20, 20), reported)
+        # students are only counted as sent once their chunk has gone to a worker
+        self.assertTrue(all(sent % 3 == 0 or sent == 20 for testIdent, marked, sent in reported))
+
+        with self.assertRaises(ValueError):
+            MarkingScheduler(None, tests=self.__tests)
+
+    def testUnknownTest(self):
+        with self.assertRaises(ValueError):
+            list(MarkingScheduler(self.__path, workers=1, tests=self.__tests).mark([('missing', 'alice', {})]))
+
+
+class SubmissionPipelineTest(unittest.TestCase):
+    """A set of tests for marking a file of submissions"""
+
+    def setUp(self):
+        self.__directory = tempfile.mkdtemp()
+        self.__input = os.path.join(self.__directory, 'submissions.jsonl')
+        self.__results = os.path.join(self.__directory, 'results.jsonl')
+        self.__test = Test()
+        self.__sum = ArithmeticQuestion('1+1', '2', ['maths'], 10)
+        self.__colour = MultipleAnswerQuestion('Sky colour', ['b'], ['science'], 5, ['green', 'blue', 'red'])
+        self.__test.add(self.__sum)
+        self.__test.add(self.__colour)
+        self.__tests = {self.__test.ident: self.__test}
+
+        with open(self.__input, 'w') as f:
+            for n in range(10):
+                answers = {self.__sum.ident: str(n % 3), self.__colour.ident: 'b'}
+                f.write(json.dumps({'test': self.__test.ident, 'student': n, 'answers': answers}) + '\n')
+            f.write('not json\n')
+            f.write(json.dumps({'test': 'missing', 'student': 'x', 'answers': {}}) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.__directory)
+
+    def readResults(self):
+        with open(self.__results) as f:
+            return [json.loads(line) for line in f]
+
+    def testRun(self):
+        totals = SubmissionPipeline(self.__input, self.__results, tests=self.__tests, batchSize=3, queueSize=1).run()
+
+        results = self.readResults()
+        self.assertEqual(len(results), 12)
+        self.assertDictEqual(results[2], {'test': self.__test.ident, 'student': '2', 'score': 15, 'outOf': 15})
+        self.assertIn('error', results[10])
+        self.assertEqual(results[11]['error'], 'there is no test missing')
+        # students 2, 5 and 8 got the sum right
+        self.assertDictEqual(totals[self.__test.ident], {'students': 10, 'total': 80, 'highest': 15, 'lowest': 5,
+                                                         'outOf': 15})
+        self.assertEqual(totals['errors'], 2)
+
+    def testBadAnswersOnlyFailTheirOwnLines(self):
+        # a test that can't be marked, as its question's answer isn't one of its choices
+        broken = Test()
+        broken.add(MultipleAnswerQuestion('Sky colour', ['e'], ['science'], 5, ['green', 'blue', 'red']))
+        self.__tests[broken.ident] = broken
+        with open(self.__input, 'w') as f:
+            for answers in ({self.__colour.ident: {'b': True}}, {self.__colour.ident: 1}, {self.__sum.ident: '2'}):
+                f.write(json.dumps({'test': self.__test.ident, 'student': 'alice', 'answers': answers}) + '\n')
+            f.write(json.dumps({'test': broken.ident, 'student': 'bob', 'answers': {}}) + '\n')
+
+        totals = SubmissionPipeline(self.__input, self.__results, tests=self.__tests).run()
+
+        results = self.readResults()
+        self.assertEqual(len(results), 4)
+        self.assertIn('isn\'t text, a number or a list', results[0]['error'])
+        # a number isn't one of the letters, so it's wrong rather than an error
+        self.assertEqual(results[1]['score'], 0)
+        self.assertEqual(results[2]['score'], 10)
+        self.assertIn('couldn\'t be marked', results[3]['error'])
+        self.assertEqual(totals['errors'], 2)
+
+    def testResumeAfterCrash(self):
+        class Crash(Exception):
+            pass
+
+        class CrashingPipeline(SubmissionPipeline):
+            batches = 0
+
+            def write(self, batches, results):
+                for offset, batch in super().write(batches, results):
+                    yield offset, batch
+                    CrashingPipeline.batches += 1
+                    if CrashingPipeline.batches == 2:
+                        # half a batch written after the checkpoint, as if the crash happened part way through
+                        results.write(b'{"partial"')
+                        raise Crash()
+
+        with self.assertRaises(Crash):
+            CrashingPipeline(self.__input, self.__results, tests=self.__tests, batchSize=3).run()
+        with open(self.__results) as f:
+            self.assertEqual(len(f.readlines()), 7)
+
+        totals = SubmissionPipeline(self.__input, self.__results, tests=self.__tests, batchSize=3).run()
+        results = self.readResults()
+        self.assertEqual(len(results), 12)
+        self.assertListEqual([result.get('student') for result in results[:10]], [str(n) for n in range(10)])
+        self.assertEqual(totals[self.__test.ident]['students'], 10)
+        self.assertEqual(totals['errors'], 2)
+
+    def testResultsShorterThanTheCheckpoint(self):
+        SubmissionPipeline(self.__input, self.__results, tests=self.__tests, batchSize=3).run()
+        with open(self.__results, 'r+b') as f:
+            f.truncate(10)
+
+        # carrying on would fill the missing results with zeros
+        with self.assertRaises(CorruptStorageError):
+            SubmissionPipeline(self.__input, self.__results, tests=self.__tests, batchSize=3).run()
+        with open(self.__results, 'rb') as f:
+            self.assertEqual(len(f.read()), 10)
+
+
+class StorageTestCase(unittest.TestCase):
+    """Base for the tests of storing the banks, which points them at storages in a temporary directory
+    so we don't touch any real data"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.__storages = QuestionBank.storage, TestBank.storage
+        QuestionBank.storage, TestBank.storage = self.createStorages()
+        QuestionBank._QuestionBank__instance = None
+        TestBank._TestBank__instance = None
+
+    def tearDown(self):
+        QuestionBank._QuestionBank__instance = None
+        TestBank._TestBank__instance = None
+        QuestionBank.storage, TestBank.storage = self.__storages
+        shutil.rmtree(self.directory)
+
+    def createStorages(self):
+        """Returns the storages for the QuestionBank and the TestBank"""
+        return JournalStorage(self.path('questionBank.txt')), PickleStorage(self.path('testBank.txt'))
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+
+class QuestionReferencesTest(StorageTestCase):
+    """A set of tests for storing a Test's questions by reference to the QuestionBank"""
+
+    def setUp(self):
+        super().setUp()
+        self.__question = Question('1+1', '2', ['maths'], 10, 'question1')
+        QuestionBank.getInstance().add(self.__question)
+
+    def testPickledTestOnlyReferencesBankQuestions(self):
+        test = Test('test1')
+        test.add(self.__question)
+        loose = Question('2+2', '4', ['maths'], 10, 'question2')
+        test.add(loose)
+
+        loaded = pickle.loads(pickle.dumps(test))
+
+        # the bank's question is shared rather than copied, so changes to it reach the test
+        self.assertIs(loaded.getQuestions()['question1'], self.__question)
+        QuestionBank.getInstance().setTags('question1', ['arithmetic'])
+        self.assertListEqual(loaded.getQuestions()['question1'].getTags(), ['arithmetic'])
+
+        # a question that isn't in the bank is pickled with the test
+        self.assertEqual(loaded.getQuestions()['question2'].question, '2+2')
+
+    def testTestsKeepQuestionsRemovedFromTheBank(self):
+        test = Test('test1')
+        test.add(self.__question)
+        # only the ident is kept until the question is needed
+        test = pickle.loads(pickle.dumps(test))
+        TestBank.getInstance().add(test)
+
+        QuestionBank.getInstance().remove('question1')
+        self.assertEqual(test.getQuestions()['question1'].question, '1+1')
+        self.assertListEqual(AnswerKey(test).manual, ['question1'])
+
+        # and the saved test has its own copy now the bank doesn't
+        TestBank.getInstance().flush()
+        TestBank._TestBank__instance = None
+        loaded = TestBank.getInstance().getTests()['test1']
+        self.assertEqual([question.question for question in loaded.questions], ['1+1'])
+
+
+class JournalStorageTest(StorageTestCase):
+    """A set of tests for the journaled QuestionBank storage"""
+
+    def createStorages(self):
+        return JournalStorage(self.path('questionBank.txt'), compactEvery=3), PickleStorage(self.path('testBank.txt'))
+
+    def testSaveOnlyAppendsToLog(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        bank.add(Question('1+1', '2', ['maths'], 10, 'question1'))
+        bank.save()
+        bank.flush()
+
+        # no snapshot is written until the log is compacted
+        self.assertFalse(os.path.exists(QuestionBank.storage.path))
+        self.assertTrue(os.path.exists(QuestionBank.storage.logPath))
+
+    def testLoadReplaysLogOnTopOfSnapshot(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        for i in range(4):
+            bank.add(Question('question {}'.format(i), 'answer', ['maths'], 10, 'question{}'.format(i)))
+            bank.save()
+            bank.flush()
+        bank.remove('question0')
+        bank.save()
+        bank.flush()
+
+        # the first three saves were compacted into the snapshot, the rest are still in the log
+        self.assertTrue(os.path.exists(QuestionBank.storage.path))
+
+        loaded = JournalStorage(QuestionBank.storage.path).load(QuestionBank)
+        self.assertListEqual(sorted(loaded.getQuestions()), ['question1', 'question2', 'question3'])
+
+    def testRemovingTheLastQuestionIsSaved(self):
+        bank = QuestionBank.getInstance()
+        bank.add(Question('1+1', '2', ['maths'], 10, 'question1'))
+        bank.save()
+        bank.flush()
+
+        # an empty bank is still the bank, rather than a reason to load it again
+        bank.remove('question1')
+        self.assertIs(QuestionBank.getInstance(), bank)
+
+        # and loading again before a save keeps the removal that hasn't been written yet
+        QuestionBank._QuestionBank__instance = None
+        self.assertEqual(len(QuestionBank.getInstance()), 0)
+        QuestionBank.getInstance().save()
+        QuestionBank.getInstance().flush()
+        QuestionBank._QuestionBank__instance = None
+
+        self.assertEqual(len(JournalStorage(QuestionBank.storage.path).load(QuestionBank)), 0)
+
+    def testTornRecordAtEndOfLogIsDropped(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        bank.add(Question('1+1', '2', ['maths'], 10, 'question1'))
+        bank.save()
+        bank.flush()
+
+        # a crash part way through appending the next record
+        with open(QuestionBank.storage.logPath, 'ab') as log:
+            log.write(b'\x40\x00\x00\x00\x00')
+
+        size = os.path.getsize(QuestionBank.storage.logPath)
+        loaded = QuestionBank.storage.load(QuestionBank)
+        self.assertListEqual(list(loaded.getQuestions()), ['question1'])
+
+        # loading leaves the log alone, and the torn record is cut off by the next save
+        self.assertEqual(os.path.getsize(QuestionBank.storage.logPath), size)
+        loaded.add(Question('2+2', '4', ['maths'], 10, 'question2'))
+        QuestionBank.storage.save(loaded)
+        loaded = JournalStorage(QuestionBank.storage.path).load(QuestionBank)
+        self.assertListEqual(sorted(loaded.getQuestions()), ['question1', 'question2'])
+
+    def testBadLengthBeforeTheEndOfLogIsCorruption(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        bank.add(Question('1+1', '2', ['maths'], 10, 'question1'))
+        QuestionBank.storage.save(bank)
+        bank.add(Question('2+2', '4', ['maths'], 10, 'question2'))
+        QuestionBank.storage.save(bank)
+
+        # the first record's length runs past the end of the log, but there's a good record after it
+        with open(QuestionBank.storage.logPath, 'r+b') as log:
+            log.write(b'\xff\xff\xff\x00')
+        size = os.path.getsize(QuestionBank.storage.logPath)
+
+        with self.assertRaises(CorruptStorageError):
+            JournalStorage(QuestionBank.storage.path).load(QuestionBank)
+        self.assertEqual(os.path.getsize(QuestionBank.storage.logPath), size)
+
+    def testFailedSaveKeepsRecordsForTheNextOne(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        bank.add(Question('1+1', '2', ['maths'], 10, 'question1'))
+        # the log can't be opened while something else is in its place
+        os.makedirs(QuestionBank.storage.logPath)
+        with self.assertRaises(OSError):
+            QuestionBank.storage.save(bank)
+        os.rmdir(QuestionBank.storage.logPath)
+
+        bank.add(Question('2+2', '4', ['maths'], 10, 'question2'))
+        QuestionBank.storage.save(bank)
+
+        loaded = JournalStorage(QuestionBank.storage.path).load(QuestionBank)
+        self.assertListEqual(sorted(loaded.getQuestions()), ['question1', 'question2'])
+
+    def testCorruptSnapshotIsNotReplacedWithAnEmptyBank(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        for i in range(3):
+            bank.add(Question('question {}'.format(i), 'answer', ['maths'], 10, 'question{}'.format(i)))
+        bank.save()
+        bank.flush()
+
+        with open(QuestionBank.storage.path, 'r+b') as snapshot:
+            snapshot.seek(-10, os.SEEK_END)
+            snapshot.write(b'corrupted!')
+
+        with self.assertRaises(CorruptStorageError):
+            JournalStorage(QuestionBank.storage.path).load(QuestionBank)
+
+
+class IndexedJournalStorageTest(StorageTestCase):
+    """A set of tests for loading the QuestionBank lazily from an indexed snapshot"""
+
+    def createStorages(self):
+        return (IndexedJournalStorage(self.path('questionBank.txt'), compactEvery=2),
+                PickleStorage(self.path('testBank.txt')))
+
+    def testQuestionsAreLoadedWhenFirstNeeded(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        bank.add(Question('1+1', '2', ['maths'], 10, 'question1'))
+        bank.add(Question('Capital of France?', 'Paris', ['geography'], 10, 'question2'))
+        bank.save()
+        bank.flush()
+
+        bank = IndexedJournalStorage(QuestionBank.storage.path).load(QuestionBank)
+        questions = bank.getQuestions()
+        self.assertListEqual(list(questions), ['question1', 'question2'])
+
+        # nothing has been unpickled yet, but the tag index is already there
+        self.assertIsNotNone(questions.getRecord('question1'))
+        self.assertIsNotNone(questions.getRecord('question2'))
+        self.assertListEqual([q.question for q in bank.findQuestionsByTag('geography')], ['Capital of France?'])
+        self.assertIsNotNone(questions.getRecord('question1'))
+        self.assertIsNone(questions.getRecord('question2'))
+
+        # duplicates are still caught from the stored fingerprints
+        self.assertFalse(bank.add(Question('1+1', '2', ['maths'], 10, 'question3')))
+
+    def testLogIsCompactedEveryCompactEveryRecords(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        for number in range(1, 4):
+            bank.add(Question('{0}+{0}'.format(number), str(number * 2), ['maths'], 10, 'question{}'.format(number)))
+            bank.save()
+            bank.flush()
+
+        # the second save filled the log, so the first two questions went into the snapshot
+        storage = IndexedJournalStorage(QuestionBank.storage.path)
+        bank = storage.load(QuestionBank)
+        questions = bank.getQuestions()
+        self.assertIsNotNone(questions.getRecord('question1'))
+        self.assertIsNotNone(questions.getRecord('question2'))
+        self.assertIsNone(questions.getRecord('question3'))
+
+        # and questions that were only loaded are copied into the next snapshot without pickling them again
+        questions['question1']
+        with mock.patch.object(storage.tagDictionary, 'dumps', wraps=storage.tagDictionary.dumps) as dumps:
+            storage.compact(storage.prepareSnapshot(bank))
+        self.assertListEqual([call.args[0].ident for call in dumps.call_args_list], ['question3'])
+        self.assertListEqual([q.question for q in storage.load(QuestionBank).questions], ['1+1', '2+2', '3+3'])
+
+    def testTagsAreStoredOnceInTheSnapshot(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        bank.add(Question('1+1', '2', ['maths', 'year7'], 10, 'question1'))
+        bank.add(Question('2+2', '4', ['maths', 'year7'], 10, 'question2'))
+        bank.save()
+        bank.flush()
+
+        bank = IndexedJournalStorage(QuestionBank.storage.path).load(QuestionBank)
+        questions = bank.getQuestions()
+        # the records only hold the tags' numbers
+        self.assertNotIn(b'year7', questions.getRecord('question1'))
+
+        # and every question loaded shares the same tag strings
+        first, second = questions['question1'], questions['question2']
+        self.assertListEqual(second.getTags(), ['maths', 'year7'])
+        self.assertTrue(all(a is b for a, b in zip(first.getTags(), second.getTags())))
+
+    def testTextIndexIsSavedNextToTheSnapshot(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        bank.add(Question('1+1', '2', ['maths'], 10, 'question1'))
+        bank.add(Question('Capital of France?', 'Paris', ['geography'], 10, 'question2'))
+        bank.save()
+        bank.flush()
+        self.assertTrue(os.path.exists(QuestionBank.storage.searchPath))
+
+        # the text index is read from the .search file without unpickling any questions
+        bank = IndexedJournalStorage(QuestionBank.storage.path).load(QuestionBank)
+        self.assertListEqual([q.ident for q in bank.findQuestionsByText('france')], ['question2'])
+        self.assertIsNotNone(bank.getQuestions().getRecord('question1'))
+
+        # a .search file that doesn't go with the snapshot is ignored, and the index rebuilt from the questions
+        with open(QuestionBank.storage.searchPath, 'wb') as f:
+            f.write(b'not an index')
+        bank = IndexedJournalStorage(QuestionBank.storage.path).load(QuestionBank)
+        self.assertListEqual([q.ident for q in bank.findQuestionsByText('france')], ['question2'])
+        self.assertIsNone(bank.getQuestions().getRecord('question1'))
+
+
+class BackgroundWriterTest(StorageTestCase):
+    """A set of tests for saving the banks on a background thread"""
+
+    def testSavesAreCoalesced(self):
+        writes = []
+        save = QuestionBank.storage.save
+        QuestionBank.storage.save = lambda collection: writes.append(save(collection))
+
+        bank = QuestionBank.storage.load(QuestionBank)
+        for i in range(20):
+            bank.add(Question('question {}'.format(i), 'answer', ['maths'], 10, 'question{}'.format(i)))
+            bank.save()
+
+        # nothing is waited for until flush, and then every question is on disk
+        self.assertTrue(bank.flush())
+        self.assertLess(len(writes), 20)
+        loaded = JournalStorage(QuestionBank.storage.path).load(QuestionBank)
+        self.assertEqual(len(loaded), 20)
+
+    def testFailedSaveIsRaisedOnFlush(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        # the log can't be opened for writing if there's a directory in its place
+        os.mkdir(QuestionBank.storage.logPath)
+        bank.add(Question('1+1', '2', ['maths'], 10, 'question1'))
+        bank.save()
+        with self.assertRaises(OSError):
+            bank.flush()
+
+        # the error is only raised the once, and the question is written by the next save
+        self.assertTrue(bank.flush())
+        os.rmdir(QuestionBank.storage.logPath)
+        bank.save()
+        self.assertTrue(bank.flush())
+        self.assertEqual(len(JournalStorage(QuestionBank.storage.path).load(QuestionBank)), 1)
+
+
+class QuestionImporterTest(StorageTestCase):
+    """A set of tests for bulk importing questions"""
+
+    def createStorages(self):
+        return IndexedJournalStorage(self.path('questionBank.txt')), PickleStorage(self.path('testBank.txt'))
+
+    def testCreateQuestion(self):
+        question = QuestionImporter.createQuestion({'question': '5+5', 'answer': '10', 'tags': 'maths, year7'})
+        self.assertIsInstance(question, ArithmeticQuestion)
+        self.assertListEqual(question.getTags(), ['maths', 'year7'])
+        self.assertEqual(question.getPoints(), 10)
+
+        question = QuestionImporter.createQuestion({'question': 'Is the sky blue?', 'answer': 'A', 'points': '20',
+                                                    'a': 'True', 'b': 'False', 'c': '', 'd': ''})
+        self.assertIsInstance(question, TrueFalseQuestion)
+        self.assertEqual(question.getPoints(), 20)
+
+        question = QuestionImporter.createQuestion({'question': 'Pick the even numbers', 'answer': ['a', 'c'],
+                                                    'choices': {'a': '2', 'b': '3', 'c': '4'}})
+        self.assertIsInstance(question, MultipleAnswerQuestion)
+
+        # points from JSON have to be whole numbers, not anything int() will take
+        self.assertEqual(QuestionImporter.createQuestion({'question': '5+5', 'answer': '10', 'points': 2.0})
+                         .getPoints(), 2)
+        for points in (2.5, True):
+            with self.assertRaises(ValueError):
+                QuestionImporter.createQuestion({'question': '5+5', 'answer': '10', 'points': points})
+
+    def testInvalidRowsAreReported(self):
+        path = self.path('questions.csv')
+        with open(path, 'w', newline='') as f:
+            f.write('question,answer,tags,points,a,b,c,d\n')
+            f.write('5+5,10,maths,10,,,,\n')
+            f.write(',10,maths,10,,,,\n')
+            f.write('Capital of France?,e,geography,10,Paris,London,,\n')
+            f.write('2+2,4,maths,lots,,,,\n')
+            f.write('5+5,10,maths,10,,,,\n')
+
+        bank = QuestionBank.storage.load(QuestionBank)
+        report = QuestionImporter(bank, batchSize=2).importFile(path)
+
+        self.assertEqual(report.imported, 1)
+        self.assertEqual(report.duplicates, 1)
+        self.assertListEqual([lineNumber for lineNumber, message in report.errors], [3, 4, 5])
+        self.assertEqual(len(IndexedJournalStorage(QuestionBank.storage.path).load(QuestionBank)), 1)
+
+
+class SqliteStorageTest(StorageTestCase):
+    """A set of tests for the SQLite storage of the question and test banks"""
+
+    def createStorages(self):
+        return SqliteQuestionStorage(self.path('bank.db')), SqliteTestStorage(self.path('bank.db'))
+
+    def tearDown(self):
+        QuestionBank.storage.close()
+        TestBank.storage.close()
+        super().tearDown()
+
+    def testQuestionsAreFoundByTagAfterReload(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        bank.add(Question('1+1', '2', ['maths', 'year7'], 10, 'question1'))
+        bank.add(Question('Capital of France?', 'Paris', ['geography'], 10, 'question2'))
+        bank.save()
+        bank.flush()
+        QuestionBank.storage.close()
+
+        bank = QuestionBank.storage.load(QuestionBank)
+        self.assertEqual(len(bank), 2)
+        self.assertListEqual([q.ident for q in bank.findQuestionsByTag('maths')], ['question1'])
+        self.assertEqual(bank.getQuestions()['question2'].question, 'Capital of France?')
+
+        # queries are answered by the database
+        self.assertListEqual([q.ident for q in bank.findQuestionsByQuery('maths AND NOT year7')], [])
+        self.assertListEqual([q.ident for q in bank.findQuestionsByQuery('NOT year7 OR maths')],
+                             ['question1', 'question2'])
+        self.assertListEqual([q.ident for q in bank.findQuestionsByText('"capital of" paris')], ['question2'])
+        self.assertListEqual(bank.completeTags('Y'), ['year7'])
+        self.assertListEqual(bank.completeTags('%'), [])
+
+        bank.remove('question2')
+        self.assertListEqual(bank.findQuestionsByText('capital'), [])
+
+    def testChangesMadeInPlaceAreWrittenOnSave(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        question = Question('1+1', '2', ['maths'], 10, 'question1')
+        bank.add(question)
+        question.setTags(['arithmetic'])
+        bank.save()
+        bank.flush()
+
+        self.assertListEqual(bank.findQuestionsByTag('maths'), [])
+        self.assertListEqual(bank.findQuestionsByTag('arithmetic'), [question])
+
+    def testSaveOnlyWritesStagedQuestions(self):
+        bank = QuestionBank.storage.load(QuestionBank)
+        for i in range(50):
+            bank.add(Question('{}+1'.format(i), str(i + 1), ['maths'], 10, 'question{}'.format(i)))
+        bank.save()
+        bank.flush()
+
+        # the database answers searches, so the bank doesn't index the questions itself
+        self.assertIsNone(bank._QuestionCollection__tagIndex)
+        self.assertIsNone(bank._QuestionCollection__textIndex)
+
+        # every question is loaded, but only the one added since is pickled again
+        for question in bank.questions:
+            self.assertEqual(question.getPoints(), 10)
+        bank.add(Question('Capital of France?', 'Paris', ['geography'], 10, 'question50'))
+        with mock.patch('pickle.dumps', wraps=pickle.dumps) as dumps:
+            QuestionBank.storage.save(bank)
+        self.assertEqual(dumps.call_count, 1)
+
+    def testTestsAreStored(self):
+        test = Test('test1')
+        test.setName('A test')
+        test.add(Question('1+1', '2', ['maths'], 10, 'question1'))
+
+        bank = TestBank.storage.load(TestBank)
+        self.assertTrue(bank.add(test))
+        self.assertFalse(bank.add(test))
+        bank.save()
+        bank.flush()
+        TestBank.storage.close()
+
+        bank = TestBank.storage.load(TestBank)
+        self.assertEqual(bank.getTests()['test1'].getName(), 'A test')
+        self.assertListEqual(list(bank.getTests()['test1'].getQuestions()), ['question1'])
 
 
 if __name__ == '__main__':